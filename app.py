@@ -1,14 +1,36 @@
-from flask import Flask, url_for
+from flask import Flask, request, url_for
 from config import Config
+from services.scheduler import current_tenant
+from services.usage import current_paper
+from utils.logs import configure_logging, current_task, new_id
+
+# Before the routes are imported, so what their services log while starting up goes through it too
+configure_logging({'tenant': current_tenant, 'paper_id': current_paper})
+
 from routes.api import api_bp
 from routes.views import views_bp
+from routes.metrics import metrics_bp
+from routes.admin import admin_bp
+from routes.gateway import gateway_bp
+from routes.health import health_bp
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+
+@app.before_request
+def assign_task_id():
+    # Records logged for the request carry the caller's X-Request-ID, or an id of its own
+    current_task.set(request.headers.get('X-Request-ID', '')[:64] or new_id())
+
+
 # Register blueprints
 app.register_blueprint(views_bp)
 app.register_blueprint(api_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp)
+app.register_blueprint(health_bp)
+app.register_blueprint(admin_bp, url_prefix='/admin')
+app.register_blueprint(gateway_bp, url_prefix='/v1')
 
 # if __name__ == '__main__':
 #     app.run(debug=True)
@@ -0,0 +1,254 @@
+# ASGI entry point: uvicorn asgi:app --host 0.0.0.0 --port 7860
+#
+# /api/stream, /api/models and /api/download run on the event loop; every
+# other route goes to the Flask app through uvicorn's WSGI bridge. Both
+# share the same services, config and state, so the worker behaves like a
+# gunicorn one apart from how it waits. With --workers N the workers pool
+# their metrics in one directory per supervisor, as under gunicorn.
+import io
+import os
+import sys
+import json
+import asyncio
+import logging
+import tempfile
+import mimetypes
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from typing import Callable, Dict, List, Tuple
+
+# uvicorn spawns each of several workers from its supervisor; they must share a metrics
+# directory, set before prometheus_client is imported, or /metrics shows one process only
+_supervisor = multiprocessing.parent_process()
+if _supervisor is not None:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                          os.path.join(tempfile.gettempdir(), f"research_metrics_{_supervisor.pid}"))
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import multiprocess
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from werkzeug.utils import secure_filename
+from app import app as flask_app
+from config import Config
+from routes import api, health
+from services import metrics
+from services.admission import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SSE_HEADERS = [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]
+
+
+def wsgi_environ(scope: Dict) -> Dict:
+    """A body-less WSGI environ for the request, so Flask's session and helpers work unchanged"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def request_header(scope: Dict, name: bytes) -> str:
+    return ','.join(value.decode('latin-1') for key, value in scope['headers'] if key == name)
+
+
+async def send_response(send: Callable, status: int, headers: List[Tuple[bytes, bytes]], body: bytes = b'') -> None:
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_flask_response(send: Callable, response) -> None:
+    headers = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]
+    await send_response(send, response.status_code, headers, response.get_data())
+
+
+async def wait_for_disconnect(receive: Callable, disconnected: asyncio.Event) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+class ResearchApp:
+    """The ASGI application.
+
+    A queued /api/stream waits for admission on the event loop, so idle
+    streams cost a coroutine rather than a thread or greenlet. Once
+    admitted, the paper is written by the same generator as under WSGI,
+    stepped on a pool sized to the admission limit; provider calls keep
+    going through the shared scheduler, pools and quality gate, all of
+    which are thread-based.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.fallback = WSGIMiddleware(wsgi_app)
+        # Admitted generations each hold a thread; a few more cover the short first steps of queued ones
+        self.generations = ThreadPoolExecutor(Config.ADMISSION_MAX_PER_WORKER + 4, thread_name_prefix='generation')
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            path = scope['path']
+            if path == '/api/stream' and scope['method'] == 'GET':
+                return await self.stream(scope, receive, send)
+            if path == '/api/models':
+                return await self.models(scope, send)
+            if path.startswith('/api/download/'):
+                return await self.download(scope, send)
+            if path in ('/healthz', '/readyz'):
+                # Probes must not queue behind busy WSGI threads
+                return await self.probe(path, send)
+        await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                api.warmup.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.generations.shutdown(wait=False)
+                if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+                    # Drop this worker's live gauges; gunicorn's child_exit does it there
+                    multiprocess.mark_process_dead(os.getpid())
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def in_request(self, scope: Dict, func: Callable):
+        """Run func on a worker thread inside a Flask request context for this request"""
+        environ = wsgi_environ(scope)
+
+        def run():
+            with self.wsgi_app.request_context(environ):
+                return func()
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    async def stream(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        def open_generation():
+            generation, error = api.open_generation()
+            return generation, (self.wsgi_app.make_response(error) if error is not None else None)
+
+        generation, error = await self.in_request(scope, open_generation)
+        if error is not None:
+            return await send_flask_response(send, error)
+
+        job, ticket = generation['job'], generation['ticket']
+        events = metrics.track_generation(api.paper_events(**generation), job)
+        # Every step runs in this one context, so the tenant and paper set by the generator stick
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(wait_for_disconnect(receive, disconnected))
+
+        async def step():
+            return await loop.run_in_executor(self.generations, context.run, next, events, None)
+
+        async def emit(event: str) -> None:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            await emit(await step())  # The task id
+            if generation['params'].get('subject', '').strip():
+                try:
+                    async for position in ticket.wait_async():
+                        if disconnected.is_set():
+                            return
+                        await emit(api.queued_event(job, position))
+                except AdmissionRejected as e:
+                    await emit(api.rejected_event(job, e))
+                    return
+            # Admitted: the generator's own wait returns at once
+            while not disconnected.is_set():
+                event = await step()
+                if event is None:
+                    break
+                await emit(event)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            try:
+                await loop.run_in_executor(None, context.run, events.close)
+            except (ValueError, RuntimeError) as e:
+                # Still running on its thread, e.g. on shutdown; its own finally cleans up
+                logger.warning("Could not close generation %s: %s", generation['task_id'], e)
+            api.close_generation(generation)
+
+    async def probe(self, path: str, send: Callable) -> None:
+        status, body = (200, {'status': 'ok'}) if path == '/healthz' else health.readiness()
+        await send_response(send, status, [(b'content-type', b'application/json')], json.dumps(body).encode('utf-8'))
+
+    async def models(self, scope: Dict, send: Callable) -> None:
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, api.model_catalog.snapshot)
+        etag = f'"{snapshot.etag}"'
+        headers = [(b'etag', etag.encode('latin-1')), (b'cache-control', b'no-cache')]
+        if etag in request_header(scope, b'if-none-match'):
+            return await send_response(send, 304, headers)
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(snapshot.body)).encode())]
+        await send_response(send, 200, headers, snapshot.body if scope['method'] == 'GET' else b'')
+
+    async def download(self, scope: Dict, send: Callable) -> None:
+        loop = asyncio.get_running_loop()
+        filename = secure_filename(scope['path'][len('/api/download/'):])
+        path = os.path.join(Config.UPLOAD_FOLDER, filename)
+        try:
+            if not filename:
+                raise FileNotFoundError(path)
+            stat = await loop.run_in_executor(None, os.stat, path)
+        except OSError:
+            body = json.dumps({'error': 'File not found'}).encode('utf-8')
+            return await send_response(send, 404, [(b'content-type', b'application/json')], body)
+
+        etag = f'"{int(stat.st_mtime)}-{stat.st_size}"'
+        headers = [
+            (b'etag', etag.encode('latin-1')),
+            (b'last-modified', formatdate(stat.st_mtime, usegmt=True).encode('latin-1')),
+            (b'cache-control', b'no-cache')
+        ]
+        if etag in request_header(scope, b'if-none-match'):
+            return await send_response(send, 304, headers)
+        headers += [
+            (b'content-type', (mimetypes.guess_type(filename)[0] or 'application/octet-stream').encode('latin-1')),
+            (b'content-length', str(stat.st_size).encode('latin-1')),
+            (b'content-disposition', f"attachment; filename={filename}".encode('latin-1'))
+        ]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        if scope['method'] == 'HEAD':
+            return await send({'type': 'http.response.body', 'body': b''})
+        f = await loop.run_in_executor(None, open, path, 'rb')
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+                if not chunk:
+                    break
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+
+app = ResearchApp(flask_app)
@@ -10,34 +10,195 @@ class Config:
     MAX_RETRIES = 3
     INITIAL_DELAY = 1
     BACKOFF_FACTOR = 2
-    AI_PROVIDER = os.getenv('AI_PROVIDER', 'g4f')  # Options: g4f, huggingface, together, openai
+    AI_PROVIDER = os.getenv('AI_PROVIDER', 'g4f')  # Options: g4f, g4f-api, huggingface, together, openai, replay
+    DEFAULT_MODELS = ['gpt-4o', 'gpt-4', 'gpt-3.5-turbo']
+
+    # Model catalog (shared across workers through a file in the cache directory)
+    CACHE_FOLDER = os.getenv('CACHE_FOLDER', os.path.join(UPLOAD_FOLDER, '.cache'))
+    MODEL_CACHE_TTL = int(os.getenv('MODEL_CACHE_TTL', 3600))
+    MODEL_CATALOG_PATH = os.path.join(CACHE_FOLDER, 'model_catalog.json')
+    MODEL_CATALOG_REFRESH_INTERVAL = int(os.getenv('MODEL_CATALOG_REFRESH_INTERVAL', 300))
+
+    # Admission control for /api/stream
+    ADMISSION_MAX_PER_WORKER = int(os.getenv('ADMISSION_MAX_PER_WORKER', 4))
+    ADMISSION_MAX_GLOBAL = int(os.getenv('ADMISSION_MAX_GLOBAL', 10))
+    ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 20))  # Per worker
+    ADMISSION_MAX_WAIT = int(os.getenv('ADMISSION_MAX_WAIT', 300))  # Seconds in queue before giving up
+    ADMISSION_POLL_INTERVAL = 1.0
+    ADMISSION_DEFAULT_DURATION = 180  # Assumed seconds per paper until real ones are observed
+    ADMISSION_SLOT_DIR = os.path.join(CACHE_FOLDER, 'admission')
+
+    # Fair scheduling of provider calls between tenants
+    SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', 8))  # Per worker
+    SCHEDULER_TENANT_CONCURRENCY = int(os.getenv('SCHEDULER_TENANT_CONCURRENCY', 2))  # Per worker
+    SCHEDULER_DAILY_TOKEN_QUOTA = int(os.getenv('SCHEDULER_DAILY_TOKEN_QUOTA', 0))  # 0 disables quotas
+    # e.g. "default=1,key:3f2a9c0d1e2b=0.25"
+    SCHEDULER_TENANT_WEIGHTS = {
+        tenant.strip(): float(weight)
+        for tenant, weight in (item.rsplit('=', 1) for item in os.getenv('SCHEDULER_TENANT_WEIGHTS', '').split(',') if '=' in item)
+    }
+    USAGE_DB_PATH = os.path.join(CACHE_FOLDER, 'usage.sqlite3')
+    # Callers are told apart by API key only for these keys (the gateway's count too), else by session or IP
+    TENANT_API_KEYS = [key.strip() for key in os.getenv('TENANT_API_KEYS', '').split(',') if key.strip()]
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 0))  # Proxies of ours adding X-Forwarded-For
+
+    # Near-duplicate subject detection for reusing earlier papers
+    SIMILARITY_DIR = os.path.join(CACHE_FOLDER, 'similarity')
+    SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.8))
+    SIMILARITY_NUM_PERM = 64
+    SIMILARITY_BANDS = 16
+
+    # Full-text archive of generated papers (/api/archive/search); python -m services.archive reindex catches up
+    ARCHIVE_DB_PATH = os.path.join(CACHE_FOLDER, 'archive.sqlite3')
+    ARCHIVE_SNIPPET_TOKENS = 24
+    ARCHIVE_SEARCH_MAX_RESULTS = 50
+
+    # References are generated once per paper as CSL-JSON and formatted locally in any citation style
+    REFERENCES_DIR = os.path.join(CACHE_FOLDER, 'references')
+    REFERENCES_COUNT = int(os.getenv('REFERENCES_COUNT', 10))
+    CITATION_STYLE = os.getenv('CITATION_STYLE', 'APA')  # When the request names none
+
+    # Rolling context injected into section prompts
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 400))
+    CONTEXT_SECTION_TOKENS = int(os.getenv('CONTEXT_SECTION_TOKENS', 80))  # Newest section's summary
+
+    # USD per million (input, output) tokens; e.g. "gpt-4o=2.5/10,gpt-4o-mini=0.15/0.6"
+    MODEL_PRICING = {
+        'gpt-4o': (2.5, 10.0),
+        'gpt-4o-mini': (0.15, 0.6),
+        'gpt-4': (30.0, 60.0),
+        'gpt-3.5-turbo': (0.5, 1.5),
+        **{
+            model.strip(): tuple(float(price) for price in prices.split('/', 1))
+            for model, prices in (item.rsplit('=', 1) for item in os.getenv('MODEL_PRICING', '').split(',') if '=' in item)
+        }
+    }
+    # Cost/latency-aware routing of cheap sections; disabled while no fast models are listed
+    ROUTING_FAST_MODELS = [m.strip() for m in os.getenv('ROUTING_FAST_MODELS', '').split(',') if m.strip()]
+    ROUTING_CHEAP_SECTIONS = [s.strip() for s in os.getenv('ROUTING_CHEAP_SECTIONS', 'index,conclusion,references').split(',') if s.strip()]
+    ROUTING_EXPECTED_TOKENS = int(os.getenv('ROUTING_EXPECTED_TOKENS', 600))  # Typical section length
+    ROUTING_DEFAULT_LATENCY = 30.0  # Assumed seconds per call for models not observed yet
+    ROUTING_COST_WEIGHT = float(os.getenv('ROUTING_COST_WEIGHT', 1000))  # Seconds one USD is worth
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+    # Logging: records are queued and written by a background thread, as JSON lines by default
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json or text
+    # e.g. "services.model_provider=0.1,services.pool=0.5"; only records below WARNING are sampled
+    LOG_SAMPLE_RATES = {
+        name.strip(): float(rate)
+        for name, rate in (item.rsplit('=', 1) for item in os.getenv('LOG_SAMPLE_RATES', '').split(',') if '=' in item)
+    }
+    LOG_DEDUP_WINDOW = float(os.getenv('LOG_DEDUP_WINDOW', 10))  # Seconds identical records are suppressed, 0 disables
+    LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped rather than making the caller wait
+
+    # Provider cassettes: CASSETTE_RECORD=true records every call; AI_PROVIDER=replay plays them back
+    CASSETTE_DIR = os.getenv('CASSETTE_DIR', os.path.join(UPLOAD_FOLDER, 'cassettes'))
+    CASSETTE_RECORD = os.getenv('CASSETTE_RECORD', 'false').lower() == 'true'
+
+    # Response quality gate; rejected responses are re-dispatched to the fallback models
+    QUALITY_MIN_CHARS = int(os.getenv('QUALITY_MIN_CHARS', 200))
+    QUALITY_MAX_REPETITION = float(os.getenv('QUALITY_MAX_REPETITION', 0.5))  # Share of repeated 6-word runs
+    # Empty: the active provider's own models, the names other providers use being invalid there
+    QUALITY_FALLBACK_MODELS = [m.strip() for m in os.getenv('QUALITY_FALLBACK_MODELS', '').split(',') if m.strip()]
+    QUALITY_MAX_REDISPATCH = int(os.getenv('QUALITY_MAX_REDISPATCH', 2))
+
+    # Completion limits follow each section's word target; answers cut off at the limit are continued
+    SECTION_WORDS = {'introduction': 500, 'chapter': 900, 'conclusion': 400, 'references': 1200}  # Without a target
+    TOKEN_LIMIT_MARGIN = float(os.getenv('TOKEN_LIMIT_MARGIN', 1.3))  # Headroom over the target's token count
+    TOKEN_LIMIT_MIN = 256
+    TOKEN_LIMIT_MAX = int(os.getenv('TOKEN_LIMIT_MAX', 4096))
+    CONTINUATION_MAX_CALLS = int(os.getenv('CONTINUATION_MAX_CALLS', 2))  # Per response, 0 disables
+
+    # Graceful drain: in-flight papers get this long before being checkpointed for another worker
+    DRAIN_GRACE_PERIOD = int(os.getenv('DRAIN_GRACE_PERIOD', 60))
+    STATE_FOLDER = os.getenv('STATE_FOLDER', os.path.join(UPLOAD_FOLDER, '.state'))
+    STATE_RETENTION = int(os.getenv('STATE_RETENTION', 86400))  # Seconds an unclaimed checkpoint is kept
+
+    # Time budgets (/api/stream?deadline=<seconds>); the planner fits model, chapters and section length to them
+    DEADLINE_MIN_SECONDS = int(os.getenv('DEADLINE_MIN_SECONDS', 60))
+    DEADLINE_MAX_SECONDS = int(os.getenv('DEADLINE_MAX_SECONDS', 3600))
+    DEADLINE_SAFETY_FACTOR = float(os.getenv('DEADLINE_SAFETY_FACTOR', 1.2))  # Plans aim for budget / factor
+    DEADLINE_SECTION_WORDS = [int(w) for w in os.getenv('DEADLINE_SECTION_WORDS', '800,600,400,250').split(',') if w.strip()]
+    DEADLINE_FINALIZE_SECONDS = 10  # Writing the markdown file and converting it to Word
+
+    # Worker warm-up; /readyz only reports ready once it finished
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+    WARMUP_TIMEOUT = int(os.getenv('WARMUP_TIMEOUT', 120))  # Ready anyway after this many seconds
+    WARMUP_KEEPALIVE_INTERVAL = int(os.getenv('WARMUP_KEEPALIVE_INTERVAL', 30))  # Provider re-pings, 0 disables
+    WARMUP_CONNECT_TIMEOUT = 10
+
+    # Sections of a paper run as a dependency graph; SCHEDULER_TENANT_CONCURRENCY still caps provider calls
+    PIPELINE_MAX_PARALLEL = int(os.getenv('PIPELINE_MAX_PARALLEL', 4))
+    # Write the introduction while the outline is still being generated
+    PIPELINE_SPECULATE = os.getenv('PIPELINE_SPECULATE', 'true').lower() == 'true'
+    # Each chapter and the conclusion wait for the section before them, so the rolling context can tell them
+    # what was written; false writes them all at once, faster but without it. Papers with a deadline never wait
+    PIPELINE_CHAIN_SECTIONS = os.getenv('PIPELINE_CHAIN_SECTIONS', 'true').lower() == 'true'
+
+    # Progress snapshots let the job status API answer from any worker
+    PROGRESS_FOLDER = os.getenv('PROGRESS_FOLDER', os.path.join(UPLOAD_FOLDER, '.cache', 'progress'))
+    PROGRESS_SNAPSHOT_INTERVAL = float(os.getenv('PROGRESS_SNAPSHOT_INTERVAL', 2))
+    PROGRESS_KEEP_FINISHED = int(os.getenv('PROGRESS_KEEP_FINISHED', 500))  # Finished jobs kept in memory
+    PROGRESS_RETENTION = int(os.getenv('PROGRESS_RETENTION', 3600))  # Seconds snapshots are kept on disk
+    SUBSCRIBE_MAX_TASKS = int(os.getenv('SUBSCRIBE_MAX_TASKS', 200))  # Per /api/subscribe connection
+
+    # Admin profiling output (cProfile dumps, collapsed stacks, tracemalloc diffs)
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', os.path.join(UPLOAD_FOLDER, 'profiles'))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))  # Newest files kept per worker host
+    PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 60))
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.01))
     
+    # OpenAI-compatible gateway (/v1) in front of the provider layer
+    GATEWAY_API_KEYS = [key.strip() for key in os.getenv('GATEWAY_API_KEYS', '').split(',') if key.strip()]  # Empty: /v1 is disabled
+    GATEWAY_CACHE_TTL = int(os.getenv('GATEWAY_CACHE_TTL', 3600))  # 0 disables the cache of temperature-0 answers
+    GATEWAY_CACHE_PATH = os.path.join(CACHE_FOLDER, 'responses.sqlite3')
+
+    # Endpoint/key pools: <PROVIDER>_POOL="url|key|max_concurrency,..."; an empty url or key uses the provider's own
+    POOL_STRATEGY = os.getenv('POOL_STRATEGY', 'least_outstanding')  # or ewma
+    POOL_MEMBER_CONCURRENCY = int(os.getenv('POOL_MEMBER_CONCURRENCY', 0))  # Default cap per member and worker, 0 for none
+    POOL_EJECT_AFTER = int(os.getenv('POOL_EJECT_AFTER', 3))  # Consecutive failures
+    POOL_EJECT_SECONDS = int(os.getenv('POOL_EJECT_SECONDS', 30))
+    POOL_ACQUIRE_TIMEOUT = int(os.getenv('POOL_ACQUIRE_TIMEOUT', 60))
+
     AI_PROVIDER_CONFIG = {
         'g4f': {
             # g4f specific configuration
         },
         'huggingface': {
             'api_key': os.getenv('HUGGINGFACE_API_KEY'),
-            'max_tokens': 1000,
-            'temperature': 0.7
+            'api_url': os.getenv('HUGGINGFACE_API_URL', "https://api-inference.huggingface.co/models"),
+            'pool': os.getenv('HUGGINGFACE_POOL'),
+            'max_tokens': int(os.getenv('HUGGINGFACE_MAX_TOKENS', 1000)),
+            'temperature': float(os.getenv('HUGGINGFACE_TEMPERATURE', 0.7))
         },
         'together': {
             'api_key': os.getenv('TOGETHER_API_KEY'),
-            'max_tokens': 1000,
-            'temperature': 0.7
+            'api_url': os.getenv('TOGETHER_API_URL', "https://api.together.xyz/v1/completions"),
+            'pool': os.getenv('TOGETHER_POOL'),
+            'max_tokens': int(os.getenv('TOGETHER_MAX_TOKENS', 1000)),
+            'temperature': float(os.getenv('TOGETHER_TEMPERATURE', 0.7))
         },
          'openai': {
             'api_key': os.getenv('OPENAI_API_KEY'),
             'organization': os.getenv('OPENAI_ORG_ID'),
             'base_url': os.getenv('OPENAI_BASE_URL', "https://oral-una-sarr-e3334ca1.koyeb.app/v1"),  # Default OpenAI endpoint
-            'max_tokens': 1000,
-            'temperature': 0.7,
+            'pool': os.getenv('OPENAI_POOL'),
+            'max_tokens': int(os.getenv('OPENAI_MAX_TOKENS', 1000)),
+            'temperature': float(os.getenv('OPENAI_TEMPERATURE', 0.7)),
             'top_p': 0.9,
             'frequency_penalty': 0,
             'presence_penalty': 0
         },
             'g4f-api': {
             'base_url': 'https://oral-una-sarr-e3334ca1.koyeb.app/v1',
+            'api_key': os.getenv('G4F_API_KEY'),
+            'pool': os.getenv('G4F_API_POOL'),
             'default_model': 'gpt-4o-mini'
+        },
+        'replay': {
+            'cassettes': os.getenv('REPLAY_CASSETTES', CASSETTE_DIR),  # Files, directories or globs, comma separated
+            'speed': float(os.getenv('REPLAY_SPEED', 1.0)),  # 2 plays twice as fast, 0 without any delay
+            'strict': os.getenv('REPLAY_STRICT', 'false').lower() == 'true'  # Fail calls with no recorded prompt
         }
     }
\ No newline at end of file
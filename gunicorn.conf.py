@@ -0,0 +1,31 @@
+# Loaded automatically by gunicorn from the working directory
+import os
+import shutil
+import tempfile
+
+# Must be set before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'research_metrics'))
+
+# Draining workers get the drain grace period plus one provider call (g4f times out at 190s)
+# to checkpoint their papers before the master kills them
+graceful_timeout = int(os.environ.get('DRAIN_GRACE_PERIOD', 60)) + 200
+
+
+def on_starting(server):
+    """Start every deployment with an empty metrics directory"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """Warm the worker up, and drain in-flight generations once it is told to stop or recycle"""
+    from routes.api import drain, warmup
+    warmup.start()
+    drain.watch(lambda: worker.alive)
+
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,41 @@
+import os
+from flask import Blueprint, Response, jsonify, request, send_from_directory
+from werkzeug.utils import secure_filename
+from services.profiling import ProfileStore, bounded_seconds, format_collapsed, memory_diff, sample_stacks
+from utils.auth import admin_required
+
+admin_bp = Blueprint('admin', __name__)
+profiles = ProfileStore()
+
+# Each request profiles only the worker that serves it; the pid is in every file name
+
+@admin_bp.route('/profile/stacks')
+@admin_required
+def profile_stacks():
+    """Sample every thread and greenlet for ?seconds=N; returns collapsed stacks for a flamegraph"""
+    seconds = bounded_seconds(request.args.get('seconds'))
+    stacks = sample_stacks(seconds, include_idle=request.args.get('idle', '1') != '0')
+    body = format_collapsed(stacks)
+    path = profiles.write('stacks', f"{seconds:g}s", 'txt', body)
+    return Response(body, mimetype='text/plain', headers={'X-Profile-File': os.path.basename(path)})
+
+@admin_bp.route('/profile/memory')
+@admin_required
+def profile_memory():
+    """Allocation growth over ?seconds=N from tracemalloc snapshots; ?frames=N groups by traceback"""
+    seconds = bounded_seconds(request.args.get('seconds'))
+    frames = max(1, min(request.args.get('frames', 1, type=int), 25))
+    body = memory_diff(seconds, request.args.get('limit', 50, type=int), frames)
+    path = profiles.write('memory', f"{seconds:g}s", 'txt', body)
+    return Response(body, mimetype='text/plain', headers={'X-Profile-File': os.path.basename(path)})
+
+@admin_bp.route('/profiles')
+@admin_required
+def list_profiles():
+    """Profiles written so far, newest first; .prof files load with pstats or snakeviz"""
+    return jsonify({'profiles': profiles.list()})
+
+@admin_bp.route('/profiles/<filename>')
+@admin_required
+def download_profile(filename):
+    return send_from_directory(profiles.directory, secure_filename(filename), as_attachment=True)
@@ -1,5 +1,5 @@
-from typing import List, Tuple
-from flask import Blueprint, jsonify, request, Response, send_from_directory, copy_current_request_context, abort, g
+from typing import Dict, Iterator, List, Optional, Tuple
+from flask import Blueprint, jsonify, request, Response, send_from_directory, copy_current_request_context, abort, g, session
 from functools import wraps
 import time
 import json
@@ -8,15 +8,56 @@ import uuid
 import random
 from werkzeug.utils import secure_filename
 from services.model_provider import ModelProvider
+from services.model_catalog import ModelCatalog
+from services.outline import Outline, DEFAULT_CHAPTERS, parse_outline
+from services import metrics
+from services.admission import AdmissionController, AdmissionRejected
+from services.scheduler import QuotaExceeded, current_tenant, tenant_from_request
+from services.similarity import SimilarityIndex
+from services.archive import PaperArchive
+from services.references import ReferenceStore, format_references
+from services.context import PaperContext
+from services.usage import current_paper, section_kind
+from services.handoff import CheckpointStore, DrainManager, GenerationSuspended, PaperCheckpoint
+from services.pipeline import Pipeline
+from services.planner import DeadlinePlanner
+from services.profiling import profile_stream
+from services.progress import ProgressRegistry, PENDING, IN_PROGRESS, COMPLETE, ERROR
+from services.bus import EventBus
+from services.warmup import Warmup
 from services.document_generator import DocumentGenerator
 from config import Config
 from utils.retry_decorator import retry
+from utils.tokens import count_tokens
+from utils.auth import is_admin
+from utils.logs import current_task
+from routes.admin import profiles
 import threading
+import logging
+
+logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 model_provider = ModelProvider()
+model_catalog = ModelCatalog(model_provider)
+admission = AdmissionController()
+drain = DrainManager(admission)
+checkpoints = CheckpointStore()
+similarity_index = SimilarityIndex()
+archive = PaperArchive()
+reference_store = ReferenceStore()
 doc_generator = DocumentGenerator(Config.UPLOAD_FOLDER)
-_generation_tasks = {}
+bus = EventBus()
+jobs = ProgressRegistry(bus=bus)
+planner = DeadlinePlanner(model_provider.ledger, model_provider.routing, model_provider.fallback_models)
+
+# Run after the worker boots (gunicorn's post_worker_init, ASGI lifespan); /readyz waits for it
+warmup = Warmup()
+warmup.add('tokenizer', lambda: count_tokens('warm-up'))
+warmup.add('providers', lambda: model_provider.service.preconnect(), repeat=True)
+warmup.add('model_catalog', lambda: model_catalog.wait_until_ready(Config.WARMUP_TIMEOUT))
+warmup.add('similarity_index', similarity_index.catch_up)
+warmup.add('pandoc', doc_generator.warm_up)
 
 def sse_stream_required(f):
     """Decorator to ensure SSE stream has request context"""
@@ -30,51 +71,38 @@ def sse_stream_required(f):
 
 def extract_chapters(index_content: str) -> List[str]:
     """Extract chapter titles from index content"""
-    chapters = []
-    for line in index_content.split('\n'):
-        if line.strip().startswith('## '):
-            chapter_title = line.strip()[3:].strip()
-            if chapter_title.lower() not in ['introduction', 'conclusion', 'references']:
-                chapters.append(chapter_title)
-    return chapters if chapters else ["Literature Review", "Methodology", "Results and Discussion"]
+    chapters = parse_outline(index_content).chapter_titles()
+    return chapters if chapters else list(DEFAULT_CHAPTERS)
+
+def introduction_prompt(research_subject: str, word_count: str = 'auto') -> str:
+    """The introduction only needs the subject, so it can be written before the outline exists"""
+    prompt = f"Write a comprehensive introduction for a research paper about {research_subject}."
+    return f"{prompt} Target word count: {word_count} words." if word_count != 'auto' else prompt
 
 def generate_automatic_sections(model: str, research_subject: str, chapter_count: str = 'auto', 
                               word_count: str = 'auto', include_references: bool = False, 
-                              citation_style: str = None) -> List[Tuple[str, str]]:
+                              citation_style: str = None, outline: Outline = None) -> List[Tuple[str, str]]:
     """Generate sections automatically based on AI-generated index"""
     try:
-        # Generate index with specified parameters
-        index_prompt = f"Create a research paper outline about {research_subject}"
-        if chapter_count != 'auto':
-            index_prompt += f" with exactly {chapter_count} main chapters"
-        if word_count != 'auto':
-            index_prompt += f" targeting approximately {word_count} words"
-        
-        index_content = model_provider.generate_index_content(model, index_prompt)
-        chapters = extract_chapters(index_content)
-        
-        # If specific chapter count requested, adjust chapters list
-        if chapter_count != 'auto':
-            requested_count = int(chapter_count)
-            if len(chapters) > requested_count:
-                chapters = chapters[:requested_count]
-            elif len(chapters) < requested_count:
-                default_chapters = ["Literature Review", "Methodology", "Results", "Discussion"]
-                chapters.extend(default_chapters[len(chapters):requested_count])
+        # The outline is generated once and rendered locally as the index
+        if outline is None:
+            outline = model_provider.generate_outline(model, research_subject, chapter_count, word_count)
+        chapters = outline.chapters
         
         sections = [
-            ("Index", index_content),
-            ("Introduction", f"Write a comprehensive introduction for a research paper about {research_subject}. "
-                           f"{'Target word count: ' + word_count + ' words.' if word_count != 'auto' else ''}")
+            ("Index", outline.to_markdown(include_references)),
+            ("Introduction", introduction_prompt(research_subject, word_count))
         ]
         
         # Add chapter prompts
         for i, chapter in enumerate(chapters, 1):
             word_guidance = f" Target approximately {int(int(word_count) / (len(chapters) + 2)) } words." if word_count != 'auto' else ''
+            section_guidance = f" Cover these sections: {', '.join(s.title for s in chapter.children)}." if chapter.children else ''
             sections.append(
-                (f"Chapter {i}: {chapter}", 
-                 f"Write a detailed chapter about '{chapter}' for a research paper about {research_subject}. "
-                 f"Provide comprehensive coverage of this aspect, including relevant theories, examples, and analysis.{word_guidance}")
+                (f"Chapter {i}: {chapter.title}", 
+                 f"Write a detailed chapter about '{chapter.title}' for a research paper about {research_subject}. "
+                 f"Provide comprehensive coverage of this aspect, including relevant theories, examples, and analysis."
+                 f"{section_guidance}{word_guidance}")
             )
         
         sections.append(
@@ -95,409 +123,655 @@ def get_manual_sections(research_subject: str) -> List[Tuple[str, str]]:
     """Get predefined manual sections"""
     return [
         ("Index", "[Index will be generated first]"),
-        ("Introduction", f"Write a comprehensive introduction for a research paper about {research_subject}."),
+        ("Introduction", introduction_prompt(research_subject)),
         ("Chapter 1: Literature Review", f"Create a detailed literature review chapter about {research_subject}."),
         ("Chapter 2: Methodology", f"Describe the research methodology for a study about {research_subject}."),
         ("Chapter 3: Results and Discussion", f"Present hypothetical results and discussion for a research paper about {research_subject}. Analyze findings and compare with existing literature."),
         ("Conclusion", f"Write a conclusion section for a research paper about {research_subject}.")
     ]
 
-def write_research_paper(md_filename: str, research_subject: str, sections: List[Tuple[str, str]], model: str) -> None:
-    """Write the research paper to a markdown file"""
+def manual_chapter_titles(sections: List[Tuple[str, str]]) -> List[str]:
+    """Chapter titles of a manual structure, without the 'Chapter N:' prefix"""
+    return [title.split(': ', 1)[1] for title, _ in sections if title.startswith('Chapter ')]
+
+def plan_reuse(mode: str, research_subject: str, chapters: List[str], match: Optional[dict],
+               tenant: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Split the tenant's archived content into sections reused verbatim and drafts to adapt"""
+    generated, drafts = {}, {}
+    if mode not in ('full', 'adapt'):
+        return generated, drafts
+    target = generated if mode == 'full' else drafts
+    if match:
+        # The outline was reused too, so section titles line up one to one
+        target.update({title: text for title, text in match['sections'] if title != 'Index'})
+    else:
+        for i, chapter in enumerate(chapters, 1):
+            found = similarity_index.find_section(research_subject, chapter, tenant=tenant)
+            if found:
+                target[f"Chapter {i}: {chapter}"] = found[0]
+    return generated, drafts
+
+def generate_section(model: str, section_title: str, prompt: str, generated: Dict[str, str],
+                     drafts: Dict[str, str] = None, context: PaperContext = None,
+                     checkpoint: PaperCheckpoint = None, words: int = None) -> str:
+    """Generate a section once, reusing content already produced for this paper; words sizes its token limit"""
+    if section_title in generated:
+        if context:
+            context.add_section(section_title, generated[section_title])
+        return generated[section_title]
+    if checkpoint is not None and drain.expired():
+        raise GenerationSuspended(checkpoint.paper_id)
+    draft = (drafts or {}).get(section_title)
+    if draft:
+        prompt = f"{prompt}\n\nAdapt the following earlier draft to this paper instead of starting from scratch:\n\n{draft}"
+    if context:
+        prompt = context.augment(prompt)
+    content = model_provider.generate_content(model, prompt, section=section_kind(section_title), words=words)
+    generated[section_title] = content
+    if context:
+        context.add_section(section_title, content)
+    if checkpoint is not None:
+        try:
+            checkpoint.save()
+        except Exception as e:
+            logger.warning("Failed to checkpoint %s: %s", checkpoint.paper_id, e)
+    return content
+
+def write_research_paper(md_filename: str, research_subject: str, sections: List[Tuple[str, str]], model: str,
+                         generated: Dict[str, str] = None, drafts: Dict[str, str] = None,
+                         context: PaperContext = None, checkpoint: PaperCheckpoint = None,
+                         errors: Dict[str, BaseException] = None) -> List[Tuple[str, str]]:
+    """Write the research paper to a markdown file, returning the sections that were written.
+
+    Sections in errors already failed after retries and get their error
+    placeholder rather than another attempt.
+    """
+    generated = {} if generated is None else generated
+    errors = errors or {}
+    written = []
     full_path = os.path.join(Config.UPLOAD_FOLDER, md_filename)
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
     with open(full_path, "w", encoding="utf-8") as f:
         f.write(f"# Research Paper: {research_subject}\n\n")
         
         for section_title, prompt in sections:
+            if section_title in errors and section_title not in generated:
+                f.write(f"## {section_title}\n\n[Error generating this section: {str(errors[section_title])}]\n\n")
+                continue
             try:
                 if isinstance(prompt, str) and (prompt.startswith("##") or prompt.startswith("#")):
                     content = f"{prompt}\n\n"
+                    response = prompt
                 else:
-                    response = model_provider.generate_content(model, prompt)
+                    response = generate_section(model, section_title, prompt, generated, drafts, context, checkpoint)
                     content = f"## {section_title}\n\n{response}\n\n"
                 f.write(content)
+                written.append((section_title, response))
             except Exception as e:
                 f.write(f"## {section_title}\n\n[Error generating this section: {str(e)}]\n\n")
+    metrics.record_output(full_path, 'markdown')
+    return written
 
 @api_bp.route('/models')
 def get_models():
-    models = model_provider.get_available_models()
-    return jsonify(models)
+    snapshot = model_catalog.snapshot()
+    response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-@api_bp.route('/stream')
-@sse_stream_required
-def stream():
-    research_subject = request.args.get('subject', '').strip()
-    selected_model = request.args.get('model', 'gpt-4o')
-    structure_type = request.args.get('structure', 'automatic')
-    chapter_count = request.args.get('chapterCount', 'auto')
-    word_count = request.args.get('wordCount', 'auto')
-    include_references = request.args.get('includeReferences') == 'true'
-    citation_style = request.args.get('citationStyle')
+@api_bp.route('/usage')
+def get_usage():
+    """Today's token usage; admins see every tenant, others only themselves"""
+    tenant = tenant_from_request(request, session)
+    report = model_provider.scheduler.report(None if is_admin() else tenant)
+    return jsonify({
+        'tenant': tenant,
+        'quota_remaining': model_provider.scheduler.quota_remaining(tenant),
+        'tenants': report
+    })
+
+@api_bp.route('/usage/papers/<paper_id>')
+def get_paper_usage(paper_id):
+    """Tokens and cost of one paper, per model and section; only admins see other tenants' papers"""
+    report = model_provider.ledger.paper_report(secure_filename(paper_id),
+                                                None if is_admin() else tenant_from_request(request, session))
+    if not report['breakdown']:
+        return jsonify({'error': 'Paper not found'}), 404
+    return jsonify(report)
+
+@api_bp.route('/usage/models')
+def get_model_usage():
+    """Per-model tokens, cost and observed speed over the last day (admin only)"""
+    if not is_admin():
+        abort(403)
+    return jsonify({'models': model_provider.ledger.model_report()})
+
+@api_bp.route('/usage/deadlines')
+def get_deadline_usage():
+    """How well time budgets were kept over the last day, overall and per model (admin only)"""
+    if not is_admin():
+        abort(403)
+    return jsonify(model_provider.ledger.deadline_report())
+
+@api_bp.route('/archive/search')
+def search_archive():
+    """Sections of earlier papers matching ?q=, best first; only admins search other tenants' papers"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), Config.ARCHIVE_SEARCH_MAX_RESULTS))
+    return jsonify(archive.search(
+        query, limit, max(0, request.args.get('offset', 0, type=int)),
+        tenant=None if is_admin() else tenant_from_request(request, session),
+        model=request.args.get('model'), kind=request.args.get('kind'),
+        since=request.args.get('since', type=float)))
+
+@api_bp.route('/archive/papers/<paper_id>')
+def get_archived_paper(paper_id):
+    """Metadata, tokens and per-section timings of an archived paper"""
+    paper = archive.paper(secure_filename(paper_id), None if is_admin() else tenant_from_request(request, session))
+    if paper is None:
+        return jsonify({'error': 'Paper not found'}), 404
+    return jsonify(paper)
+
+@api_bp.route('/archive/reindex', methods=['POST'])
+def reindex_archive():
+    """Index new and changed papers in the output folder, ?full=1 for all of them (admin only)"""
+    if not is_admin():
+        abort(403)
+    return jsonify(archive.reindex(full=request.args.get('full') == '1'))
+
+@api_bp.route('/references/<paper_id>')
+def get_references(paper_id):
+    """A paper's references in ?style= (APA, MLA, Chicago, Harvard, IEEE), ?format=csl for the CSL-JSON"""
+    cached = reference_store.get(secure_filename(paper_id))
+    if cached is None or not (is_admin() or cached['tenant'] == tenant_from_request(request, session)):
+        return jsonify({'error': 'No references for this paper'}), 404
+    if request.args.get('format') == 'csl':
+        return jsonify(cached['items'])
+    style = request.args.get('style') or Config.CITATION_STYLE
+    try:
+        return jsonify({'paper_id': cached['paper_id'], 'style': style,
+                        'references': format_references(cached['items'], style)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@api_bp.route('/references/<paper_id>', methods=['POST'])
+def restyle_references(paper_id):
+    """Rewrite a finished paper's references in ?style= and convert it to Word again, without the model"""
+    paper_id = secure_filename(paper_id)
+    cached = reference_store.get(paper_id)
+    if cached is None or not (is_admin() or cached['tenant'] == tenant_from_request(request, session)):
+        return jsonify({'error': 'No references for this paper'}), 404
+    try:
+        references = format_references(cached['items'], request.args.get('style'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    md_filename, docx_filename = f"{paper_id}.md", f"{paper_id}.docx"
+    md_path = os.path.join(Config.UPLOAD_FOLDER, md_filename)
+    try:
+        with open(md_path, encoding='utf-8') as f:
+            markdown = f.read()
+        with open(md_path, 'w', encoding='utf-8') as f:
+            f.write(replace_references(markdown, references))
+    except OSError:
+        return jsonify({'error': 'Paper not found'}), 404
+    try:
+        archive.refresh(md_path)
+    except Exception as e:
+        logger.warning("Failed to re-archive %s: %s", paper_id, e)
+    try:
+        doc_generator.convert_to_word(md_filename, docx_filename)
+    except Exception as e:
+        return jsonify({'status': 'partial_success', 'md_file': md_filename,
+                        'message': f'References restyled but Word conversion failed: {str(e)}'})
+    return jsonify({'status': 'complete', 'md_file': md_filename, 'docx_file': docx_filename})
+
+@api_bp.route('/pool')
+def get_pool():
+    """Load, latency and ejections of this worker's provider pool members (admin only)"""
+    if not is_admin():
+        abort(403)
+    pool = model_provider.service.pool
+    return jsonify({'strategy': pool.strategy if pool else None, 'members': pool.export() if pool else []})
+
+@api_bp.route('/resumable')
+def get_resumable():
+    """Papers of this tenant that were suspended or orphaned and can be resumed"""
+    return jsonify({'papers': checkpoints.resumable(tenant_from_request(request, session))})
+
+def open_generation() -> Tuple[Optional[dict], Optional[tuple]]:
+    """Tenant, parameters, checkpoint and queue ticket of a /stream request.
+
+    Returns the arguments of paper_events, or else an error response to
+    send before any SSE stream is opened. Needs a request context.
+    """
+    tenant = tenant_from_request(request, session)
+    # ?resume=<paper_id> continues a checkpointed paper with the parameters it was started with
+    resume_id = request.args.get('resume')
+    checkpoint = checkpoints.claim(resume_id) if resume_id else None
+    if resume_id and (checkpoint is None or checkpoint.tenant != tenant):
+        if checkpoint is not None:
+            checkpoint.release()
+        return None, (jsonify({'error': 'No resumable generation with this id'}), 404)
+    params = checkpoint.params if checkpoint else request.args.to_dict()
+    if checkpoint is None and params.get('deadline'):
+        try:
+            budget = float(params['deadline'])
+        except ValueError:
+            budget = 0
+        if not Config.DEADLINE_MIN_SECONDS <= budget <= Config.DEADLINE_MAX_SECONDS:
+            return None, (jsonify({'error': f"deadline must be between {Config.DEADLINE_MIN_SECONDS} and "
+                                            f"{Config.DEADLINE_MAX_SECONDS} seconds"}), 400)
+        # Absolute, so a resumed paper still works towards the original deadline
+        params['deadline_at'] = str(time.time() + budget)
+
+    # Reject fast, before any SSE stream is opened, when over quota or even the queue is full
+    try:
+        model_provider.scheduler.check_quota(tenant)
+        ticket = admission.enqueue()
+    except QuotaExceeded as e:
+        if checkpoint is not None:
+            checkpoint.release()
+        return None, (jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)})
+    except AdmissionRejected as e:
+        if checkpoint is not None:
+            checkpoint.release()
+        return None, (jsonify({'error': str(e)}), e.status_code, {'Retry-After': str(e.retry_after)})
 
     # Generate unique task ID
     task_id = str(uuid.uuid4())
-    _generation_tasks[task_id] = {'abort': False}
+    job = jobs.create(task_id, tenant)
+    return {'task_id': task_id, 'job': job, 'tenant': tenant, 'params': params,
+            'checkpoint': checkpoint, 'ticket': ticket}, None
+
+def close_generation(generation: dict) -> None:
+    """Free the queue entry and checkpoint even if the client went away before the stream started"""
+    generation['ticket'].release()
+    generation['job'].apply('finish', outcome='disconnected')
+    if generation['checkpoint'] is not None:
+        generation['checkpoint'].release()
+
+def queued_event(job, position: int) -> str:
+    job.apply('queued', position=position)
+    return "data: " + json.dumps({"status": "queued", "queue_position": position}) + "\n\n"
+
+def rejected_event(job, e: AdmissionRejected) -> str:
+    job.apply('finish', outcome='rejected', message=str(e))
+    return "data: " + json.dumps({"error": str(e), "retry_after": e.retry_after}) + "\n\n"
+
+def paper_references(paper_id: str, tenant: str, model: str, research_subject: str,
+                     chapter_titles: List[str] = None) -> List[dict]:
+    """CSL-JSON references of a paper, from the model only the first time"""
+    cached = reference_store.get(paper_id)
+    if cached is not None:
+        return cached['items']
+    items = model_provider.generate_references(model, research_subject, chapter_titles)
+    try:
+        reference_store.put(paper_id, tenant, research_subject, items)
+    except OSError as e:
+        logger.warning("Failed to cache references of %s: %s", paper_id, e)
+    return items
+
+def replace_references(markdown: str, references: str) -> str:
+    """The paper's markdown with its references section, always the last one, swapped"""
+    head = markdown.partition('\n## References\n')[0]
+    return f"{head.rstrip()}\n\n## References\n\n{references}\n\n"
 
-    def generate():
+def deadline_status(params: dict, plan) -> dict:
+    """The deadline part of the final event, when the paper has one"""
+    if plan is None:
+        return {}
+    budget = float(params['deadline'])
+    elapsed = time.time() - (float(params['deadline_at']) - budget)
+    return {'deadline': {'budget': budget, 'elapsed': round(elapsed, 1), 'met': elapsed <= budget}}
+
+def paper_events(task_id: str, job, tenant: str, params: dict, checkpoint: Optional[PaperCheckpoint],
+                 ticket) -> Iterator[str]:
+    """The SSE events of one paper, from its queue position to the Word file"""
+    research_subject = params.get('subject', '').strip()
+    selected_model = params.get('model', 'gpt-4o')
+    structure_type = params.get('structure', 'automatic')
+    chapter_count = params.get('chapterCount', 'auto')
+    word_count = params.get('wordCount', 'auto')
+    include_references = params.get('includeReferences') == 'true'
+    citation_style = params.get('citationStyle')
+    reuse_mode = params.get('reuse', 'off')  # off, outline, adapt or full
+
+    # Provider calls made for this paper are scheduled and billed to the tenant
+    current_tenant.set(tenant)
+    current_task.set(task_id)
+    state = checkpoint
+    paper_id = None
+    plan = None
+    pipeline = None
+    try:
+        # Send task ID to client
+        yield "data: " + json.dumps({"task_id": task_id}) + "\n\n"
+
+        if not research_subject:
+            job.apply('finish', outcome='rejected', message="Research subject is required")
+            yield "data: " + json.dumps({"error": "Research subject is required"}) + "\n\n"
+            return
+
+        # Wait for a generation slot, telling the client where it stands
         try:
-            # Send task ID to client
-            yield "data: " + json.dumps({"task_id": task_id}) + "\n\n"
-
-            if not research_subject:
-                yield "data: " + json.dumps({"error": "Research subject is required"}) + "\n\n"
-                return
-            
-            # Generate filenames
+            for position in ticket.wait():
+                yield queued_event(job, position)
+        except AdmissionRejected as e:
+            yield rejected_event(job, e)
+            return
+        
+        # Generate filenames, or keep those of the paper being resumed
+        if state is None:
             md_filename, docx_filename = doc_generator.generate_filename()
-            
-            # Initial steps
-            steps = [
-                {"id": 0, "text": "Preparing document structure...", "status": "pending"},
-                {"id": 1, "text": "Generating index/table of contents...", "status": "pending"},
-                {"id": 2, "text": "Determining chapters...", "status": "pending"},
-                {"id": 3, "text": "Writing content...", "status": "pending", "subSteps": []},
-                {"id": 4, "text": "Finalizing document...", "status": "pending"},
-                {"id": 5, "text": "Converting to Word format...", "status": "pending"}
-            ]
-            
-            # Initial progress update
-            yield "data: " + json.dumps({"steps": steps, "progress": 0}) + "\n\n"
-            
-            # Step 0: Prepare
-            steps[0]["status"] = "in-progress"
-            yield "data: " + json.dumps({
-                "steps": steps,
-                "progress": 0,
-                "current_step": 0
-            }) + "\n\n"
-            
-            sections = []
-            chapter_steps = []
-            
-            if structure_type == 'automatic':
+            state = checkpoints.create(os.path.splitext(md_filename)[0], params, tenant,
+                                       md_filename, docx_filename)
+        md_filename, docx_filename = state.md_filename, state.docx_filename
+        paper_id = state.paper_id
+        current_paper.set(paper_id)
+        job.apply('started', paper_id=paper_id)
+        
+        # Initial progress update
+        yield job.event()
+        
+        # Step 0: Prepare
+        job.apply('step', index=0, status=IN_PROGRESS)
+        yield job.event()
+
+        if params.get('deadline_at'):
+            # The time left after queueing decides the model, structure and concurrency
+            plan = planner.plan(float(params['deadline_at']), selected_model, chapter_count, word_count,
+                                include_references)
+            chapter_count, word_count = str(plan.chapters), str(plan.words * plan.sections)
+            planned_words = plan.words
+            yield "data: " + json.dumps({"plan": plan.to_dict()}) + "\n\n"
+
+        def model():
+            return plan.model if plan is not None else selected_model
+        
+        outline = state.outline
+        reused = None
+        generated, drafts = state.generated, state.drafts
+        context = PaperContext(research_subject, outline)
+        sections = []
+        chapters = []  # Node names of the chapters, in order
+        prompts = {}
+        planned = False
+        failed = None
+        aborted = False
+        automatic = structure_type == 'automatic'
+        # Archived sections may stand in for the introduction, so only speculate when nothing is reused
+        speculate = Config.PIPELINE_SPECULATE and reuse_mode in ('off', 'outline')
+
+        def plan_outline(inputs):
+            """Outline and section prompts, falling back to the manual structure"""
+            fallback = None
+            if automatic:
                 try:
-                    # Step 1: Generate index
-                    steps[1]["status"] = "in-progress"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 10,
-                        "current_step": 1
-                    }) + "\n\n"
-                    
-                    sections = generate_automatic_sections(
-                        selected_model, 
-                        research_subject,
-                        chapter_count,
-                        word_count,
-                        include_references,
-                        citation_style
-                    )
-                    
-                    steps[1]["status"] = "complete"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 20,
-                        "current_step": 1
-                    }) + "\n\n"
-                    
-                    # Step 2: Determine chapters
-                    steps[2]["status"] = "in-progress"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 30,
-                        "current_step": 2
-                    }) + "\n\n"
-                    
-                    chapters = extract_chapters(sections[0][1])
-                    
-                    # Create sub-steps for each chapter with initial timing info
-                    chapter_substeps = [
-                        {
-                            "id": f"chapter_{i}", 
-                            "text": chapter, 
-                            "status": "pending",
-                            "start_time": None,
-                            "duration": None
-                        }
-                        for i, chapter in enumerate(chapters)
-                    ]
-                    
-                    steps[3]["subSteps"] = chapter_substeps
-                    
-                    steps[2]["status"] = "complete"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 40,
-                        "current_step": 2,
-                        "update_steps": True
-                    }) + "\n\n"
-                    
-                    # Add introduction and conclusion
-                    sections.append((
-                        "Introduction", 
-                        f"Write a comprehensive introduction for a research paper about {research_subject}."
-                    ))
-                    
-                    for i, chapter in enumerate(chapters, 1):
-                        sections.append((
-                            f"Chapter {i}: {chapter}", 
-                            f"Write a detailed chapter about '{chapter}' for a research paper about {research_subject}."
-                        ))
-                    
-                    sections.append((
-                        "Conclusion",
-                        f"Write a conclusion section for a research paper about {research_subject}."
-                    ))
-                    
-                    # Generate content for each chapter with timing
-                    for i, chapter in enumerate(chapters):
-                        # Update chapter start time
-                        steps[3]["subSteps"][i]["start_time"] = time.time()
-                        steps[3]["subSteps"][i]["status"] = "in-progress"
-                        
-                        yield "data: " + json.dumps({
-                            "steps": steps,
-                            "progress": 40 + (i * 50 / len(chapters)),
-                            "current_step": 3,
-                            "chapter_progress": {
-                                "current": i + 1,
-                                "total": len(chapters),
-                                "chapter": chapter,
-                                "percent": ((i + 1) / len(chapters)) * 100
-                            }
-                        }) + "\n\n"
-                        
-                        try:
-                            response = model_provider.generate_content(
-                                selected_model,
-                                f"Write a detailed chapter about '{chapter}' for a research paper about {research_subject}."
-                            )
-                            
-                            # Calculate and store duration
-                            duration = time.time() - steps[3]["subSteps"][i]["start_time"]
-                            steps[3]["subSteps"][i]["duration"] = f"{duration:.1f}s"
-                            steps[3]["subSteps"][i]["status"] = "complete"
-                            
-                            yield "data: " + json.dumps({
-                                "steps": steps,
-                                "progress": 40 + ((i + 1) * 50 / len(chapters)),
-                                "current_step": 3,
-                                "chapter_progress": {
-                                    "current": i + 1,
-                                    "total": len(chapters),
-                                    "chapter": chapter,
-                                    "percent": ((i + 1) / len(chapters)) * 100,
-                                    "duration": f"{duration:.1f}s"
-                                }
-                            }) + "\n\n"
-                        except Exception as e:
-                            duration = time.time() - steps[3]["subSteps"][i]["start_time"]
-                            steps[3]["subSteps"][i]["duration"] = f"{duration:.1f}s"
-                            steps[3]["subSteps"][i]["status"] = "error"
-                            steps[3]["subSteps"][i]["message"] = str(e)
-                            
-                            yield "data: " + json.dumps({
-                                "steps": steps,
-                                "progress": 40 + ((i + 1) * 50 / len(chapters)),
-                                "current_step": 3,
-                                "warning": f"Failed to generate chapter {i+1} after retries",
-                                "chapter_progress": {
-                                    "current": i + 1,
-                                    "total": len(chapters),
-                                    "chapter": chapter,
-                                    "percent": ((i + 1) / len(chapters)) * 100,
-                                    "error": str(e)
-                                }
-                            }) + "\n\n"
-                    
-                    steps[3]["status"] = "complete"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 90,
-                        "current_step": 3,
-                        "chapter_progress": {
-                            "complete": True,
-                            "total_chapters": len(chapters)
-                        }
-                    }) + "\n\n"
-                    
+                    planned, match = outline, None
+                    # A near-duplicate earlier subject can stand in for a new outline
+                    if planned is None and reuse_mode != 'off':
+                        match = similarity_index.find_paper(research_subject, tenant=tenant)
+                        if match:
+                            planned = Outline.from_dict(match[0]['outline']).fit_chapter_count(chapter_count)
+                    planned = planned or model_provider.generate_outline(
+                        model(), research_subject, chapter_count, word_count)
+                    planned_sections = generate_automatic_sections(
+                        model(), research_subject, chapter_count, word_count,
+                        include_references, citation_style, outline=planned)
+                    return {'outline': planned, 'sections': planned_sections, 'match': match}
                 except Exception as e:
-                    steps[1]["status"] = "error"
-                    steps[1]["message"] = str(e)
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 20,
-                        "current_step": 1
-                    }) + "\n\n"
-                    
-                    # Fallback to manual structure
-                    sections = get_manual_sections(research_subject)
-                    steps[1]["message"] = "Falling back to manual structure"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 20,
-                        "current_step": 1
-                    }) + "\n\n"
-                    
-                    try:
-                        index_content = model_provider.generate_index_content(selected_model, research_subject, [s[0] for s in sections[1:]])
-                        sections[0] = ("Index", index_content)
-                        
-                        steps[1]["status"] = "complete"
-                        yield "data: " + json.dumps({
-                            "steps": steps,
-                            "progress": 25,
-                            "current_step": 1
-                        }) + "\n\n"
-                    except Exception as e:
-                        steps[1]["status"] = "error"
-                        steps[1]["message"] = str(e)
-                        yield "data: " + json.dumps({
-                            "steps": steps,
-                            "progress": 20,
-                            "current_step": 1,
-                            "error": "Failed to generate even fallback content"
-                        }) + "\n\n"
-                        return
-            else:
-                sections = get_manual_sections(research_subject)
-                steps[1]["status"] = "in-progress"
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 10,
-                    "current_step": 1
-                }) + "\n\n"
-                
+                    logger.warning("Automatic structure failed, falling back to manual: %s", e)
+                    fallback = str(e)
+            planned_sections = get_manual_sections(research_subject)
+            planned = outline or model_provider.generate_outline(
+                model(), research_subject, manual_chapters=manual_chapter_titles(planned_sections))
+            planned_sections[0] = ("Index", planned.to_markdown())
+            return {'outline': planned, 'sections': planned_sections, 'match': None, 'fallback': fallback}
+
+        def write_section(title, prompt=None):
+            def write(inputs):
+                text = prompt or prompts[title]
+                if plan is not None and plan.words < planned_words:
+                    # Replanned after the prompts were written
+                    text = f"{text} Keep it to about {plan.words} words to meet the deadline."
+                return generate_section(model(), title, text, generated, drafts, context, state, section_words(title))
+            return write
+
+        def write_references(inputs):
+            """Reference data from the model, formatted here; a failure leaves the section to the text prompt"""
+            if 'References' not in generated:
+                items = paper_references(paper_id, tenant, model(), research_subject, outline.chapter_titles())
                 try:
-                    index_content = model_provider.generate_index_content(selected_model, research_subject, [s[0] for s in sections[1:]])
-                    sections[0] = ("Index", index_content)
-                    
-                    steps[1]["status"] = "complete"
-                    yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 20,
-                        "current_step": 1
-                    }) + "\n\n"
-                except Exception as e:
-                    steps[1]["status"] = "error"
-                    steps[1]["message"] = str(e)
+                    generated['References'] = format_references(items, citation_style)
+                except ValueError as e:
+                    logger.warning("%s, using %s", e, Config.CITATION_STYLE)
+                    generated['References'] = format_references(items)
+                state.save()
+            return generated['References']
+
+        def section_words(title):
+            """The word target a section's prompt asks for; None sizes it by its kind"""
+            if title == 'References':
+                return None
+            if plan is not None:
+                return plan.words
+            if automatic and word_count != 'auto' and title in chapters:
+                return int(int(word_count) / (len(chapters) + 2))
+            return None
+
+        # Each section declares what it needs: the introduction nothing, everything else the outline
+        pipeline = Pipeline(plan.parallel if plan is not None else None)
+        pipeline.add('outline', plan_outline)
+        pipeline.add('Introduction',
+                     write_section('Introduction', introduction_prompt(
+                         research_subject, str(plan.words) if plan is not None else word_count if automatic else 'auto')),
+                     deps=() if speculate else ('outline',))
+
+        def progress():
+            if not planned:
+                return 10
+            writing = [node for name, node in pipeline.nodes.items() if name != 'outline']
+            finished = sum(1 for node in writing if node.state in ('done', 'failed', 'skipped'))
+            return 20 + 70 * finished / len(writing)
+
+        def event(current_step, **extra):
+            job.apply('progress', value=progress(), current_step=current_step)
+            return job.event(**extra)
+
+        def writing_finished():
+            return all(node.state in ('done', 'failed', 'skipped') for name, node in pipeline.nodes.items()
+                       if name not in ('outline', 'Conclusion', 'References'))
+
+        # Steps are driven by node state changes; the wall time is the critical path, not the sum
+        for node in pipeline.run():
+            if node.name == 'outline':
+                if node.state == 'running':
+                    job.apply('step', index=0, status=COMPLETE)
+                    job.apply('step', index=1, status=IN_PROGRESS)
+                    yield event(1)
+                    continue
+                if node.state != 'done':
+                    job.apply('step', index=1, status=ERROR, message=str(node.error))
+                    failed = "Failed to generate even fallback content" if automatic else "Failed to generate manual index"
+                    pipeline.cancel()
+                    continue
+                outline = node.result['outline']
+                sections = node.result['sections']
+                if node.result['match']:
+                    reused, similarity = node.result['match']
                     yield "data: " + json.dumps({
-                        "steps": steps,
-                        "progress": 20,
-                        "current_step": 1,
-                        "error": "Failed to generate manual index"
+                        "reused_from": reused['paper_id'],
+                        "similarity": round(similarity, 2)
                     }) + "\n\n"
-                    return
-            
-            # Write introduction
-            steps[3]["status"] = "in-progress"
-            yield "data: " + json.dumps({
-                "steps": steps,
-                "progress": 40,
-                "current_step": 3
-            }) + "\n\n"
-            
-            try:
-                introduction_content = model_provider.generate_content(
-                    selected_model,
-                    f"Write a comprehensive introduction for a research paper about {research_subject}."
-                )
-                
-                steps[3]["status"] = "complete"
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 60,
-                    "current_step": 3
-                }) + "\n\n"
-            except Exception as e:
-                steps[3]["status"] = "error"
-                steps[3]["message"] = str(e)
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 60,
-                    "current_step": 3,
-                    "warning": "Failed to generate introduction after retries"
-                }) + "\n\n"
-            
-            # Write conclusion
-            steps[4]["status"] = "in-progress"
-            yield "data: " + json.dumps({
-                "steps": steps,
-                "progress": 80,
-                "current_step": 4
-            }) + "\n\n"
-            
+                chapters = [title for title, _ in sections if title.startswith('Chapter ')]
+                planned = True
+                if checkpoint is None:
+                    reused_sections, reused_drafts = plan_reuse(reuse_mode, research_subject,
+                                                                outline.chapter_titles(), reused, tenant)
+                    for title, text in reused_sections.items():
+                        generated.setdefault(title, text)
+                    drafts.update(reused_drafts)
+                context.set_outline(outline)
+                state.outline = outline
+                prompts.update(sections)
+                # Chained, every section's context covers those before it; a deadline needs the concurrency
+                chain = Config.PIPELINE_CHAIN_SECTIONS and plan is None
+                previous = 'Introduction'
+                for title, _ in sections:
+                    if title == 'References':
+                        pipeline.add(title, write_references, deps=('outline',))
+                    elif title not in ('Index', 'Introduction'):
+                        pipeline.add(title, write_section(title), deps=('outline',), after=(previous,) if chain else ())
+                        previous = title
+
+                job.apply('step', index=1, status=COMPLETE,
+                          message="Falling back to manual structure" if node.result.get('fallback') else None)
+                job.apply('chapters', titles=[chapter.split(': ', 1)[-1] for chapter in chapters])
+                job.apply('step', index=2, status=COMPLETE)
+                yield event(2, update_steps=True)
+            elif node.name in ('Conclusion', 'References'):
+                if node.state == 'running':
+                    job.apply('step', index=4, status=IN_PROGRESS)
+                    yield event(4)
+                elif node.state == 'failed':
+                    yield event(4, warning=f"Failed to generate {node.name.lower()} after retries")
+                else:
+                    yield event(4)
+            else:
+                if node.state == 'running' and job.steps[3].status == PENDING:
+                    job.apply('step', index=3, status=IN_PROGRESS)
+                extra = {}
+                if node.name in chapters and node.state != 'skipped':
+                    i = chapters.index(node.name)
+                    status = {'running': IN_PROGRESS, 'done': COMPLETE}.get(node.state, ERROR)
+                    job.apply('chapter', index=i, status=status,
+                              message=str(node.error) if node.error is not None else None)
+                    extra["chapter_progress"] = job.chapter_progress(i)
+                    if node.state == 'failed':
+                        extra["warning"] = f"Failed to generate chapter {i + 1} after retries"
+                elif node.state == 'failed':
+                    extra["warning"] = "Failed to generate introduction after retries"
+                yield event(3, **extra)
+                if planned and node.state != 'running' and writing_finished() and job.steps[3].status != COMPLETE:
+                    job.apply('step', index=3, status=COMPLETE)
+                    yield event(3, chapter_progress={"complete": True, "total_chapters": len(chapters)})
+
+            if plan is not None and planned and node.name != 'outline' and node.state in ('done', 'failed'):
+                # Sections coming in late: speed up those that haven't started
+                writing = [n for name, n in pipeline.nodes.items() if name != 'outline']
+                durations = [n.duration for n in writing if n.state == 'done']
+                unfinished = sum(1 for n in writing if n.state in ('pending', 'running'))
+                adjustable = durations and any(n.state == 'pending' for n in writing)
+                changes = planner.replan(plan, unfinished, sum(durations) / len(durations)) if adjustable else []
+                if changes:
+                    pipeline.max_parallel = plan.parallel
+                    yield event(3, warning=f"Behind schedule, adjusted: {', '.join(changes)}", plan=plan.to_dict())
+
+            # Nodes that haven't started yet are skipped once the user aborts
+            if not aborted and job.abort:
+                aborted = True
+                pipeline.cancel()
+
+        if aborted:
+            raise Exception("Generation aborted by user")
+        if failed:
+            job.apply('finish', outcome='failed', message=failed)
+            yield event(1, error=failed)
+            return
+        job.apply('step', index=4, status=COMPLETE)
+
+        # Write the complete paper, reusing the sections generated above
+        errors = {name: node.error for name, node in pipeline.nodes.items() if node.state == 'failed'}
+        written = write_research_paper(md_filename, research_subject, sections, model(),
+                                       generated, drafts, context, state, errors)
+        if outline is not None and not (reused and reuse_mode == 'full'):
             try:
-                conclusion_content = model_provider.generate_content(
-                    selected_model,
-                    f"Write a conclusion section for a research paper about {research_subject}."
-                )
-                
-                steps[4]["status"] = "complete"
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 90,
-                    "current_step": 4
-                }) + "\n\n"
+                similarity_index.add_paper(paper_id, research_subject,
+                                           model(), outline.to_dict(), written, tenant)
             except Exception as e:
-                steps[4]["status"] = "error"
-                steps[4]["message"] = str(e)
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 90,
-                    "current_step": 4,
-                    "warning": "Failed to generate conclusion after retries"
-                }) + "\n\n"
-            
-            # Write the complete paper
-            write_research_paper(md_filename, research_subject, sections, selected_model)
-            
-            # Convert to Word
-            steps[5]["status"] = "in-progress"
-            yield "data: " + json.dumps({
-                "steps": steps,
-                "progress": 95,
-                "current_step": 5
-            }) + "\n\n"
-            
+                logger.warning("Failed to index paper for reuse: %s", e)
+        try:
+            usage = model_provider.ledger.paper_report(paper_id)
+            archive.add_paper(paper_id, research_subject, written, model(), tenant, job.elapsed,
+                              (usage['prompt_tokens'], usage['completion_tokens']),
+                              {name: node.duration for name, node in pipeline.nodes.items() if node.state == 'done'},
+                              os.path.join(Config.UPLOAD_FOLDER, md_filename))
+        except Exception as e:
+            logger.warning("Failed to archive paper %s: %s", paper_id, e)
+        
+        # Convert to Word
+        job.apply('step', index=5, status=IN_PROGRESS)
+        job.apply('progress', value=95, current_step=5)
+        yield job.event()
+        
+        try:
+            doc_generator.convert_to_word(md_filename, docx_filename)
+            job.apply('step', index=5, status=COMPLETE)
+            job.apply('finish', outcome='complete')
+            yield job.event(
+                status="complete",
+                docx_file=docx_filename,
+                md_file=md_filename,
+                paper_id=paper_id,
+                **deadline_status(params, plan)
+            )
+        except Exception as e:
+            message = f'Paper generated but Word conversion failed: {str(e)}'
+            job.apply('step', index=5, status=ERROR, message=str(e))
+            job.apply('finish', outcome='partial', message=message)
+            yield job.event(
+                status="partial_success",
+                message=message,
+                md_file=md_filename,
+                paper_id=paper_id,
+                **deadline_status(params, plan)
+            )
+
+    except GenerationSuspended:
+        # This worker is going away; the client reconnects with ?resume= and another one continues
+        job.apply('finish', outcome='suspended')
+        yield "data: " + json.dumps({"status": "suspended", "paper_id": paper_id, "retry_after": 1}) + "\n\n"
+    except Exception as e:
+        if str(e) == "Generation aborted by user":
+            job.apply('finish', outcome='aborted')
+            yield "data: " + json.dumps({"status": "aborted"}) + "\n\n"
+        else:
+            job.apply('finish', outcome='failed', message=str(e))
+            yield "data: " + json.dumps({"error": f"Failed to generate paper: {str(e)}"}) + "\n\n"
+    finally:
+        if pipeline is not None:
+            # Sections still running when the client left finish before the slot and checkpoint are given up
+            pipeline.close()
+        ticket.release()
+        if plan is not None and job.outcome in ('complete', 'partial', 'failed'):
             try:
-                doc_generator.convert_to_word(md_filename, docx_filename)
-                steps[5]["status"] = "complete"
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 100,
-                    "current_step": 5,
-                    "status": "complete",
-                    "docx_file": docx_filename,
-                    "md_file": md_filename
-                }) + "\n\n"
+                budget = float(params['deadline'])
+                planner.record(plan, paper_id, tenant, budget, float(params['deadline_at']) - budget, job.outcome)
             except Exception as e:
-                steps[5]["status"] = "error"
-                steps[5]["message"] = str(e)
-                yield "data: " + json.dumps({
-                    "steps": steps,
-                    "progress": 100,
-                    "current_step": 5,
-                    "status": "partial_success",
-                    "message": f'Paper generated but Word conversion failed: {str(e)}',
-                    "md_file": md_filename
-                }) + "\n\n"
-            
-            # Clean up task when done
-            if task_id in _generation_tasks:
-                del _generation_tasks[task_id]
-
-        except Exception as e:
-            # Clean up task on error
-            if task_id in _generation_tasks:
-                del _generation_tasks[task_id]
-            if str(e) == "Generation aborted by user":
-                yield "data: " + json.dumps({"status": "aborted"}) + "\n\n"
+                logger.warning("Failed to record deadline of %s: %s", paper_id, e)
+        if state is not None:
+            # Finished papers are dropped; suspended or interrupted ones stay resumable
+            if job.outcome in ('complete', 'partial', 'failed', 'aborted'):
+                state.discard()
             else:
-                yield "data: " + json.dumps({"error": f"Failed to generate paper: {str(e)}"}) + "\n\n"
-    
-    return Response(generate(), mimetype="text/event-stream")
+                state.suspend()
+
+@api_bp.route('/stream')
+@sse_stream_required
+def stream():
+    generation, error = open_generation()
+    if error is not None:
+        return error
+    events = paper_events(**generation)
+    if request.args.get('profile') == '1' and is_admin():
+        # cProfile dump of this generation, listed under /admin/profiles
+        events = profile_stream(events, profiles, generation['task_id'])
+    response = Response(metrics.track_generation(events, generation['job']), mimetype="text/event-stream")
+    response.call_on_close(lambda: close_generation(generation))
+    return response
 
 @api_bp.route('/download/<filename>')
 def download(filename):
@@ -511,8 +785,83 @@ def download(filename):
 @api_bp.route('/abort/<task_id>', methods=['POST'])
 def abort_generation(task_id):
     """Abort an ongoing generation task"""
-    if task_id in _generation_tasks:
-        _generation_tasks[task_id]['abort'] = True
+    job = jobs.get(task_id)
+    if job is not None and job.outcome is None:
+        job.abort = True
         return jsonify({'status': 'aborted'})
     return jsonify({'status': 'not_found'}), 404
+
+@api_bp.route('/jobs/<task_id>')
+def get_job(task_id):
+    """Progress of a generation, whichever worker runs it"""
+    snapshot = jobs.snapshot(task_id)
+    if snapshot is None or (snapshot.pop('tenant') != tenant_from_request(request, session) and not is_admin()):
+        return jsonify({'error': 'Unknown task'}), 404
+    return jsonify(snapshot)
+
+@api_bp.route('/subscribe')
+def subscribe():
+    """Watch many generations over one SSE connection: ?tasks=<id>,<id>,...
+
+    Every message is a job snapshot as returned by /api/jobs/<task_id>.
+    Intermediate changes may be coalesced, the final state of each task is
+    always sent, and the stream ends once every task has finished. Tasks
+    running on other workers are followed through their shared snapshots.
+    """
+    tenant = tenant_from_request(request, session)
+    admin = is_admin()
+    task_ids = list(dict.fromkeys(task_id for value in request.args.getlist('tasks')
+                                  for task_id in value.split(',') if task_id))
+    if not task_ids or len(task_ids) > Config.SUBSCRIBE_MAX_TASKS:
+        return jsonify({'error': f'Watch between 1 and {Config.SUBSCRIBE_MAX_TASKS} tasks'}), 400
+
+    def watch():
+        watching = set(task_ids)
+        seen_files = {}  # Snapshot mtimes of tasks other workers run
+        started = last_sent = time.monotonic()
+        with bus.subscribe(task_ids) as subscription:
+            # Current state first, then whatever changes
+            updates = [(task_id, jobs.get(task_id)) for task_id in task_ids]
+            while watching:
+                for task_id, job in updates:
+                    if task_id not in watching:
+                        continue
+                    if job is not None:
+                        owner, finished, body = job.tenant, job.outcome is not None, job.snapshot_json()
+                    else:
+                        mtime, snapshot = jobs.read_snapshot(task_id, seen_files.get(task_id))
+                        if snapshot is None:
+                            continue
+                        seen_files[task_id] = mtime
+                        owner, finished = snapshot.get('tenant'), snapshot['status'] not in ('queued', 'running')
+                        body = json.dumps(snapshot)
+                    if not admin and owner != tenant:
+                        watching.discard(task_id)
+                        continue
+                    last_sent = time.monotonic()
+                    yield "data: " + body + "\n\n"
+                    if finished:
+                        watching.discard(task_id)
+
+                # Tasks that never showed up anywhere are given up on
+                if time.monotonic() - started > 30:
+                    for task_id in [t for t in watching if t not in seen_files and jobs.get(t) is None]:
+                        watching.discard(task_id)
+                        yield "data: " + json.dumps({"task_id": task_id, "status": "unknown"}) + "\n\n"
+                if not watching:
+                    break
+                if time.monotonic() - last_sent > 15:
+                    last_sent = time.monotonic()
+                    yield ": keepalive\n\n"
+                updates = subscription.get(timeout=1.0)
+                # Not in this worker: poll the shared snapshots while waiting
+                updates += [(task_id, None) for task_id in watching if jobs.get(task_id) is None]
+
+    return Response(watch(), mimetype="text/event-stream")
+
+@api_bp.route('/jobs')
+def get_jobs():
+    """This worker's generations in flight; admins see every tenant"""
+    tenant = tenant_from_request(request, session)
+    return jsonify({'jobs': [job.to_dict() for job in jobs.active() if is_admin() or job.tenant == tenant]})
     
\ No newline at end of file
@@ -0,0 +1,223 @@
+import hmac
+import json
+import time
+import uuid
+import queue
+import threading
+import contextvars
+import logging
+from typing import Dict, List, Optional
+from flask import Blueprint, jsonify, request, Response, session
+from services.model_provider import Completion
+from services.pool import PoolExhausted
+from services.quality import ResponseRejected, StreamInterrupted, StreamRelay
+from services.response_cache import ResponseCache
+from services.scheduler import QuotaExceeded, bearer_token, current_tenant, tenant_from_request
+from services import metrics
+from config import Config
+from utils.tokens import count_tokens
+from routes.api import model_provider, model_catalog
+
+logger = logging.getLogger(__name__)
+
+gateway_bp = Blueprint('gateway', __name__)
+response_cache = ResponseCache()
+
+STREAM_CHUNK_CHARS = 64
+KEEPALIVE_SECONDS = 15
+
+
+def openai_error(message: str, status: int, error_type: str, code: str = None, headers: Dict = None):
+    body = {'error': {'message': message, 'type': error_type, 'param': None, 'code': code}}
+    return jsonify(body), status, headers or {}
+
+
+def error_for(e: Exception):
+    """(message, status, type, code, headers) of a failed completion, in OpenAI's terms"""
+    if isinstance(e, QuotaExceeded):
+        return str(e), 429, 'rate_limit_error', 'quota_exceeded', {'Retry-After': str(e.retry_after)}
+    if isinstance(e, PoolExhausted):
+        return str(e), 503, 'server_error', 'capacity', {'Retry-After': '1'}
+    if isinstance(e, ResponseRejected):
+        return str(e), 502, 'server_error', e.reason, {}
+    if isinstance(e, StreamInterrupted):
+        return str(e), 502, 'server_error', 'stream_interrupted', {}
+    return f"Upstream provider failed: {str(e)}", 502, 'server_error', None, {}
+
+
+def messages_to_prompt(messages: List[Dict]) -> str:
+    """A lone user message is the prompt itself; a conversation becomes 'Role: content' blocks"""
+    turns = []
+    for message in messages:
+        content = message.get('content') or ''
+        if isinstance(content, list):  # Content parts; only text is supported
+            content = ''.join(part.get('text', '') for part in content
+                              if isinstance(part, dict) and part.get('type') == 'text')
+        turns.append((message.get('role') or 'user', content))
+    if len(turns) == 1 and turns[0][0] == 'user':
+        return turns[0][1]
+    return '\n\n'.join(f"{role.capitalize()}: {content}" for role, content in turns) + '\n\nAssistant:'
+
+
+def usage_of(prompt: str, completion: Completion) -> Dict:
+    usage = getattr(completion, 'usage', None) or {}
+    prompt_tokens = usage.get('prompt_tokens') or count_tokens(prompt)
+    completion_tokens = usage.get('completion_tokens')
+    if completion_tokens is None:
+        completion_tokens = count_tokens(completion)
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+@gateway_bp.before_request
+def authenticate():
+    if not Config.GATEWAY_API_KEYS:
+        # Calls are made with the server's own provider credentials, so nobody gets in without a key
+        return openai_error('The gateway is disabled: no GATEWAY_API_KEYS are configured', 503, 'server_error',
+                            'gateway_disabled')
+    key = (bearer_token(request) or request.headers.get('X-API-Key') or '').encode('utf-8')
+    if not any(hmac.compare_digest(key, allowed.encode('utf-8')) for allowed in Config.GATEWAY_API_KEYS):
+        return openai_error('Invalid API key', 401, 'invalid_request_error', 'invalid_api_key')
+    return None
+
+
+@gateway_bp.route('/models')
+def list_models():
+    created = int(time.time())
+    return jsonify({
+        'object': 'list',
+        'data': [{'id': model, 'object': 'model', 'created': created, 'owned_by': model_provider.service.name}
+                 for model in model_catalog.models()]
+    })
+
+
+@gateway_bp.route('/chat/completions', methods=['POST'])
+def chat_completions():
+    """OpenAI chat completions on top of ModelProvider.
+
+    Requests get the same fair scheduling, token quotas, model fallback
+    and usage accounting as paper sections, but keep the request's
+    max_tokens and temperature, and only empty replies are turned away.
+    Answers to requests with temperature 0 are cached for
+    GATEWAY_CACHE_TTL seconds unless the request sends 'Cache-Control:
+    no-cache'; sampled ones are expected to differ each time.
+    """
+    body = request.get_json(silent=True) or {}
+    messages = body.get('messages')
+    if not isinstance(messages, list) or not messages or not all(isinstance(m, dict) for m in messages):
+        return openai_error("'messages' must be a non-empty list of messages", 400, 'invalid_request_error')
+    model = body.get('model') or Config.DEFAULT_MODELS[0]
+    prompt = messages_to_prompt(messages)
+    response_format = body.get('response_format')
+    if not isinstance(response_format, dict) or response_format.get('type') == 'text':
+        response_format = None
+    max_tokens = body.get('max_completion_tokens', body.get('max_tokens'))
+    if max_tokens is not None and (not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens < 1):
+        return openai_error("'max_tokens' must be a positive integer", 400, 'invalid_request_error')
+    temperature = body.get('temperature')
+    if temperature is not None and (not isinstance(temperature, (int, float)) or isinstance(temperature, bool)
+                                    or not 0 <= temperature <= 2):
+        return openai_error("'temperature' must be a number between 0 and 2", 400, 'invalid_request_error')
+    options = {name: value for name, value in (('max_tokens', max_tokens), ('temperature', temperature))
+               if value is not None}
+    # Without a temperature the service samples at its configured one
+    use_cache = temperature == 0 and 'no-cache' not in request.headers.get('Cache-Control', '')
+
+    tenant = tenant_from_request(request, session)
+    current_tenant.set(tenant)
+    try:
+        model_provider.scheduler.check_quota(tenant)
+    except QuotaExceeded as e:
+        metrics.GATEWAY_REQUESTS.labels('quota', 'none').inc()
+        message, status, error_type, code, headers = error_for(e)
+        return openai_error(message, status, error_type, code, headers)
+
+    def call(relay: StreamRelay = None):
+        def complete() -> Completion:
+            return model_provider.complete_chat(model, prompt, response_format, max_tokens, temperature, relay)
+
+        if not use_cache:
+            return complete(), False
+        return response_cache.get_or_compute(ResponseCache.key(model, prompt, response_format, options), complete)
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.get('stream'):
+        try:
+            completion, cached = call()
+        except Exception as e:
+            logger.warning("Gateway completion failed for %s: %s", tenant, e)
+            metrics.GATEWAY_REQUESTS.labels('error', 'none').inc()
+            message, status, error_type, code, headers = error_for(e)
+            return openai_error(message, status, error_type, code, headers)
+        metrics.GATEWAY_REQUESTS.labels('ok', 'hit' if cached else 'miss').inc()
+        return jsonify({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': getattr(completion, 'model', None) or model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': str(completion)},
+                'finish_reason': getattr(completion, 'finish_reason', None) or 'stop'
+            }],
+            'usage': usage_of(prompt, completion)
+        }), 200, {'X-Cache': 'HIT' if cached else 'MISS'}
+
+    include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+    # The worker thread has to see the tenant just set
+    context = contextvars.copy_context()
+
+    def chunk(delta: Dict, finish_reason: Optional[str] = None, model_name: str = model, **extra) -> str:
+        data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+        data.update(extra)
+        return "data: " + json.dumps(data) + "\n\n"
+
+    def events():
+        # The completion runs off the request and passes each chunk on as the service streams it.
+        # Services that don't stream, cached answers and answers shared with an identical request
+        # arrive whole and are sent out in pieces.
+        updates = queue.Queue()
+        relay = StreamRelay(updates.put)
+
+        def run():
+            try:
+                updates.put(call(relay))
+            except (Exception, StreamInterrupted) as e:
+                updates.put(e)
+
+        threading.Thread(target=context.run, args=(run,), name=f"gateway-{completion_id}", daemon=True).start()
+        yield chunk({'role': 'assistant', 'content': ''})
+        while True:
+            try:
+                result = updates.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if not isinstance(result, str):
+                break
+            yield chunk({'content': result})
+        if isinstance(result, BaseException):
+            logger.warning("Gateway completion failed for %s: %s", tenant, result)
+            metrics.GATEWAY_REQUESTS.labels('error', 'none').inc()
+            message, _, error_type, code, _ = error_for(result)
+            yield "data: " + json.dumps({'error': {'message': message, 'type': error_type, 'code': code}}) + "\n\n"
+            yield "data: [DONE]\n\n"
+            return
+        completion, cached = result
+        metrics.GATEWAY_REQUESTS.labels('ok', 'hit' if cached else 'miss').inc()
+        model_name = getattr(completion, 'model', None) or model
+        text = str(completion)
+        if not relay.sent:
+            for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                yield chunk({'content': text[start:start + STREAM_CHUNK_CHARS]}, model_name=model_name)
+        yield chunk({}, getattr(completion, 'finish_reason', None) or 'stop', model_name=model_name)
+        if include_usage:
+            yield "data: " + json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created,
+                                         'model': model_name, 'choices': [],
+                                         'usage': usage_of(prompt, completion)}) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
@@ -0,0 +1,25 @@
+from typing import Dict, Tuple
+from flask import Blueprint, jsonify
+from routes.api import admission, drain, warmup
+
+health_bp = Blueprint('health', __name__)
+
+
+def readiness() -> Tuple[int, Dict]:
+    """Ready once warm-up finished, and no longer once the worker drains"""
+    warmup.start()  # No-op where the server hook already started it
+    body = dict(warmup.status(), draining=drain.draining, admission=admission.stats())
+    body['ready'] = body['ready'] and not drain.draining
+    return (200 if body['ready'] else 503), body
+
+
+@health_bp.route('/healthz')
+def healthz():
+    """Liveness: the worker answers requests"""
+    return jsonify({'status': 'ok'})
+
+
+@health_bp.route('/readyz')
+def readyz():
+    status, body = readiness()
+    return jsonify(body), status
@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from services import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers"""
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
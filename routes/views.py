@@ -1,10 +1,69 @@
-from flask import Blueprint, render_template
-from services.model_provider import ModelProvider
+import os
+import uuid
+import json
+import hashlib
+from flask import Blueprint, Response, current_app, render_template, request, session
+from routes.api import model_catalog
+from utils.assets import AssetManifest, compress, preferred_encoding
 
 views_bp = Blueprint('views', __name__)
-model_provider = ModelProvider()
+assets = AssetManifest()
+
+# The rendered index page and its precompressed variants, for the current model list
+_index_page = None
+_template_version = None  # (mtime_ns, size, digest) of templates/index.html
+
+
+@views_bp.app_context_processor
+def inject_assets():
+    return {'asset_url': assets.url}
+
+
+def template_digest() -> str:
+    """Hash of the index template's source, re-read only when the file changed"""
+    global _template_version
+    path = os.path.join(current_app.root_path, current_app.template_folder, 'index.html')
+    stat = os.stat(path)
+    version = _template_version
+    if version is None or version[:2] != (stat.st_mtime_ns, stat.st_size):
+        with open(path, 'rb') as f:
+            version = (stat.st_mtime_ns, stat.st_size, hashlib.sha1(f.read()).hexdigest())
+        _template_version = version
+    return version[2]
+
+
+def render_index(models) -> dict:
+    """Render the index once per model list, template and asset build"""
+    global _index_page
+    # A deploy that only touches the template must change the ETag too
+    key = hashlib.sha1(json.dumps([models, assets.version, template_digest()]).encode('utf-8')).hexdigest()[:16]
+    page = _index_page
+    if page is None or page['key'] != key:
+        # Concurrent misses may render twice; both results are identical
+        body = render_template('index.html', models=models).encode('utf-8')
+        page = {'key': key, '': body, **compress(body)}
+        _index_page = page
+    return page
+
 
 @views_bp.route('/')
 def index():
-    models = model_provider.get_available_models()
-    return render_template('index.html', models=models)
\ No newline at end of file
+    # Served from the background-refreshed catalog, never from a provider call
+    page = render_index(model_catalog.models())
+    # Browser users are scheduled as one tenant per session rather than per IP
+    session.setdefault('tenant', uuid.uuid4().hex[:12])
+    encoding = preferred_encoding([e for e in ('br', 'gzip') if e in page])
+    response = Response(page[encoding], mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # Each coding is a different representation, so it gets its own ETag
+    response.set_etag(f"{page['key']}-{encoding or 'identity'}")
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+
+@views_bp.route('/assets/<path:filename>')
+def asset(filename):
+    """Fingerprinted static files; their names change with their content"""
+    return assets.send(filename)
@@ -0,0 +1,178 @@
+import os
+import math
+import asyncio
+import time
+import fcntl
+import threading
+from collections import deque
+from typing import AsyncIterator, Iterator, Optional
+from config import Config
+from services import metrics
+
+
+class AdmissionRejected(Exception):
+    """Raised when a generation cannot even be queued"""
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A generation's place in the admission queue, and later its slot"""
+
+    def __init__(self, controller: 'AdmissionController'):
+        self.controller = controller
+        self.admitted = False
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self._slot_file = None
+        self._released = False
+
+    def wait(self) -> Iterator[int]:
+        """Yield the queue position while waiting; returns once admitted.
+
+        Raises AdmissionRejected if the wait exceeds ADMISSION_MAX_WAIT or
+        the worker starts draining.
+        """
+        for position in self._poll():
+            if position is not None:
+                yield position
+            time.sleep(self.controller.poll_interval)
+
+    async def wait_async(self) -> AsyncIterator[int]:
+        """wait() for asyncio, so a queued stream costs no thread"""
+        for position in self._poll():
+            if position is not None:
+                yield position
+            await asyncio.sleep(self.controller.poll_interval)
+
+    def _poll(self) -> Iterator[Optional[int]]:
+        """One step per poll: the position when it is worth reporting, else None"""
+        last_position = None
+        last_report = 0.0
+        while not self.controller._try_admit(self):
+            if not self.controller.accepting:
+                # The worker is draining; another one will pick the request up
+                metrics.ADMISSION_REJECTIONS.labels('503').inc()
+                raise AdmissionRejected("Server is restarting, please retry", 503, 1)
+            position = self.controller.position(self)
+            now = time.monotonic()
+            if now - self.enqueued_at > self.controller.max_wait:
+                metrics.ADMISSION_REJECTIONS.labels('timeout').inc()
+                raise AdmissionRejected("Server is busy, please retry later", 503,
+                                        self.controller.retry_after())
+            # Report position changes, and repeat it now and then as a keep-alive
+            if position != last_position or now - last_report >= 15:
+                last_position, last_report = position, now
+                yield position
+            else:
+                yield None
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """Bounds concurrent generations per worker and across all workers.
+
+    Per-worker concurrency is tracked in memory. The global limit uses a pool
+    of slot files shared by all workers: holding an exclusive flock on one of
+    them is holding a slot, and the kernel releases it if the worker dies.
+    Requests beyond both limits wait in a bounded FIFO queue; once that is
+    full they are rejected with 429, and with 503 while the worker is closed.
+    """
+
+    def __init__(self, max_per_worker: int = None, max_global: int = None, max_queue: int = None,
+                 slot_dir: str = None):
+        self.max_per_worker = max_per_worker or Config.ADMISSION_MAX_PER_WORKER
+        self.max_global = max_global or Config.ADMISSION_MAX_GLOBAL
+        self.max_queue = Config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.slot_dir = slot_dir or Config.ADMISSION_SLOT_DIR
+        self.poll_interval = Config.ADMISSION_POLL_INTERVAL
+        self.max_wait = Config.ADMISSION_MAX_WAIT
+        self.accepting = True
+        self._queue = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+        # Recent generation wall time, used to estimate Retry-After
+        self._avg_duration = Config.ADMISSION_DEFAULT_DURATION
+
+    def enqueue(self) -> Ticket:
+        """Join the wait queue or raise AdmissionRejected"""
+        with self._lock:
+            if not self.accepting:
+                metrics.ADMISSION_REJECTIONS.labels('503').inc()
+                raise AdmissionRejected("Server is not accepting new generations", 503, self.retry_after())
+            can_start_now = not self._queue and self._running < self.max_per_worker
+            if not can_start_now and len(self._queue) >= self.max_queue:
+                metrics.ADMISSION_REJECTIONS.labels('429').inc()
+                raise AdmissionRejected("Too many generations queued, please retry later", 429,
+                                        self.retry_after())
+            ticket = Ticket(self)
+            self._queue.append(ticket)
+            metrics.GENERATIONS_QUEUED.inc()
+            return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        with self._lock:
+            try:
+                return self._queue.index(ticket) + 1
+            except ValueError:
+                return 0
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queued request would start"""
+        waiting = len(self._queue) + 1
+        return max(1, math.ceil(self._avg_duration * waiting / self.max_per_worker))
+
+    def stats(self) -> dict:
+        return {'running': self._running, 'queued': len(self._queue), 'accepting': self.accepting}
+
+    def _try_admit(self, ticket: Ticket) -> bool:
+        with self._lock:
+            if ticket.admitted:
+                return True
+            if not self._queue or self._queue[0] is not ticket or self._running >= self.max_per_worker:
+                return False
+            slot_file = self._acquire_global_slot()
+            if slot_file is None:
+                return False
+            self._queue.popleft()
+            self._running += 1
+            ticket._slot_file = slot_file
+            ticket.admitted = True
+            ticket.admitted_at = time.monotonic()
+        metrics.GENERATIONS_QUEUED.dec()
+        metrics.GENERATIONS_IN_FLIGHT.inc()
+        metrics.ADMISSION_WAIT.observe(ticket.admitted_at - ticket.enqueued_at)
+        return True
+
+    def _release(self, ticket: Ticket) -> None:
+        with self._lock:
+            if not ticket.admitted:
+                try:
+                    self._queue.remove(ticket)
+                    metrics.GENERATIONS_QUEUED.dec()
+                except ValueError:
+                    pass
+                return
+            self._running -= 1
+            duration = time.monotonic() - ticket.admitted_at
+            self._avg_duration += 0.2 * (duration - self._avg_duration)
+        metrics.GENERATIONS_IN_FLIGHT.dec()
+        fcntl.flock(ticket._slot_file, fcntl.LOCK_UN)
+        ticket._slot_file.close()
+
+    def _acquire_global_slot(self) -> Optional[object]:
+        os.makedirs(self.slot_dir, exist_ok=True)
+        for slot in range(self.max_global):
+            slot_file = open(os.path.join(self.slot_dir, f"slot-{slot}.lock"), 'w')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_file
+            except BlockingIOError:
+                slot_file.close()
+        return None
@@ -0,0 +1,269 @@
+import os
+import re
+import sys
+import html
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from services.usage import section_kind
+
+logger = logging.getLogger(__name__)
+
+# Top-level sections as write_research_paper emits them; other '## ' lines belong to the section text
+_SECTION_HEADING = re.compile(r'^## (Introduction|Conclusion|References|Chapter \d+: .+)\s*$')
+_QUERY_TERM = re.compile(r'"([^"]*)"|(\w+)(\*?)')
+_WORD = re.compile(r'\w+')
+_MARK_START, _MARK_END = '\x02', '\x03'  # Snippet markers, swapped for <mark> after escaping
+
+
+def fts_query(text: str) -> str:
+    """User input as an FTS5 query: every word must match, "quoted phrases" stay phrases, abc* matches prefixes"""
+    terms = []
+    for phrase, word, star in _QUERY_TERM.findall(text or ''):
+        if phrase:
+            words = _WORD.findall(phrase)
+            if words:
+                terms.append('"' + ' '.join(words) + '"')
+        elif word:
+            # Shorter prefixes match a large share of the archive, too slow to rank
+            terms.append(f'"{word}"{star if len(word) >= 3 else ""}')
+    return ' '.join(terms)
+
+
+def parse_paper(text: str) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    """Subject and (title, text) sections of a paper's markdown file"""
+    subject = None
+    sections = []
+    title, lines = None, []
+    for line in text.splitlines():
+        if subject is None and line.startswith('# '):
+            subject = line[2:].strip()
+            subject = subject[len('Research Paper: '):] if subject.startswith('Research Paper: ') else subject
+            continue
+        match = _SECTION_HEADING.match(line)
+        if match:
+            if title is not None:
+                sections.append((title, '\n'.join(lines).strip()))
+            title, lines = match.group(1), []
+        elif title is not None:
+            lines.append(line)
+    if title is not None:
+        sections.append((title, '\n'.join(lines).strip()))
+    return subject, [(title, body) for title, body in sections
+                     if body and not body.startswith('[Error generating this section')]
+
+
+class PaperArchive:
+    """Full-text index of generated papers in SQLite FTS5.
+
+    Every paper is recorded as it is written, one row per section with
+    its metadata, in the shared archive database; the markdown files stay
+    the source of truth. reindex() brings the index in line with the
+    output folder, only re-reading files whose size or mtime changed.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.ARCHIVE_DB_PATH
+        self._conn = None  # Opened on first use, so importing the app leaves no files behind
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._connection().execute(query, params).fetchall()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The database connection, opened with its schema on first use; the caller holds the lock"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS papers (
+                paper_id TEXT PRIMARY KEY, subject TEXT NOT NULL, model TEXT, tenant TEXT, created_at REAL NOT NULL,
+                duration REAL, prompt_tokens INTEGER, completion_tokens INTEGER, words INTEGER NOT NULL,
+                path TEXT, mtime REAL, size INTEGER)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS papers_created ON papers (created_at)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY, paper_id TEXT NOT NULL, position INTEGER NOT NULL, subject TEXT NOT NULL,
+                title TEXT NOT NULL, kind TEXT NOT NULL, body TEXT NOT NULL, words INTEGER NOT NULL, duration REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS sections_paper ON sections (paper_id)')
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sections_fts'").fetchall():
+                # The text lives once, in sections; the FTS table only holds the index over it
+                conn.execute('''CREATE VIRTUAL TABLE sections_fts USING fts5(
+                    subject, title, body, content='sections', content_rowid='id', tokenize='porter unicode61')''')
+                # Title hits weigh most, then the subject, then the text
+                conn.execute("INSERT INTO sections_fts (sections_fts, rank) VALUES ('rank', 'bm25(2.0, 4.0, 1.0)')")
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS sections_insert AFTER INSERT ON sections BEGIN
+                INSERT INTO sections_fts (rowid, subject, title, body) VALUES (new.id, new.subject, new.title, new.body);
+                END''')
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS sections_delete AFTER DELETE ON sections BEGIN
+                INSERT INTO sections_fts (sections_fts, rowid, subject, title, body)
+                VALUES ('delete', old.id, old.subject, old.title, old.body);
+                END''')
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection().execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def add_paper(self, paper_id: str, subject: str, sections: List[Tuple[str, str]], model: str = None,
+                  tenant: str = None, duration: float = None, tokens: Tuple[int, int] = None,
+                  durations: Dict[str, float] = None, path: str = None) -> None:
+        """Record a written paper, replacing an earlier version of it; durations are per section title"""
+        stat = os.stat(path) if path else None
+        with self._transaction() as conn:
+            self._store(conn, paper_id, subject, sections, durations or {},
+                        (model, tenant, time.time(), duration) + tuple(tokens or (None, None)), path, stat)
+
+    def _store(self, conn: sqlite3.Connection, paper_id: str, subject: str, sections: List[Tuple[str, str]],
+               durations: Dict[str, float], metadata: tuple, path: Optional[str], stat) -> None:
+        sections = [(title, text) for title, text in sections if title != 'Index' and text and text.strip()]
+        counts = [len(_WORD.findall(text)) for _, text in sections]
+        conn.execute('DELETE FROM sections WHERE paper_id = ?', (paper_id,))
+        conn.execute('INSERT OR REPLACE INTO papers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (paper_id, subject) + metadata + (sum(counts), path,
+                                                       stat.st_mtime if stat else None, stat.st_size if stat else None))
+        conn.executemany(
+            'INSERT INTO sections (paper_id, position, subject, title, kind, body, words, duration) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(paper_id, position, subject, title, section_kind(title), text, count, durations.get(title))
+             for position, ((title, text), count) in enumerate(zip(sections, counts))])
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, tenant: str = None, model: str = None,
+               kind: str = None, since: float = None) -> Dict:
+        """Best matching sections, with a highlighted snippet; tenant restricts to that tenant's papers"""
+        match = fts_query(query)
+        if not match:
+            return {'query': query, 'results': [], 'has_more': False}
+        filters, params = ['sections_fts MATCH ?'], [match]
+        for column, value in (('p.tenant', tenant), ('p.model', model), ('s.kind', kind)):
+            if value is not None:
+                filters.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            filters.append('p.created_at >= ?')
+            params.append(since)
+        start = time.monotonic()
+        rows = self._execute(
+            f'''SELECT s.paper_id, s.position, s.title, s.kind, s.words, p.subject, p.model, p.created_at,
+                       snippet(sections_fts, 2, ?, ?, '…', ?), sections_fts.rank
+                FROM sections_fts JOIN sections s ON s.id = sections_fts.rowid JOIN papers p ON p.paper_id = s.paper_id
+                WHERE {' AND '.join(filters)}
+                ORDER BY sections_fts.rank LIMIT ? OFFSET ?''',
+            [_MARK_START, _MARK_END, Config.ARCHIVE_SNIPPET_TOKENS] + params + [limit + 1, offset])
+        results = [{
+            'paper_id': paper_id, 'position': position, 'title': title, 'kind': section, 'words': words,
+            'subject': subject, 'model': paper_model, 'created_at': created_at,
+            'snippet': html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'),
+            'score': round(-rank, 4)
+        } for paper_id, position, title, section, words, subject, paper_model, created_at, snippet, rank in rows[:limit]]
+        return {'query': query, 'results': results, 'has_more': len(rows) > limit,
+                'took_ms': round((time.monotonic() - start) * 1000, 2)}
+
+    def paper(self, paper_id: str, tenant: str = None) -> Optional[Dict]:
+        """Metadata and section list of one archived paper"""
+        rows = self._execute(
+            '''SELECT subject, model, tenant, created_at, duration, prompt_tokens, completion_tokens, words
+               FROM papers WHERE paper_id = ?''', (paper_id,))
+        if not rows or (tenant is not None and rows[0][2] != tenant):
+            return None
+        subject, model, owner, created_at, duration, prompt_tokens, completion_tokens, words = rows[0]
+        sections = self._execute(
+            'SELECT position, title, kind, words, duration FROM sections WHERE paper_id = ? ORDER BY position',
+            (paper_id,))
+        return {
+            'paper_id': paper_id, 'subject': subject, 'model': model, 'created_at': created_at,
+            'duration': duration, 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'words': words,
+            'sections': [{'position': position, 'title': title, 'kind': kind, 'words': count, 'duration': took}
+                         for position, title, kind, count, took in sections]
+        }
+
+    def reindex(self, directory: str = None, full: bool = False, batch: int = 500) -> Dict[str, int]:
+        """Index new and changed research_paper_*.md files and drop removed ones.
+
+        Files whose mtime and size match the index are skipped unless full
+        is set. Metadata known only at write time (model, tenant, tokens,
+        timings) is kept for papers that were already indexed.
+        """
+        directory = directory or Config.UPLOAD_FOLDER
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        if not os.path.isdir(directory):
+            return counts  # No paper written yet
+        known = {paper_id: (mtime, size) for paper_id, mtime, size in
+                 self._execute('SELECT paper_id, mtime, size FROM papers WHERE path IS NOT NULL')}
+        seen = set()
+        pending = []
+        for entry in os.scandir(directory):
+            if not (entry.name.startswith('research_paper_') and entry.name.endswith('.md')):
+                continue
+            paper_id = entry.name[:-3]
+            seen.add(paper_id)
+            stat = entry.stat()
+            if not full and known.get(paper_id) == (stat.st_mtime, stat.st_size):
+                counts['unchanged'] += 1
+                continue
+            pending.append((paper_id, entry.path, stat))
+            if len(pending) >= batch:
+                self._reindex_batch(pending, counts)
+                pending = []
+        if pending:
+            self._reindex_batch(pending, counts)
+
+        removed = [paper_id for paper_id in known if paper_id not in seen]
+        for start in range(0, len(removed), batch):
+            with self._transaction() as conn:
+                for paper_id in removed[start:start + batch]:
+                    conn.execute('DELETE FROM sections WHERE paper_id = ?', (paper_id,))
+                    conn.execute('DELETE FROM papers WHERE paper_id = ?', (paper_id,))
+        counts['removed'] = len(removed)
+        logger.info("Reindexed archive of %s: %s", directory, dict(counts))
+        return counts
+
+    def refresh(self, path: str) -> None:
+        """Re-read one paper file, e.g. after it was edited in place"""
+        self._reindex_batch([(os.path.basename(path)[:-3], path, os.stat(path))],
+                            {'indexed': 0, 'failed': 0})
+
+    def _reindex_batch(self, files: List[Tuple[str, str, os.stat_result]], counts: Dict[str, int]) -> None:
+        parsed = []
+        for paper_id, path, stat in files:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    subject, sections = parse_paper(f.read())
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning("Could not read %s for the archive: %s", path, e)
+                counts['failed'] += 1
+                continue
+            parsed.append((paper_id, path, stat, subject or paper_id, sections))
+        with self._transaction() as conn:
+            for paper_id, path, stat, subject, sections in parsed:
+                row = conn.execute('''SELECT model, tenant, created_at, duration, prompt_tokens, completion_tokens
+                                      FROM papers WHERE paper_id = ?''', (paper_id,)).fetchone()
+                durations = dict(conn.execute('SELECT title, duration FROM sections WHERE paper_id = ?',
+                                              (paper_id,)).fetchall())
+                metadata = row or (None, None, stat.st_mtime, None, None, None)
+                self._store(conn, paper_id, subject, sections, durations, metadata, path, stat)
+                counts['indexed'] += 1
+
+
+if __name__ == '__main__':
+    # python -m services.archive reindex [--full] [DIRECTORY]
+    args = sys.argv[1:]
+    if not args or args[0] != 'reindex':
+        sys.exit("usage: python -m services.archive reindex [--full] [DIRECTORY]")
+    logging.basicConfig(level=logging.INFO)
+    paths = [arg for arg in args[1:] if arg != '--full']
+    print(PaperArchive().reindex(paths[0] if paths else None, full='--full' in args))
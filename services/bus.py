@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+class Subscription:
+    """Messages for a set of topics, coalesced to the latest one per topic.
+
+    A slow reader never makes publishers wait or memory grow: whatever it
+    hasn't read yet is replaced by the newer message of the same topic.
+    """
+
+    def __init__(self, bus: 'EventBus', topics: Iterable[str]):
+        self.bus = bus
+        self.topics = set(topics)
+        self._pending: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def deliver(self, topic: str, message: Any) -> None:
+        with self._lock:
+            self._pending.pop(topic, None)
+            self._pending[topic] = message
+            self._ready.set()
+
+    def get(self, timeout: float = None) -> List[Tuple[str, Any]]:
+        """Wait for messages; returns those that arrived, oldest topic first, or [] on timeout"""
+        self._ready.wait(timeout)
+        with self._lock:
+            messages = list(self._pending.items())
+            self._pending.clear()
+            self._ready.clear()
+        return messages
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+    def __enter__(self) -> 'Subscription':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class EventBus:
+    """In-process publish/subscribe; publishing costs one dict lookup when nobody listens"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        subscription = Subscription(self, topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def publish(self, topic: str, message: Any) -> None:
+        subscribers = self._subscribers.get(topic)
+        if not subscribers:
+            return
+        for subscription in list(subscribers):
+            subscription.deliver(topic, message)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
@@ -0,0 +1,118 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteWriter:
+    """Appends provider interactions to gzip-compressed JSONL cassettes.
+
+    Every worker writes its own files, so no locking between processes is
+    needed. Each record is flushed as it is written; a cassette cut short
+    by a crash stays readable up to its last complete record.
+    """
+
+    def __init__(self, directory: str, max_records: int = 1000):
+        self.directory = directory
+        self.max_records = max_records
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._records = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, record: Dict) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._file is None or self._records >= self.max_records:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._records += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz")
+        self._file = gzip.open(path, 'ab')
+        self._records = 0
+
+
+def cassette_files(paths: Iterable[str]) -> List[str]:
+    """Expand files, directories and glob patterns into cassette files, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.jsonl.gz'))))
+        else:
+            files.extend(sorted(glob.glob(path)))
+    return files
+
+
+def read_cassettes(paths: Iterable[str]) -> Iterator[Dict]:
+    for path in cassette_files(paths):
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except EOFError:
+            pass  # Still being written, or cut short by a crash
+        except OSError as e:
+            logger.warning(f"Skipping unreadable cassette {path}: {str(e)}")
+
+
+def summarize(records: Iterable[Dict]) -> Dict[str, Dict]:
+    """Calls, errors, latency percentiles and throughput per model"""
+    by_model = defaultdict(list)
+    for record in records:
+        by_model[record['model']].append(record)
+    summary = {}
+    for model, calls in sorted(by_model.items()):
+        durations = sorted(call['duration'] for call in calls)
+        ok = [call for call in calls if not call.get('error')]
+        chars = sum(len(call.get('response') or '') for call in ok)
+        first_chunks = sorted(call['chunks'][0][0] for call in ok if call.get('chunks'))
+        summary[model] = {
+            'calls': len(calls),
+            'errors': len(calls) - len(ok),
+            'p50': _percentile(durations, 0.5),
+            'p95': _percentile(durations, 0.95),
+            'first_chunk_p50': _percentile(first_chunks, 0.5),
+            'chars_per_second': round(chars / max(sum(call['duration'] for call in ok), 1e-9), 1)
+        }
+    return summary
+
+
+def _percentile(values: List[float], q: float):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+if __name__ == '__main__':
+    # python -m services.cassette BASELINE [CANDIDATE]: per-model summary, side by side when comparing
+    runs = [summarize(read_cassettes([path])) for path in sys.argv[1:3]]
+    if not runs:
+        sys.exit("usage: python -m services.cassette BASELINE [CANDIDATE]")
+    for model in sorted(set().union(*runs)):
+        print(model)
+        for key in ('calls', 'errors', 'p50', 'p95', 'first_chunk_p50', 'chars_per_second'):
+            print(f"  {key:<18}" + ''.join(f"{str(run.get(model, {}).get(key)):>14}" for run in runs))
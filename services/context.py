@@ -0,0 +1,116 @@
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+from config import Config
+from services.outline import Outline
+from utils.tokens import count_tokens, truncate_to_tokens
+
+_SENTENCE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(])')
+_WORD = re.compile(r'[a-z]{4,}')
+
+
+class PaperContext:
+    """Compact, bounded context shared by the section prompts of one paper.
+
+    Holds a one-line outline and an extractive summary of every section
+    written so far. Whatever the paper's length, the rendered context stays
+    within token_budget: the newest summaries are kept longest, older ones
+    shrink to their key sentence and finally to their title.
+    """
+
+    def __init__(self, research_subject: str, outline: Optional[Outline] = None,
+                 token_budget: int = None, section_tokens: int = None):
+        self.research_subject = research_subject
+        self.token_budget = token_budget or Config.CONTEXT_TOKEN_BUDGET
+        self.section_tokens = section_tokens or Config.CONTEXT_SECTION_TOKENS
+        self.outline_line = self._outline_line(outline) if outline else ''
+        self._summaries: Dict[str, List[str]] = {}  # title -> ranked key sentences
+
+    def set_outline(self, outline: Outline) -> None:
+        """Add the outline once it is known; sections may already have been written without it"""
+        self.outline_line = self._outline_line(outline)
+
+    def add_section(self, title: str, content: str) -> None:
+        if title in self._summaries or not content:
+            return
+        self._summaries[title] = self._key_sentences(content)
+
+    def render(self) -> str:
+        """Context block within the token budget, empty if there is nothing yet"""
+        if not self.outline_line and not self._summaries:
+            return ''
+        header = "Context for consistency (build on it, do not repeat what is already covered):"
+        outline_line = truncate_to_tokens(self.outline_line, self.token_budget // 3)
+        remaining = self.token_budget - count_tokens(header) - count_tokens(outline_line)
+
+        lines = []
+        # Newest sections first: they get the full allowance, older ones less
+        for age, (title, sentences) in enumerate(reversed(list(self._summaries.items()))):
+            allowance = int(self.section_tokens * 0.7 ** age)
+            summary = self._fit(sentences, allowance) if allowance >= 12 else ''
+            line = f"- {title}: {summary}" if summary else f"- {title}"
+            cost = count_tokens(line)
+            if cost > remaining:
+                line = f"- {title}"
+                cost = count_tokens(line)
+                if cost > remaining:
+                    break
+            lines.append(line)
+            remaining -= cost
+        lines.reverse()
+
+        parts = [header]
+        if outline_line:
+            parts.append(outline_line)
+        if lines:
+            parts.append("Already written:")
+            parts.extend(lines)
+        return "\n".join(parts)
+
+    def augment(self, prompt: str) -> str:
+        context = self.render()
+        return f"{context}\n\n{prompt}" if context else prompt
+
+    def _fit(self, sentences: List[str], allowance: int) -> str:
+        chosen = []
+        used = 0
+        for sentence in sentences:
+            cost = count_tokens(sentence)
+            if used + cost > allowance:
+                if not chosen:
+                    chosen.append(truncate_to_tokens(sentence, allowance))
+                break
+            chosen.append(sentence)
+            used += cost
+        return ' '.join(chosen)
+
+    @staticmethod
+    def _outline_line(outline: Outline) -> str:
+        chapters = []
+        for chapter in outline.chapters:
+            if chapter.children:
+                chapters.append(f"{chapter.title} ({', '.join(child.title for child in chapter.children)})")
+            else:
+                chapters.append(chapter.title)
+        return "Paper outline: " + "; ".join(["Introduction"] + chapters + ["Conclusion"])
+
+    @staticmethod
+    def _key_sentences(content: str, limit: int = 4) -> List[str]:
+        """Most informative sentences, by frequency of the section's own terms"""
+        text = re.sub(r'^#+\s.*$', '', content, flags=re.MULTILINE)
+        text = re.sub(r'[*_`>|]', '', text)
+        sentences = list(dict.fromkeys(
+            s.strip() for s in _SENTENCE.split(' '.join(text.split())) if len(s.split()) >= 5
+        ))
+        if not sentences:
+            return []
+        frequencies = Counter(_WORD.findall(text.lower()))
+
+        def score(sentence: str) -> float:
+            words = _WORD.findall(sentence.lower())
+            return sum(frequencies[w] for w in set(words)) / (len(words) + 5)
+
+        ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)
+        # The opening sentence usually states the section's point, so keep it first
+        chosen = [0] + [i for i in ranked if i != 0][:limit - 1]
+        return [sentences[i] for i in chosen]
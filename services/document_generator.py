@@ -1,12 +1,14 @@
 import os
 import uuid
+import time
+import tempfile
 import subprocess
 from typing import List, Tuple
+from services import metrics
 
 class DocumentGenerator:
     def __init__(self, upload_folder):
         self.upload_folder = upload_folder
-        os.makedirs(self.upload_folder, exist_ok=True)
 
     def generate_filename(self) -> Tuple[str, str]:
         """Generate filenames with unique ID"""
@@ -15,15 +17,7 @@ class DocumentGenerator:
         docx_filename = f"research_paper_{unique_id}.docx"
         return md_filename, docx_filename
 
-    def convert_to_word(self, md_filename: str, docx_filename: str) -> None:
-        """Convert markdown file to Word document using Pandoc"""
-        md_path = os.path.join(self.upload_folder, md_filename)
-        docx_path = os.path.join(self.upload_folder, docx_filename)
-        
-        # Check if input file exists
-        if not os.path.exists(md_path):
-            raise Exception(f"Markdown file not found: {md_path}")
-        
+    def _command(self, md_path: str, docx_path: str) -> List[str]:
         command = [
             "pandoc", md_path,
             "-o", docx_path,
@@ -34,7 +28,32 @@ class DocumentGenerator:
         
         if os.path.exists("reference.docx"):
             command.extend(["--reference-doc", "reference.docx"])
+        return command
+
+    def warm_up(self) -> float:
+        """Convert a tiny document so the first real paper doesn't pay pandoc's startup; returns the seconds taken"""
+        with tempfile.TemporaryDirectory() as directory:
+            md_path = os.path.join(directory, "warmup.md")
+            with open(md_path, "w", encoding="utf-8") as f:
+                f.write("# Warm-up\n\n## Section\n\nText.\n")
+            start = time.monotonic()
+            subprocess.run(self._command(md_path, os.path.join(directory, "warmup.docx")),
+                           check=True, capture_output=True, timeout=60)
+            return round(time.monotonic() - start, 3)
+
+    def convert_to_word(self, md_filename: str, docx_filename: str) -> None:
+        """Convert markdown file to Word document using Pandoc"""
+        md_path = os.path.join(self.upload_folder, md_filename)
+        docx_path = os.path.join(self.upload_folder, docx_filename)
+        
+        # Check if input file exists
+        if not os.path.exists(md_path):
+            raise Exception(f"Markdown file not found: {md_path}")
+        
+        command = self._command(md_path, docx_path)
         
+        start = time.monotonic()
+        outcome = 'error'
         try:
             # Run pandoc with timeout and capture output
             result = subprocess.run(
@@ -48,10 +67,14 @@ class DocumentGenerator:
             # Check if output file was created
             if not os.path.exists(docx_path):
                 raise Exception("Word file was not created after conversion")
+            outcome = 'success'
+            metrics.record_output(docx_path, 'docx')
             
         except subprocess.TimeoutExpired:
             raise Exception("Conversion timed out after 60 seconds")
         except subprocess.CalledProcessError as e:
             raise Exception(f"Pandoc conversion failed: {e.stderr}")
         except Exception as e:
-            raise Exception(f"Conversion error: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Conversion error: {str(e)}")
+        finally:
+            metrics.PANDOC_DURATION.labels(outcome).observe(time.monotonic() - start)
\ No newline at end of file
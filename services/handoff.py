@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from config import Config
+from services.outline import Outline
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationSuspended(BaseException):
+    """Raised between sections once a draining worker's deadline has passed.
+
+    Derives from BaseException so the per-section `except Exception`
+    fallbacks in the stream don't swallow it.
+    """
+    def __init__(self, paper_id: str):
+        super().__init__(f"Generation {paper_id} suspended for handoff")
+        self.paper_id = paper_id
+
+
+class PaperCheckpoint:
+    """Durable state of one in-flight paper, enough for any worker to resume it.
+
+    The owning worker holds an exclusive flock on the paper's lock file while
+    it generates; the kernel drops it if the worker dies, so a checkpoint is
+    resumable exactly when nobody holds that lock.
+    """
+
+    def __init__(self, store: 'CheckpointStore', paper_id: str, params: Dict, tenant: str,
+                 md_filename: str, docx_filename: str):
+        self.store = store
+        self.paper_id = paper_id
+        self.params = params
+        self.tenant = tenant
+        self.md_filename = md_filename
+        self.docx_filename = docx_filename
+        self.outline: Optional[Outline] = None
+        self.generated: Dict[str, str] = {}
+        self.drafts: Dict[str, str] = {}
+        self._lock_file = None
+        self._save_lock = threading.Lock()  # Sections may finish concurrently
+        self._closed = False
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.store.directory, f"{self.paper_id}.json")
+
+    def save(self, status: str = 'running') -> None:
+        with self._save_lock:
+            if not self._closed:
+                self._write(status)
+
+    def _write(self, status: str) -> None:
+        state = {
+            'paper_id': self.paper_id,
+            'status': status,
+            'params': self.params,
+            'tenant': self.tenant,
+            'md_filename': self.md_filename,
+            'docx_filename': self.docx_filename,
+            'outline': self.outline.to_dict() if self.outline is not None else None,
+            'generated': dict(self.generated),
+            'drafts': dict(self.drafts),
+            'updated_at': time.time()
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def suspend(self) -> None:
+        """Save the current state and let another worker claim it"""
+        try:
+            with self._save_lock:
+                if not self._closed:
+                    self._write('suspended')
+                self._closed = True  # Whoever claims it owns the file now; a late section mustn't overwrite it
+            logger.info("Checkpointed %s with %d sections for handoff", self.paper_id, len(self.generated))
+        finally:
+            self._unlock()
+
+    def release(self) -> None:
+        """Give up ownership without touching the saved state"""
+        self._unlock()
+
+    def discard(self) -> None:
+        """Drop the checkpoint once the paper reached a final outcome"""
+        with self._save_lock:
+            self._closed = True  # A section still finishing mustn't recreate it
+        for path in (self.path, self.store.lock_path(self.paper_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._unlock()
+
+    def _lock(self) -> bool:
+        lock_file = open(self.store.lock_path(self.paper_id), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _unlock(self) -> None:
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class CheckpointStore:
+    """Checkpoints of in-flight papers under Config.STATE_FOLDER"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or Config.STATE_FOLDER
+        self.prune()
+
+    def lock_path(self, paper_id: str) -> str:
+        return os.path.join(self.directory, f"{paper_id}.lock")
+
+    def _listdir(self) -> List[str]:
+        # Created by the first checkpoint, not on import
+        return os.listdir(self.directory) if os.path.isdir(self.directory) else []
+
+    def create(self, paper_id: str, params: Dict, tenant: str, md_filename: str,
+               docx_filename: str) -> PaperCheckpoint:
+        checkpoint = PaperCheckpoint(self, paper_id, params, tenant, md_filename, docx_filename)
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint._lock()
+        return checkpoint
+
+    def claim(self, paper_id: str) -> Optional[PaperCheckpoint]:
+        """Take over a suspended or orphaned paper; None if unknown or still owned"""
+        path = os.path.join(self.directory, f"{os.path.basename(paper_id)}.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        checkpoint = PaperCheckpoint(self, state['paper_id'], state['params'], state['tenant'],
+                                     state['md_filename'], state['docx_filename'])
+        if not checkpoint._lock():
+            return None
+        checkpoint.outline = Outline.from_dict(state['outline']) if state.get('outline') else None
+        checkpoint.generated = state.get('generated') or {}
+        checkpoint.drafts = state.get('drafts') or {}
+        return checkpoint
+
+    def resumable(self, tenant: str = None) -> List[Dict]:
+        """Checkpoints nobody is working on, optionally for one tenant"""
+        entries = []
+        for name in self._listdir():
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if tenant and state.get('tenant') != tenant:
+                continue
+            if not self._is_free(state['paper_id']):
+                continue
+            entries.append({
+                'paper_id': state['paper_id'],
+                'subject': state['params'].get('subject'),
+                'sections_done': len(state.get('generated') or {}),
+                'updated_at': state['updated_at']
+            })
+        return entries
+
+    def prune(self) -> None:
+        """Forget checkpoints nobody resumed within STATE_RETENTION"""
+        cutoff = time.time() - Config.STATE_RETENTION
+        for name in self._listdir():
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.json') and os.path.getmtime(path) < cutoff and \
+                        self._is_free(name[:-len('.json')]):
+                    os.remove(path)
+                    os.remove(self.lock_path(name[:-len('.json')]))
+            except OSError:
+                pass
+
+    def _is_free(self, paper_id: str) -> bool:
+        probe = PaperCheckpoint(self, paper_id, {}, '', '', '')
+        if not probe._lock():
+            return False
+        probe._unlock()
+        return True
+
+
+class DrainManager:
+    """Graceful drain of a worker that gunicorn is about to stop.
+
+    Once started the worker stops admitting generations; in-flight papers
+    keep going for DRAIN_GRACE_PERIOD and are then suspended at their next
+    section boundary, leaving a checkpoint another worker can resume.
+    """
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.grace_period = Config.DRAIN_GRACE_PERIOD
+        self.started_at = None
+
+    @property
+    def draining(self) -> bool:
+        return self.started_at is not None
+
+    def start(self) -> None:
+        if self.draining:
+            return
+        self.started_at = time.monotonic()
+        self.admission.accepting = False
+        logger.info(f"Draining worker {os.getpid()}: {self.admission.stats()['running']} generations in flight, "
+                    f"handing off after {self.grace_period}s")
+
+    def expired(self) -> bool:
+        return self.draining and time.monotonic() - self.started_at >= self.grace_period
+
+    def watch(self, is_alive: Callable[[], bool], interval: float = 1.0) -> None:
+        """Start draining as soon as is_alive() turns false, e.g. gunicorn's worker.alive"""
+        def run():
+            while is_alive():
+                time.sleep(interval)
+            self.start()
+        threading.Thread(target=run, name='drain-watch', daemon=True).start()
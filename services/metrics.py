@@ -0,0 +1,173 @@
+import os
+import time
+from functools import wraps
+from typing import Iterable
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from config import Config
+
+# When PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py and asgi.py) every worker writes
+# its samples to that directory and /metrics aggregates them across workers.
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 190, 300, 600)
+
+GENERATIONS_IN_FLIGHT = Gauge(
+    'research_generations_in_flight', 'Admitted papers currently being generated by this worker',
+    multiprocess_mode='liveall'
+)
+GENERATIONS_QUEUED = Gauge(
+    'research_generations_queued', 'Generations waiting for admission', multiprocess_mode='livesum'
+)
+ADMISSION_REJECTIONS = Counter(
+    'research_admission_rejections_total', 'Generations turned away by admission control', ['status']
+)
+ADMISSION_WAIT = Histogram(
+    'research_admission_wait_seconds', 'Time generations spent in the admission queue',
+    buckets=(0.1, 1, 5, 10, 30, 60, 120, 300)
+)
+SCHEDULER_QUEUED = Gauge(
+    'research_scheduler_queued_calls', 'Provider calls waiting in the fair scheduler', multiprocess_mode='livesum'
+)
+SCHEDULER_WAIT = Histogram(
+    'research_scheduler_wait_seconds', 'Time provider calls waited in the fair scheduler',
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120)
+)
+GENERATIONS_TOTAL = Counter(
+    'research_generations_total', 'Finished /api/stream generations by outcome', ['outcome']
+)
+GENERATION_DURATION = Histogram(
+    'research_generation_duration_seconds', 'Wall time of a whole /api/stream generation',
+    buckets=LATENCY_BUCKETS + (900, 1800)
+)
+CHAPTER_DURATION = Histogram(
+    'research_chapter_duration_seconds', 'Wall time of one chapter, from the progress model', ['status'],
+    buckets=LATENCY_BUCKETS
+)
+DEADLINE_RESULTS = Counter(
+    'research_deadline_results_total', 'Generations with a time budget, by whether they met it', ['result']
+)
+DEADLINE_BUDGET_USED = Histogram(
+    'research_deadline_budget_used_ratio', 'Wall time of a generation as a share of its time budget',
+    buckets=(0.25, 0.5, 0.75, 0.9, 1, 1.1, 1.25, 1.5, 2, 3)
+)
+PROVIDER_REQUEST_DURATION = Histogram(
+    'research_provider_request_duration_seconds', 'Latency of a single AI service call',
+    ['provider', 'model', 'outcome'], buckets=LATENCY_BUCKETS
+)
+GENERATE_CONTENT_DURATION = Histogram(
+    'research_generate_content_duration_seconds', 'Latency of ModelProvider.generate_content including retries',
+    ['outcome'], buckets=LATENCY_BUCKETS
+)
+PROVIDER_FALLBACKS = Counter(
+    'research_provider_fallbacks_total', 'Calls answered by a fallback model instead of the requested one',
+    ['provider', 'model']
+)
+GATEWAY_REQUESTS = Counter(
+    'research_gateway_requests_total', 'Chat completions served by the /v1 gateway', ['outcome', 'cache']
+)
+POOL_EJECTIONS = Counter(
+    'research_pool_ejections_total', 'Provider pool members ejected after repeated failures, by position in the pool',
+    ['provider', 'member']
+)
+QUALITY_REJECTIONS = Counter(
+    'research_quality_rejections_total', 'Provider responses rejected by the quality gate',
+    ['reason', 'stage']
+)
+CONTINUATIONS = Counter(
+    'research_continuations_total', 'Continuation calls for responses cut off at max_tokens',
+    ['section', 'outcome']
+)
+RETRIES = Counter(
+    'research_retries_total', 'Retries performed by the retry decorator', ['operation']
+)
+PANDOC_DURATION = Histogram(
+    'research_pandoc_conversion_seconds', 'Time spent converting markdown to Word with pandoc',
+    ['outcome'], buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+)
+OUTPUT_BYTES = Counter(
+    'research_output_bytes_total', 'Bytes written to the output folder', ['format']
+)
+
+# Model names come from clients; only those the catalog lists become label values
+_known_models = frozenset(Config.DEFAULT_MODELS)
+
+
+def set_known_models(models: Iterable[str]) -> None:
+    """Models that may appear as a 'model' label, as of the latest catalog snapshot"""
+    global _known_models
+    _known_models = frozenset(Config.DEFAULT_MODELS).union(models)
+
+
+def model_label(model: str) -> str:
+    if not model:
+        return 'default'
+    return model if model in _known_models else 'other'
+
+
+def observe_provider_call(func):
+    """Time an AI service's generate_content call, labelled by provider and model"""
+    @wraps(func)
+    def wrapper(self, model, *args, **kwargs):
+        start = time.monotonic()
+        outcome = 'error'
+        try:
+            result = func(self, model, *args, **kwargs)
+            outcome = 'success'
+            return result
+        finally:
+            PROVIDER_REQUEST_DURATION.labels(self.name, model_label(model), outcome).observe(time.monotonic() - start)
+    return wrapper
+
+
+def timed(histogram):
+    """Record a function's duration in a histogram with an 'outcome' label"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'success'
+                return result
+            finally:
+                histogram.labels(outcome).observe(time.monotonic() - start)
+        return wrapper
+    return decorator
+
+
+def count_retry(operation: str):
+    """on_retry callback for utils.retry_decorator.retry"""
+    counter = RETRIES.labels(operation)
+    return lambda exception, attempt: counter.inc()
+
+
+def record_output(path: str, file_format: str) -> None:
+    try:
+        OUTPUT_BYTES.labels(file_format).inc(os.path.getsize(path))
+    except OSError:
+        pass
+
+
+def render_latest():
+    """Return (body, content_type) for the /metrics endpoint"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def track_generation(events, job):
+    """Wrap an SSE event generator with outcome and duration metrics.
+
+    The generator reports how it finished through the job's progress model;
+    a stream closed before it finished was dropped by the client.
+    """
+    try:
+        yield from events
+    finally:
+        GENERATIONS_TOTAL.labels(job.outcome or 'disconnected').inc()
+        GENERATION_DURATION.observe(job.elapsed)
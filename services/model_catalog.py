@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from config import Config
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot(NamedTuple):
+    """Immutable, pre-serialized view of the model catalog"""
+    body: bytes
+    etag: str
+    models: List[str]
+    generated_at: float
+
+
+class ModelHealth:
+    """Per-worker success/failure and latency statistics for each model"""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ok: bool, latency: float) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(model, {'success': 0, 'failure': 0, 'latency': None, 'last_error_at': None})
+            if ok:
+                stats['success'] += 1
+                # Only successful calls say anything useful about latency
+                if stats['latency'] is None:
+                    stats['latency'] = latency
+                else:
+                    stats['latency'] += self.alpha * (latency - stats['latency'])
+            else:
+                stats['failure'] += 1
+                stats['last_error_at'] = time.time()
+
+    def export(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {model: dict(stats) for model, stats in self._stats.items()}
+
+    @staticmethod
+    def merge(exports: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+        """Combine health exports from several workers into one view"""
+        merged: Dict[str, Dict] = {}
+        for export in exports:
+            for model, stats in export.items():
+                current = merged.setdefault(model, {'success': 0, 'failure': 0, 'latency': None, 'last_error_at': None})
+                total_before = current['success']
+                current['success'] += stats.get('success', 0)
+                current['failure'] += stats.get('failure', 0)
+                if stats.get('latency') is not None:
+                    if current['latency'] is None:
+                        current['latency'] = stats['latency']
+                    elif current['success']:
+                        # Weight each worker's latency by its number of successful calls
+                        current['latency'] = (current['latency'] * total_before +
+                                              stats['latency'] * stats.get('success', 0)) / current['success']
+                if stats.get('last_error_at'):
+                    current['last_error_at'] = max(current['last_error_at'] or 0, stats['last_error_at'])
+        return merged
+
+    @staticmethod
+    def describe(stats: Optional[Dict]) -> Dict:
+        """Turn raw counters into the health block served to clients"""
+        if not stats or not (stats['success'] + stats['failure']):
+            return {'status': 'unknown', 'success': 0, 'failure': 0, 'latency_ms': None}
+        total = stats['success'] + stats['failure']
+        failure_rate = stats['failure'] / total
+        if failure_rate < 0.2:
+            status = 'healthy'
+        elif failure_rate < 0.5:
+            status = 'degraded'
+        else:
+            status = 'unhealthy'
+        latency = stats.get('latency')
+        return {
+            'status': status,
+            'success': stats['success'],
+            'failure': stats['failure'],
+            'latency_ms': round(latency * 1000) if latency is not None else None
+        }
+
+
+class ModelCatalog:
+    """Model catalog refreshed in the background and shared across workers.
+
+    Request handlers only ever read the current snapshot. Listing models from
+    the provider happens on a background thread, and the serialized result is
+    written to a shared file so every gunicorn worker serves the same bytes.
+    A file lock makes sure only one worker refreshes at a time.
+    """
+
+    def __init__(self, provider, path: str = None, refresh_interval: int = None):
+        self.provider = provider
+        self.path = path or Config.MODEL_CATALOG_PATH
+        self.refresh_interval = refresh_interval or Config.MODEL_CATALOG_REFRESH_INTERVAL
+        self.health_dir = os.path.join(os.path.dirname(self.path), 'health')
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._snapshot_mtime = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._refreshed = threading.Event()
+
+    def start(self) -> None:
+        """Start the background refresher once per process"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='model-catalog', daemon=True)
+            self._thread.start()
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Return the current snapshot without ever calling the provider"""
+        self.start()
+        self._load_shared()
+        if self._snapshot is None:
+            # Nothing refreshed yet: serve the static defaults until the refresher catches up
+            self._snapshot = self._build_snapshot(list(Config.DEFAULT_MODELS), {}, persist=False)
+        return self._snapshot
+
+    def models(self) -> List[str]:
+        return self.snapshot().models
+
+    def refresh(self) -> CatalogSnapshot:
+        """List models from the provider and publish a new shared snapshot"""
+        models = self.provider.get_available_models()
+        snapshot = self._build_snapshot(models, self._collect_health())
+        self._refreshed.set()
+        return snapshot
+
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """Block until this process has seen a refreshed snapshot"""
+        self.start()
+        self._load_shared()
+        if self._snapshot_mtime is not None:
+            return True
+        return self._refreshed.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._write_own_health()
+                if self._is_stale():
+                    self._refresh_if_leader()
+            except Exception as e:
+                logger.warning(f"Model catalog refresh failed: {str(e)}")
+            # Jitter keeps workers from waking up in lockstep
+            time.sleep(self._tick_interval() * random.uniform(0.8, 1.2))
+
+    def _tick_interval(self) -> float:
+        return max(1.0, min(self.refresh_interval, 60))
+
+    def _is_stale(self) -> bool:
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        return age >= self.refresh_interval
+
+    def _refresh_if_leader(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another worker is refreshing
+            try:
+                # Re-check under the lock, another worker may have just finished
+                if self._is_stale():
+                    self.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _build_snapshot(self, models: List[str], health: Dict[str, Dict], persist: bool = True) -> CatalogSnapshot:
+        service = self.provider.service
+        generated_at = time.time()
+        document = {
+            'provider': service.name,
+            'generated_at': datetime.fromtimestamp(generated_at, timezone.utc).isoformat(),
+            'models': [
+                {
+                    'id': model,
+                    'capabilities': service.get_model_capabilities(model),
+                    'health': ModelHealth.describe(health.get(model))
+                }
+                for model in models
+            ]
+        }
+        body = json.dumps(document, separators=(',', ':')).encode('utf-8')
+        if persist:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self.path)
+        snapshot = CatalogSnapshot(body, self._etag(body), list(models), generated_at)
+        self._snapshot = snapshot
+        metrics.set_known_models(models)
+        return snapshot
+
+    def _load_shared(self) -> None:
+        """Pick up a snapshot published by any worker, if it changed"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._snapshot_mtime:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                body = f.read()
+            document = json.loads(body)
+            models = [entry['id'] for entry in document.get('models', [])]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable model catalog: {str(e)}")
+            return
+        self._snapshot = CatalogSnapshot(body, self._etag(body), models, mtime / 1e9)
+        self._snapshot_mtime = mtime
+        metrics.set_known_models(models)
+
+    def _write_own_health(self) -> None:
+        export = self.provider.health.export()
+        if not export:
+            return
+        tmp_path = os.path.join(self.health_dir, f"{os.getpid()}.json.tmp")
+        os.makedirs(self.health_dir, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(export, f)
+        os.replace(tmp_path, os.path.join(self.health_dir, f"{os.getpid()}.json"))
+
+    def _collect_health(self) -> Dict[str, Dict]:
+        """Merge health reports from all live workers"""
+        exports = [self.provider.health.export()]
+        cutoff = time.time() - 3 * self.refresh_interval
+        for filename in (os.listdir(self.health_dir) if os.path.isdir(self.health_dir) else []):
+            if not filename.endswith('.json') or filename == f"{os.getpid()}.json":
+                continue
+            path = os.path.join(self.health_dir, filename)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)  # Worker is gone
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    exports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return ModelHealth.merge(exports)
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return hashlib.sha1(body).hexdigest()
@@ -1,18 +1,95 @@
-import os
+import json
+import hashlib
+import itertools
 import g4f
 import requests
+from g4f.providers.response import FinishReason
 import openai
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 from datetime import datetime
 from config import Config
 from utils.retry_decorator import retry
+from services.model_catalog import ModelHealth
+from services import metrics
+from services.scheduler import FairScheduler, current_tenant
+from services.usage import UsageLedger, RoutingPolicy, current_paper
+from services.quality import HEAD_CHARS, QualityGate, ResponseRejected, StreamMonitor, StreamRelay
+from services.cassette import CassetteWriter, read_cassettes
+from services.pool import EndpointPool
+from utils.tokens import WORDS_PER_TOKEN, count_tokens
+from utils.logs import in_span
+from services.outline import Outline, OutlineNode, OUTLINE_SCHEMA, DEFAULT_CHAPTERS, parse_outline
+from services.references import REFERENCES_SCHEMA, parse_references, references_prompt
 import logging
 import time
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PREFERRED_MODELS = ['gpt-4o', 'gpt-4', 'claude-2']
+_g4f_models = None
+
+CONTINUATION_PROMPT = (
+    "{prompt}\n\nYour answer was cut off. This is what you wrote so far:\n\n{text}\n\n"
+    "Continue exactly where it stops. Do not repeat or summarize anything above and do not start over; "
+    "reply with the remaining text only."
+)
+
+
+def prioritized_g4f_models() -> List[str]:
+    """Sorted g4f model list with preferred models first, computed once per process"""
+    global _g4f_models
+    if _g4f_models is None:
+        models = sorted(g4f.models._all_models)
+        for preferred in reversed(PREFERRED_MODELS):
+            if preferred in models:
+                models.remove(preferred)
+                models.insert(0, preferred)
+        _g4f_models = models
+    return _g4f_models.copy()
+
+
+class Completion(str):
+    """Generated text that also carries the provider's metadata.
+
+    Behaves as a plain str everywhere; usage holds the provider-reported
+    'prompt_tokens' and 'completion_tokens' when the API returns them.
+    """
+
+    def __new__(cls, text: Optional[str], model: str = None, finish_reason: str = None, usage: Dict = None):
+        completion = super().__new__(cls, text or '')
+        completion.model = model
+        completion.finish_reason = finish_reason
+        completion.usage = usage or {}
+        return completion
+
+
+def token_limit(section: str = None, words: int = None) -> Optional[int]:
+    """max_tokens for a section's word target plus TOKEN_LIMIT_MARGIN; None leaves it to the provider"""
+    words = words or Config.SECTION_WORDS.get(section)
+    if not words:
+        return None
+    tokens = int(words / WORDS_PER_TOKEN * Config.TOKEN_LIMIT_MARGIN)
+    return max(Config.TOKEN_LIMIT_MIN, min(tokens, Config.TOKEN_LIMIT_MAX))
+
+
+def join_continuation(text: str, part: str) -> str:
+    """Append a continuation, dropping the overlap when the model repeated the end of what it was given"""
+    head = part.lstrip()
+    for size in range(min(len(text), len(head), 300), 20, -1):
+        if text.endswith(head[:size]):
+            return text + head[size:]
+    if not text or not part or text[-1].isspace() or part[0].isspace() or not head[0].isalnum():
+        return text + part
+    return f"{text} {part}"
+
+
 class BaseAIService:
     """Base class for AI services with standardized request handling"""
+    name = 'base'
+    supports_streaming = False
+    supports_json_schema = False
+    reports_truncation = False  # Whether a completion cut off at max_tokens comes back with finish_reason 'length'
+    pool: Optional[EndpointPool] = None  # Endpoint/key pairs of HTTP services
+
     def __init__(self, config: Dict):
         self.config = config
         self.session = requests.Session()  # Reuse session for all requests
@@ -26,24 +103,61 @@ class BaseAIService:
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            logger.error(f"API request failed: {str(e)}")
+            logger.error("API request failed: %s", e)
             raise
 
-    def generate_content(self, model: str, prompt: str) -> str:
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
+        """Generate a completion.
+
+        response_format is only honoured when supports_json_schema is set.
+        Streaming services feed monitor every chunk, which raises
+        ResponseRejected to abandon a bad response early. max_tokens caps
+        the completion and temperature sets the sampling, the service's
+        configured 'max_tokens' and 'temperature' when None.
+        """
         raise NotImplementedError
 
     def get_available_models(self) -> List[str]:
         raise NotImplementedError
 
+    def preconnect(self) -> int:
+        """Open a connection to every pool member so no call pays for DNS and TLS; returns how many answered"""
+        if self.pool is None:
+            return 0
+        reached = 0
+        for member in self.pool.members:
+            try:
+                # Any status will do, the point is the pooled connection
+                self.session.head(member.base_url, timeout=Config.WARMUP_CONNECT_TIMEOUT)
+                reached += 1
+            except requests.RequestException as e:
+                logger.warning("Could not preconnect to %s pool member %s: %s", self.name, member.label, e)
+        return reached
+
+    def get_model_capabilities(self, model: str) -> Dict:
+        """Capabilities advertised in the model catalog"""
+        return {
+            'streaming': self.supports_streaming,
+            'json_schema': self.supports_json_schema
+        }
+
 
 class G4FService(BaseAIService):
     """Service for g4f provider with primary model fallback"""
-    
+    name = 'g4f'
+    supports_streaming = True
+    reports_truncation = True
+
     def __init__(self, config: Dict):
         super().__init__(config)
         self._available_models = None  # Cache for available models
 
-    def generate_content(self, model: str, prompt: str) -> str:
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
         """
         Generate content trying the specified model first,
         then fall back to others if needed
@@ -51,6 +165,9 @@ class G4FService(BaseAIService):
         Args:
             model: The preferred model to try first
             prompt: The prompt to generate content for
+            monitor: Quality gate for streamed responses; rejected ones fall back too
+            max_tokens: Completion limit, left to the provider when None
+            temperature: Sampling temperature, left to the provider when None
             
         Returns:
             Generated content as string
@@ -58,19 +175,17 @@ class G4FService(BaseAIService):
         Raises:
             Exception: If all model attempts fail
         """
+        options = {'max_tokens': max_tokens} if max_tokens else {}
+        if temperature is not None:
+            options['temperature'] = temperature
         # First try with the requested model
         try:
-            response = g4f.ChatCompletion.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False,
-                timeout=190
-            )
+            response = self._complete(model, prompt, monitor, timeout=190, **options)
             if response:
-                return str(response)
-            logger.warning(f"Empty response from primary model {model}")
+                return response
+            logger.warning("Empty response from primary model %s", model)
         except Exception as e:
-            logger.warning(f"Primary model {model} failed: {str(e)}")
+            logger.warning("Primary model %s failed: %s", model, e)
 
         # If primary model fails, try other available models
         fallback_models = [
@@ -80,109 +195,170 @@ class G4FService(BaseAIService):
 
         for fallback_model in fallback_models:
             try:
-                response = g4f.ChatCompletion.create(
-                    model=fallback_model,
-                    messages=[{"role": "user", "content": prompt}],
-                    stream=False,
-                    # timeout=30
-                )
+                response = self._complete(fallback_model, prompt, monitor, **options)
                 if response:
-                    logger.info(f"Successfully generated with fallback model {fallback_model}")
-                    return str(response)
-                logger.warning(f"Empty response from fallback model {fallback_model}")
+                    logger.info("Successfully generated with fallback model %s", fallback_model)
+                    metrics.PROVIDER_FALLBACKS.labels(self.name, metrics.model_label(fallback_model)).inc()
+                    return response
+                logger.warning("Empty response from fallback model %s", fallback_model)
             except Exception as e:
-                logger.warning(f"Fallback model {fallback_model} failed: {str(e)}")
+                logger.warning("Fallback model %s failed: %s", fallback_model, e)
                 continue
 
         raise Exception(f"Failed to generate content after trying {model} and {len(fallback_models)} fallback models")
 
+    def _complete(self, model: str, prompt: str, monitor: Optional[StreamMonitor] = None, **kwargs) -> Completion:
+        messages = [{"role": "user", "content": prompt}]
+        if monitor is None:
+            # ignore_stream hands back the provider's chunks unjoined, finish markers included
+            stream = g4f.ChatCompletion.create(model=model, messages=messages, stream=False, ignore_stream=True,
+                                               **kwargs)
+        else:
+            monitor.reset()
+            stream = g4f.ChatCompletion.create(model=model, messages=messages, stream=True, **kwargs)
+        if isinstance(stream, str):
+            stream = [stream]
+        parts, finish_reason = [], None
+        try:
+            for chunk in stream:
+                if isinstance(chunk, FinishReason):
+                    finish_reason = chunk.reason
+                elif isinstance(chunk, str):  # Besides text, g4f yields usage and other markers
+                    parts.append(chunk)
+                    if monitor is not None:
+                        monitor.feed(chunk)
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+        response = Completion(''.join(parts), model, finish_reason)
+        if monitor is not None:
+            monitor.check(response, finish_reason)
+        return response
+
     def get_available_models(self) -> List[str]:
         """Get available models with caching and priority order"""
         if self._available_models is None:
             try:
-                models = sorted(g4f.models._all_models)
-                # Prioritize certain models
-                for preferred in ['gpt-4o', 'gpt-4', 'claude-2']:
-                    if preferred in models:
-                        models.remove(preferred)
-                        models.insert(0, preferred)
-                self._available_models = models
+                self._available_models = prioritized_g4f_models()
             except Exception as e:
-                logger.error(f"Failed to get G4F models, using defaults: {str(e)}")
+                logger.error("Failed to get G4F models, using defaults: %s", e)
                 self._available_models = ['gpt-4o', 'gpt-4', 'gpt-3.5-turbo', 'llama2-70b', 'claude-2']
         return self._available_models.copy()
 
 class G4FServiceAPI(BaseAIService):
     """Service for local G4F API endpoint"""
+    name = 'g4f-api'
+    supports_streaming = True
+    supports_json_schema = True
+    reports_truncation = True
+
     def __init__(self, config: Dict):
         super().__init__(config)
-        self.base_url = self.config.get('base_url', "http://localhost:1337/v1")
+        self.pool = EndpointPool.from_config(self.name, self.config, "http://localhost:1337/v1")
+        self.base_url = self.pool.members[0].base_url
         self.default_model = self.config.get('default_model', "gpt-4o-mini")
-        logger.error(f"G4F API : {self.base_url}")
 
-    def generate_content(self, model: str, prompt: str) -> str:
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
         payload = {
             "model": model or self.default_model,
             "stream": False,
             "messages": [{"role": "user", "content": prompt}]
         }
+        if max_tokens or self.config.get('max_tokens'):
+            payload["max_tokens"] = max_tokens or self.config['max_tokens']
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if response_format:
+            payload["response_format"] = response_format
 
         try:
-            response = self._make_request(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                json=payload
-            )
-            choices = response.get('choices', [])
-            if choices:
-                return choices[0].get('message', {}).get('content', '[Empty response]')
-            return '[No response content]'
+            with self.pool.acquire() as member:
+                headers = {"Authorization": f"Bearer {member.api_key}"} if member.api_key else {}
+                if monitor is not None and not response_format:
+                    return self._stream(payload, monitor, member.base_url, headers)
+                response = self._make_request(
+                    "POST",
+                    f"{member.base_url}/chat/completions",
+                    json=payload,
+                    headers=headers
+                )
+            # An empty reply stays empty; the quality gate rejects it
+            choices = response.get('choices') or [{}]
+            return Completion((choices[0].get('message') or {}).get('content'), payload["model"],
+                              choices[0].get('finish_reason'), response.get('usage'))
+        except ResponseRejected:
+            raise
         except Exception as e:
-            logger.error(f"G4F API error: {str(e)}")
+            logger.error("G4F API error: %s", e)
             raise
 
+    def _stream(self, payload: Dict, monitor: StreamMonitor, base_url: str, headers: Dict) -> Completion:
+        """Read an SSE chat completion chunk by chunk; leaving early closes the connection"""
+        monitor.reset()
+        finish_reason = None
+        with self.session.post(f"{base_url}/chat/completions", json={**payload, "stream": True},
+                               headers=headers, stream=True, timeout=190) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                for choice in chunk.get('choices') or []:
+                    content = (choice.get('delta') or {}).get('content')
+                    if content:
+                        monitor.feed(content)
+                    finish_reason = choice.get('finish_reason') or finish_reason
+        return Completion(monitor.text, payload["model"], finish_reason)
+
     def get_available_models(self) -> List[str]:
         try:
-                models = sorted(g4f.models._all_models)
-                # Prioritize certain models
-                for preferred in ['gpt-4o', 'gpt-4', 'claude-2']:
-                    if preferred in models:
-                        models.remove(preferred)
-                        models.insert(0, preferred)
-                return models
-              
+            return prioritized_g4f_models()
         except Exception as e:
-            logger.error(f"Failed to get G4F API models: {str(e)}")
+            logger.error("Failed to get G4F API models: %s", e)
             return ['gpt-4o-mini', 'gpt-4', 'gpt-3.5-turbo']
         
 class HuggingFaceService(BaseAIService):
     """Service for HuggingFace Inference API"""
+    name = 'huggingface'
+
     def __init__(self, config: Dict):
         super().__init__(config)
-        self.api_key = self.config.get('api_key', os.getenv('HUGGINGFACE_API_KEY'))
-        self.base_url = self.config.get('api_url', "https://api-inference.huggingface.co/models")
+        self.pool = EndpointPool.from_config(self.name, self.config, "https://api-inference.huggingface.co/models",
+                                             url_key='api_url')
 
-    def generate_content(self, model: str, prompt: str) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
         payload = {
             "inputs": prompt,
             "parameters": {
-                "max_new_tokens": self.config.get('max_tokens', 1000),
-                "temperature": self.config.get('temperature', 0.7)
+                "max_new_tokens": max_tokens or self.config.get('max_tokens', 1000),
+                "temperature": temperature if temperature is not None else self.config.get('temperature', 0.7)
             }
         }
 
-        response = self._make_request(
-            "POST",
-            f"{self.base_url}/{model}",
-            headers=headers,
-            json=payload
-        )
-        return response[0]['generated_text']
+        with self.pool.acquire() as member:
+            headers = {
+                "Authorization": f"Bearer {member.api_key}",
+                "Content-Type": "application/json"
+            }
+            response = self._make_request(
+                "POST",
+                f"{member.base_url}/{model}",
+                headers=headers,
+                json=payload
+            )
+        return Completion(response[0]['generated_text'], model)
 
     def get_available_models(self) -> List[str]:
         # Maintain your own list or implement pagination for the API
@@ -195,33 +371,40 @@ class HuggingFaceService(BaseAIService):
 
 class TogetherAIService(BaseAIService):
     """Service for Together AI API"""
+    name = 'together'
+    reports_truncation = True
+
     def __init__(self, config: Dict):
         super().__init__(config)
-        self.api_key = self.config.get('api_key', os.getenv('TOGETHER_API_KEY'))
-        self.base_url = self.config.get('api_url', "https://api.together.xyz/v1/completions")
+        self.pool = EndpointPool.from_config(self.name, self.config, "https://api.together.xyz/v1/completions",
+                                             url_key='api_url')
 
-    def generate_content(self, model: str, prompt: str) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
         payload = {
             "model": model,
             "prompt": prompt,
-            "max_tokens": self.config.get('max_tokens', 1000),
-            "temperature": self.config.get('temperature', 0.7),
+            "max_tokens": max_tokens or self.config.get('max_tokens', 1000),
+            "temperature": temperature if temperature is not None else self.config.get('temperature', 0.7),
             "top_p": self.config.get('top_p', 0.9),
             "stop": self.config.get('stop_sequences', ["</s>"])
         }
 
-        response = self._make_request(
-            "POST",
-            self.base_url,
-            headers=headers,
-            json=payload
-        )
-        return response['choices'][0]['text']
+        with self.pool.acquire() as member:
+            headers = {
+                "Authorization": f"Bearer {member.api_key}",
+                "Content-Type": "application/json"
+            }
+            response = self._make_request(
+                "POST",
+                member.base_url,
+                headers=headers,
+                json=payload
+            )
+        choice = response['choices'][0]
+        return Completion(choice['text'], model, choice.get('finish_reason'), response.get('usage'))
 
     def get_available_models(self) -> List[str]:
         return [
@@ -233,43 +416,104 @@ class TogetherAIService(BaseAIService):
 
 class OpenAIService(BaseAIService):
     """Service for OpenAI API with custom base URL support"""
+    name = 'openai'
+    supports_streaming = True
+    supports_json_schema = True
+    reports_truncation = True
+
     def __init__(self, config: Dict):
         super().__init__(config)
-        self.api_key = self.config.get('api_key', os.getenv('OPENAI_API_KEY'))
-        self.base_url = self.config.get('base_url', "https://api.openai.com/v1")
-        
-        self.client = openai.OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url
-        )
+        self.pool = EndpointPool.from_config(self.name, self.config, "https://api.openai.com/v1")
+        # One client, and so one connection pool, per endpoint/key pair
+        self.clients = {
+            member: openai.OpenAI(api_key=member.api_key, base_url=member.base_url)
+            for member in self.pool.members
+        }
+        self.client = self.clients[self.pool.members[0]]
 
-    def generate_content(self, model: str, prompt: str) -> str:
+    def preconnect(self) -> int:
+        """Warm each client's own connection pool, which the shared session doesn't cover"""
+        reached = 0
+        for member, client in self.clients.items():
+            try:
+                client.with_options(timeout=Config.WARMUP_CONNECT_TIMEOUT, max_retries=0).models.list()
+                reached += 1
+            except openai.APIStatusError:
+                reached += 1  # Answered, so the connection is open
+            except Exception as e:
+                logger.warning("Could not preconnect to %s pool member %s: %s", self.name, member.label, e)
+        return reached
+
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
+        options = {'response_format': response_format} if response_format else {}
+        temperature = temperature if temperature is not None else self.config.get('temperature', 0.7)
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=self.config.get('temperature', 0.7),
-                max_tokens=self.config.get('max_tokens', 1000),
-                top_p=self.config.get('top_p', 0.9)
-            )
-            return response.choices[0].message.content
+            with self.pool.acquire() as member:
+                if monitor is not None and not response_format:
+                    return self._stream(self.clients[member], model, prompt, monitor, max_tokens, temperature)
+                response = self.clients[member].chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_tokens=max_tokens or self.config.get('max_tokens', 1000),
+                    top_p=self.config.get('top_p', 0.9),
+                    **options
+                )
+            usage = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens
+            } if response.usage else None
+            return Completion(response.choices[0].message.content, model, response.choices[0].finish_reason, usage)
+        except ResponseRejected:
+            raise
         except Exception as e:
-            logger.error(f"OpenAI API error: {str(e)}")
+            logger.error("OpenAI API error: %s", e)
             raise
 
+    def _stream(self, client: openai.OpenAI, model: str, prompt: str, monitor: StreamMonitor,
+                max_tokens: Optional[int] = None, temperature: float = 0.7) -> Completion:
+        monitor.reset()
+        finish_reason = None
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens or self.config.get('max_tokens', 1000),
+            top_p=self.config.get('top_p', 0.9),
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    monitor.feed(choice.delta.content)
+                finish_reason = choice.finish_reason or finish_reason
+        finally:
+            stream.close()  # Abandoning a rejected stream drops the connection
+        return Completion(monitor.text, model, finish_reason)
+
     def get_available_models(self) -> List[str]:
         if self._should_use_cache():
-            return self._cached_models
+            return self._cached_models.copy()
             
         try:
             models = self.client.models.list()
             self._update_cache([m.id for m in models.data if m.id.startswith('gpt-')])
-            return self._cached_models
-        except Exception:
-            return self._get_fallback_models()
+        except Exception as e:
+            logger.warning("Failed to list OpenAI models, using fallback list: %s", e)
+            # Cache the fallback too so an unreachable endpoint isn't hit on every call
+            self._cached_models = self._get_fallback_models()
+            self._cache_time = datetime.now()
+        return self._cached_models.copy()
 
     def _should_use_cache(self) -> bool:
-        return self._cached_models and (datetime.now() - self._cache_time).seconds < 3600
+        return bool(self._cached_models) and \
+            (datetime.now() - self._cache_time).total_seconds() < Config.MODEL_CACHE_TTL
 
     def _update_cache(self, models: List[str]) -> None:
         self._cached_models = sorted(models)
@@ -277,19 +521,173 @@ class OpenAIService(BaseAIService):
 
     def _get_fallback_models(self) -> List[str]:
         try:
-            models = sorted(g4f.models._all_models)
-            if 'gpt-4o' in models:
-                models.remove('gpt-4o')
-                models.insert(0, 'gpt-4o')
-            return models
+            return prioritized_g4f_models()
         except Exception:
             return ['gpt-4o', 'gpt-4', 'gpt-3.5-turbo']
 
 
+class _ChunkRecorder:
+    """Stands in for a stream monitor and notes when each chunk arrived"""
+
+    def __init__(self, monitor: StreamMonitor, start: float):
+        self.monitor = monitor
+        self.start = start
+        self.chunks = []
+
+    def reset(self) -> None:
+        self.chunks = []
+        self.monitor.reset()
+
+    def feed(self, chunk: str) -> None:
+        self.chunks.append([round(time.monotonic() - self.start, 4), chunk])
+        self.monitor.feed(chunk)
+
+    def __getattr__(self, name):
+        return getattr(self.monitor, name)
+
+
+class RecordingService(BaseAIService):
+    """Wraps a real service and records every interaction to a cassette"""
+
+    def __init__(self, service: BaseAIService, writer: CassetteWriter):
+        super().__init__(service.config)
+        self.service = service
+        self.writer = writer
+        self.name = service.name
+        self.supports_streaming = service.supports_streaming
+        self.supports_json_schema = service.supports_json_schema
+        self.reports_truncation = service.reports_truncation
+        self.pool = service.pool
+
+    def preconnect(self) -> int:
+        return self.service.preconnect()
+
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
+        started_at, start = time.time(), time.monotonic()
+        recorder = _ChunkRecorder(monitor, start) if monitor is not None else None
+        record = {
+            'started_at': started_at,
+            'provider': self.name,
+            'model': model,
+            'prompt': prompt,
+            'response_format': response_format,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'tenant': current_tenant.get(),
+            'paper_id': current_paper.get()
+        }
+        try:
+            content = self.service.generate_content(model, prompt, response_format=response_format, monitor=recorder,
+                                                    max_tokens=max_tokens, temperature=temperature)
+            record.update(response=str(content), response_model=getattr(content, 'model', None),
+                          finish_reason=getattr(content, 'finish_reason', None), usage=getattr(content, 'usage', None))
+            return content
+        except Exception as e:
+            record['error'] = {'type': type(e).__name__, 'message': str(e), 'reason': getattr(e, 'reason', None)}
+            raise
+        finally:
+            record['duration'] = round(time.monotonic() - start, 4)
+            record['chunks'] = recorder.chunks if recorder is not None else None
+            try:
+                self.writer.write(record)
+            except Exception as e:
+                logger.warning("Failed to record provider call: %s", e)
+
+    def get_available_models(self) -> List[str]:
+        return self.service.get_available_models()
+
+    def get_model_capabilities(self, model: str) -> Dict:
+        return self.service.get_model_capabilities(model)
+
+
+class ReplayService(BaseAIService):
+    """Plays recorded cassettes back instead of calling a provider.
+
+    Calls are matched to recordings by model and prompt, then by prompt
+    alone and finally by model, cycling through the candidates so a
+    replay never runs dry. Chunks and errors come back with their recorded
+    timing, divided by the configured speed.
+    """
+    name = 'replay'
+    supports_streaming = True
+    supports_json_schema = True
+    reports_truncation = True
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.speed = self.config.get('speed', 1.0)
+        self.strict = self.config.get('strict', False)
+        self._indexes = {'exact': {}, 'prompt': {}, 'model': {}}
+        self._cursors = {}
+        paths = [path.strip() for path in self.config.get('cassettes', Config.CASSETTE_DIR).split(',')]
+        count = 0
+        for record in read_cassettes(paths):
+            digest = self._digest(record['prompt'])
+            for index, key in (('exact', (record['model'], digest)), ('prompt', digest), ('model', record['model'])):
+                self._indexes[index].setdefault(key, []).append(record)
+            count += 1
+        logger.info("Loaded %s recorded provider calls for replay", count)
+
+    @metrics.observe_provider_call
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         monitor: Optional[StreamMonitor] = None, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None) -> str:
+        record = self._find(model, prompt)
+        start = time.monotonic()
+        text = record.get('response')
+        if record.get('chunks'):
+            if monitor is not None:
+                monitor.reset()
+                for offset, chunk in record['chunks']:
+                    self._sleep_until(start, offset)
+                    monitor.feed(chunk)
+            if text is None:
+                text = ''.join(chunk for _, chunk in record['chunks'])
+        self._sleep_until(start, record['duration'])
+        error = record.get('error')
+        # A recorded quality rejection is left to the current quality gate to judge
+        if error and error['type'] != 'ResponseRejected':
+            raise Exception(f"Replayed {error['type']}: {error['message']}")
+        return Completion(text, record.get('response_model') or model, record.get('finish_reason'), record.get('usage'))
+
+    def get_available_models(self) -> List[str]:
+        return sorted(self._indexes['model']) or list(Config.DEFAULT_MODELS)
+
+    def _find(self, model: str, prompt: str) -> Dict:
+        digest = self._digest(prompt)
+        lookups = [('exact', (model, digest))] if self.strict else \
+            [('exact', (model, digest)), ('prompt', digest), ('model', model)]
+        for index, key in lookups:
+            records = self._indexes[index].get(key)
+            if records:
+                cursor = self._cursors.setdefault((index, key), itertools.count())
+                return records[next(cursor) % len(records)]
+        raise Exception(f"No recorded call for model {model} and this prompt")
+
+    def _sleep_until(self, start: float, offset: float) -> None:
+        if self.speed > 0:
+            delay = start + offset / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    @staticmethod
+    def _digest(prompt: str) -> str:
+        return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+
 class ModelProvider:
     """Main provider class that routes requests to the configured service"""
     def __init__(self):
         self.service = self._initialize_service()
+        self.health = ModelHealth()
+        # Capped pools raise the per-worker ceiling, so throughput grows with every member added
+        capacity = self.service.pool.capacity if self.service.pool is not None else None
+        self.scheduler = FairScheduler(max(Config.SCHEDULER_MAX_CONCURRENCY, capacity or 0))
+        self.ledger = UsageLedger()
+        self.routing = RoutingPolicy(self.ledger, self.health)
+        self.quality = QualityGate()
 
     def _initialize_service(self) -> BaseAIService:
         provider = Config.AI_PROVIDER.lower()
@@ -300,17 +698,196 @@ class ModelProvider:
             'g4f-api': G4FServiceAPI,
             'huggingface': HuggingFaceService,
             'together': TogetherAIService,
-            'openai': OpenAIService
+            'openai': OpenAIService,
+            'replay': ReplayService
         }
 
         if provider not in service_map:
             raise ValueError(f"Unsupported AI provider: {provider}")
         
-        return service_map[provider](provider_config)
-
-    @retry()
-    def generate_content(self, model: str, prompt: str) -> str:
-        return self.service.generate_content(model, prompt)
+        service = service_map[provider](provider_config)
+        if Config.CASSETTE_RECORD:
+            service = RecordingService(service, CassetteWriter(Config.CASSETTE_DIR))
+        return service
+
+    @metrics.timed(metrics.GENERATE_CONTENT_DURATION)
+    @in_span
+    def generate_content(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                         section: str = None, words: int = None) -> Completion:
+        """Generate a completion; section is the kind of paper section it is for, used for routing and accounting.
+
+        The completion limit follows words, the section's word target, or
+        the usual length of its kind; answers cut off at that limit are
+        continued rather than generated again.
+        """
+        self.scheduler.check_quota(current_tenant.get())
+        model = self.routing.choose(model, section)
+        max_tokens = self.token_limit(section, words)
+        content = self._redispatch(model, lambda candidate: self._generate_with_retry(
+            candidate, prompt, response_format, section, max_tokens))
+        if content.finish_reason == 'length' and not response_format:
+            content = self._continue(content.model, prompt, content, section, max_tokens)
+        return content
+
+    def _redispatch(self, model: str, attempt: Callable[[str], Completion]) -> Completion:
+        """attempt(model), then attempt(fallback) for each of fallback_models(model) while the quality gate rejects"""
+        # Responses failing the quality gate go straight to another model instead of being retried
+        candidates = [model]
+        for candidate in candidates:
+            try:
+                content = attempt(candidate)
+            except ResponseRejected as e:
+                logger.warning("Rejected %s response from %s%s, re-dispatching", e.reason, candidate,
+                               ' mid-stream' if e.early else '')
+                rejected = e
+                if candidate == model:
+                    # Only listed once needed: the provider may have to be asked for its models
+                    candidates.extend(self.fallback_models(model))
+                continue
+            if candidate != model:
+                metrics.PROVIDER_FALLBACKS.labels(self.service.name, metrics.model_label(candidate)).inc()
+            content.model = content.model or candidate
+            return content
+        raise rejected
+
+    def token_limit(self, section: str = None, words: int = None) -> Optional[int]:
+        """token_limit() where the service reports a cut-off answer; elsewhere None, as it would truncate silently"""
+        return token_limit(section, words) if self.service.reports_truncation else None
+
+    def fallback_models(self, model: str) -> List[str]:
+        """Models a rejected response is re-dispatched to: QUALITY_FALLBACK_MODELS, else the service's own"""
+        models = Config.QUALITY_FALLBACK_MODELS or self.service.get_available_models()
+        return [m for m in models if m != model][:Config.QUALITY_MAX_REDISPATCH]
+
+    @metrics.timed(metrics.GENERATE_CONTENT_DURATION)
+    @in_span
+    def complete_chat(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                      max_tokens: int = None, temperature: float = None, relay: StreamRelay = None) -> Completion:
+        """A gateway chat completion, with the caller's limits as given.
+
+        Unlike a paper section it is not routed or continued past
+        max_tokens, and the quality gate only turns away replies that can't
+        be an answer at all; those are re-dispatched to the fallback models
+        like any other. A relay gets the text as the service streams it, if
+        it does.
+        """
+        self.scheduler.check_quota(current_tenant.get())
+        return self._redispatch(model, lambda candidate: self._generate_with_retry(
+            candidate, prompt, response_format, 'chat', max_tokens, temperature, relay))
+
+    @retry(on_retry=metrics.count_retry('generate_content'), giveup_on=(ResponseRejected,))
+    def _generate_with_retry(self, model: str, prompt: str, response_format: Optional[Dict] = None,
+                             section: str = None, max_tokens: int = None, temperature: float = None,
+                             relay: StreamRelay = None) -> Completion:
+        # Structured (JSON) replies are validated by their parser instead of the quality gate
+        monitor = None if response_format else self.quality.monitor(prompt, section, relay)
+        # Each attempt queues for its own slot so backoff sleeps don't hold one
+        with self.scheduler.slot(current_tenant.get(), count_tokens(prompt)):
+            start = time.monotonic()
+            try:
+                content = self.service.generate_content(model, prompt, response_format=response_format,
+                                                        monitor=monitor, max_tokens=max_tokens, temperature=temperature)
+                if monitor is not None:
+                    monitor.check(content, getattr(content, 'finish_reason', None))
+            except ResponseRejected as e:
+                latency = time.monotonic() - start
+                self.health.record(model, False, latency)
+                # The tokens were paid for even if the text is discarded
+                e.completion = self._account(model, prompt, e.completion, latency, section)
+                raise
+            except Exception:
+                self.health.record(model, False, time.monotonic() - start)
+                raise
+        latency = time.monotonic() - start
+        self.health.record(model, True, latency)
+        return self._account(model, prompt, content, latency, section)
+
+    def _continue(self, model: str, prompt: str, content: Completion, section: str = None,
+                  max_tokens: int = None) -> Completion:
+        """Extend a response cut off at max_tokens with up to CONTINUATION_MAX_CALLS continuation calls.
+
+        Each call is shown the text so far and only asked for the rest, so
+        nothing is written twice; if one fails, what arrived is kept.
+        """
+        text, finish_reason = str(content), content.finish_reason
+        usage = dict(content.usage)
+        for _ in range(Config.CONTINUATION_MAX_CALLS):
+            if finish_reason != 'length':
+                break
+            continuation = CONTINUATION_PROMPT.format(prompt=prompt, text=text)
+            start = time.monotonic()
+            try:
+                with self.scheduler.slot(current_tenant.get(), count_tokens(continuation)):
+                    start = time.monotonic()
+                    part = self.service.generate_content(model, continuation, max_tokens=max_tokens)
+            except Exception as e:
+                self.health.record(model, False, time.monotonic() - start)
+                metrics.CONTINUATIONS.labels(section or 'other', 'error').inc()
+                logger.warning("Continuation of a cut-off %s failed, keeping it as is: %s", section or 'response', e)
+                break
+            latency = time.monotonic() - start
+            self.health.record(model, True, latency)
+            part = self._account(model, continuation, part, latency, section)
+            # Too short for the full gate, but an error page or refusal must not be appended
+            reason = self.quality.check_head(part.strip()[:HEAD_CHARS], prompt)
+            metrics.CONTINUATIONS.labels(section or 'other', reason or 'success').inc()
+            if reason:
+                logger.warning("Rejected %s continuation from %s, keeping the cut-off text", reason, model)
+                break
+            text = join_continuation(text, str(part))
+            finish_reason = part.finish_reason
+            usage = {key: usage[key] + part.usage[key] for key in ('prompt_tokens', 'completion_tokens')
+                     if key in usage and key in part.usage}
+        if finish_reason == 'length':
+            logger.warning("%s still cut off after %d continuations", section or 'Response', Config.CONTINUATION_MAX_CALLS)
+        return Completion(text, content.model, finish_reason, usage)
+
+    def _account(self, model: str, prompt: str, content: str, latency: float, section: str = None) -> Completion:
+        """Bill the call to the tenant and record it in the usage ledger"""
+        if not isinstance(content, Completion):
+            content = Completion(content, model)
+        usage = content.usage
+        estimated = not (usage.get('prompt_tokens') and usage.get('completion_tokens') is not None)
+        prompt_tokens = count_tokens(prompt) if estimated else usage['prompt_tokens']
+        completion_tokens = count_tokens(content) if estimated else usage['completion_tokens']
+        tenant = current_tenant.get()
+        self.scheduler.record_usage(tenant, prompt_tokens + completion_tokens)
+        try:
+            self.ledger.record(content.model or model, self.service.name, section, tenant,
+                               prompt_tokens, completion_tokens, latency, estimated)
+        except Exception as e:
+            logger.warning("Failed to record token usage: %s", e)
+        return content
+
+    @in_span
+    def _generate_structured(self, model: str, prompt: str, response_format: Dict, section: str) -> Completion:
+        """Single attempt: endpoints without structured output support fail fast here"""
+        model = self.routing.choose(model, section)
+        with self.scheduler.slot(current_tenant.get(), count_tokens(prompt)):
+            start = time.monotonic()
+            reply = self.service.generate_content(model, prompt, response_format=response_format,
+                                                  max_tokens=self.token_limit(section))
+        return self._account(model, prompt, reply, time.monotonic() - start, section)
+
+    def generate_references(self, model: str, research_subject: str, chapter_titles: List[str] = None) -> List[Dict]:
+        """Reference data as CSL-JSON items, as structured JSON where the provider supports it"""
+        prompt = references_prompt(research_subject, chapter_titles)
+        references = []
+        if self.service.supports_json_schema:
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "references", "schema": REFERENCES_SCHEMA}
+            }
+            try:
+                references = parse_references(self._generate_structured(model, prompt, response_format, 'references'))
+            except Exception as e:
+                logger.warning("Structured references failed, asking for plain JSON: %s", e)
+        if not references:
+            reply = self.generate_content(model, prompt + " Reply with the JSON object only.", section='references')
+            references = parse_references(reply)
+        if not references:
+            raise ValueError("No usable references in the model's reply")
+        return references
 
     def generate_index_content(self, model: str, research_subject: str, manual_chapters: List[str] = None) -> str:
         prompt = (f"Generate a detailed index for a research paper about {research_subject} "
@@ -318,5 +895,45 @@ class ModelProvider:
                  f"Generate a detailed index for a research paper about {research_subject}")
         return self.generate_content(model, prompt + ". Use markdown format.")
 
+    def generate_outline(self, model: str, research_subject: str, chapter_count: str = 'auto',
+                         word_count: str = 'auto', manual_chapters: List[str] = None) -> Outline:
+        """Generate the paper outline once, as structured JSON where the provider supports it"""
+        prompt = f"Create a research paper outline about {research_subject}"
+        if manual_chapters:
+            prompt += f" with these chapters: {', '.join(manual_chapters)}"
+        elif chapter_count != 'auto':
+            prompt += f" with exactly {chapter_count} main chapters"
+        if word_count != 'auto':
+            prompt += f" targeting approximately {word_count} words"
+        prompt += ". Do not list the introduction, conclusion or references as chapters."
+
+        outline = None
+        if self.service.supports_json_schema:
+            json_prompt = (prompt + " Respond with a JSON object with a 'title' and a list of 'chapters', "
+                           "each with a 'title' and a list of 'sections' titles.")
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "paper_outline", "schema": OUTLINE_SCHEMA, "strict": True}
+            }
+            try:
+                outline = parse_outline(self._generate_structured(model, json_prompt, response_format, 'index'))
+            except Exception as e:
+                logger.warning("Structured outline failed, falling back to markdown: %s", e)
+
+        if outline is None or not outline.chapters:
+            markdown_prompt = (prompt + ". Use markdown, with one '## ' heading per chapter "
+                               "and '### ' headings for its sections.")
+            outline = parse_outline(self.generate_content(model, markdown_prompt, section='index'))
+
+        if manual_chapters:
+            # The chapters are fixed; keep whatever sections the model proposed for them
+            proposed = {chapter.title.lower(): chapter.children for chapter in outline.chapters}
+            outline = Outline(outline.title, [OutlineNode(title, proposed.get(title.lower(), []))
+                                              for title in manual_chapters])
+        elif not outline.chapters:
+            logger.warning("No chapters found in generated outline, using default chapters")
+            outline = Outline(outline.title, [OutlineNode(title) for title in DEFAULT_CHAPTERS])
+        return outline.fit_chapter_count(chapter_count) if not manual_chapters else outline
+
     def get_available_models(self) -> List[str]:
         return self.service.get_available_models()
\ No newline at end of file
@@ -0,0 +1,246 @@
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Sections the paper always writes itself; never treated as outline chapters
+RESERVED_TITLES = {
+    'introduction', 'conclusion', 'conclusions', 'references', 'bibliography',
+    'abstract', 'index', 'table of contents', 'contents', 'appendix', 'appendices'
+}
+
+DEFAULT_CHAPTERS = ["Literature Review", "Methodology", "Results and Discussion"]
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "chapters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "sections": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["title", "sections"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["title", "chapters"],
+    "additionalProperties": False
+}
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_NUMBERED = re.compile(r'^(\d+(?:\.\d+)*)[.)]?\s+(.*)$')
+_ROMAN = re.compile(r'^([IVXLC]+)[.)]\s+(.*)$')
+_LETTER = re.compile(r'^([A-Za-z])[.)]\s+(.*)$')
+_BULLET = re.compile(r'^([-*+•])\s+(.*)$')
+_CHAPTER_PREFIX = re.compile(r'^(?:chapter|part|section)\s+(?:\d+|[ivxlc]+)\s*[:.\-–—]?\s*', re.IGNORECASE)
+_LEADING_NUMBER = re.compile(r'^(?:\d+(?:\.\d+)*|[IVXLC]+|[A-Za-z])[.)]\s+')
+_BOLD = re.compile(r'^\*\*(.+?)\*\*|^__(.+?)__')
+
+
+@dataclass
+class OutlineNode:
+    """A chapter or section in the paper outline"""
+    title: str
+    children: List['OutlineNode'] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        return {'title': self.title, 'sections': [child.title for child in self.children]}
+
+
+@dataclass
+class Outline:
+    """Hierarchical outline of a paper: chapters with their sections"""
+    title: str = ''
+    chapters: List[OutlineNode] = field(default_factory=list)
+
+    def chapter_titles(self) -> List[str]:
+        return [chapter.title for chapter in self.chapters]
+
+    def fit_chapter_count(self, chapter_count: str) -> 'Outline':
+        """Trim or pad the chapters to an explicitly requested count"""
+        if chapter_count == 'auto':
+            return self
+        requested_count = int(chapter_count)
+        chapters = self.chapters[:requested_count]
+        defaults = ["Literature Review", "Methodology", "Results", "Discussion"]
+        for title in defaults:
+            if len(chapters) >= requested_count:
+                break
+            if title not in [chapter.title for chapter in chapters]:
+                chapters.append(OutlineNode(title))
+        return Outline(self.title, chapters)
+
+    def to_dict(self) -> Dict:
+        return {'title': self.title, 'chapters': [chapter.to_dict() for chapter in self.chapters]}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Outline':
+        return cls(data.get('title', ''), [
+            OutlineNode(chapter['title'], [OutlineNode(section) for section in chapter.get('sections', [])])
+            for chapter in data.get('chapters', [])
+        ])
+
+    def to_markdown(self, include_references: bool = False) -> str:
+        """Render the outline as the paper's index section"""
+        lines = ["## Index", "", "1. Introduction"]
+        for i, chapter in enumerate(self.chapters, 2):
+            lines.append(f"{i}. {chapter.title}")
+            for j, section in enumerate(chapter.children, 1):
+                lines.append(f"    {i}.{j}. {section.title}")
+        lines.append(f"{len(self.chapters) + 2}. Conclusion")
+        if include_references:
+            lines.append(f"{len(self.chapters) + 3}. References")
+        return "\n".join(lines) + "\n\n"
+
+
+def parse_outline(text: str) -> Outline:
+    """Parse a model's outline reply, structured JSON or free-form markdown"""
+    outline = _parse_json_outline(text)
+    if outline is None:
+        outline = _parse_markdown_outline(text)
+    return outline
+
+
+def _parse_json_outline(text: str) -> Optional[Outline]:
+    stripped = text.strip()
+    if stripped.startswith('```'):
+        stripped = re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', stripped)
+    start, end = stripped.find('{'), stripped.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(stripped[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('chapters'), list):
+        return None
+
+    chapters = []
+    for item in data['chapters']:
+        if isinstance(item, str):
+            title, sections = item, []
+        elif isinstance(item, dict):
+            title, sections = str(item.get('title', '')), item.get('sections') or []
+        else:
+            continue
+        title = _clean_title(title)
+        if not title or title.lower() in RESERVED_TITLES:
+            continue
+        children = []
+        for section in sections:
+            section_title = _clean_title(section.get('title', '') if isinstance(section, dict) else str(section))
+            if section_title:
+                children.append(OutlineNode(section_title))
+        chapters.append(OutlineNode(title, children))
+    return Outline(_clean_title(str(data.get('title', ''))), chapters)
+
+
+def _parse_markdown_outline(text: str) -> Outline:
+    """Parse headings, numbered lists, bold titles and bullets into a tree.
+
+    Every recognised line gets a depth; lines of different formats are ranked
+    so that headings nest above numbered items, which nest above bold titles
+    and bullets. The shallowest depth that occurs more than once becomes the
+    chapter level, and the next depth below each chapter its sections.
+    """
+    items = []
+    for raw_line in text.splitlines():
+        item = _classify_line(raw_line)
+        if item is not None:
+            items.append(item)
+
+    title = ''
+    while items:
+        top = min(depth for depth, _ in items)
+        top_items = [item for item in items if item[0] == top]
+        # A single top-level item followed by deeper ones is the document title
+        if len(top_items) == 1 and len(items) > 1 and items[0][0] == top:
+            title = items[0][1]
+            items = items[1:]
+            continue
+        break
+
+    if not items:
+        return Outline(title, [])
+
+    chapter_depth = min(depth for depth, _ in items)
+    chapters: List[OutlineNode] = []
+    current: Optional[OutlineNode] = None
+    section_depth = None
+    for depth, item_title in items:
+        if depth == chapter_depth:
+            if item_title.lower() in RESERVED_TITLES:
+                current = None  # Sections under reserved chapters are dropped too
+                continue
+            current = OutlineNode(item_title)
+            chapters.append(current)
+            section_depth = None
+        elif current is not None and depth > chapter_depth:
+            if section_depth is None:
+                section_depth = depth
+            if depth == section_depth:
+                current.children.append(OutlineNode(item_title))
+    return Outline(title, chapters)
+
+
+def _classify_line(raw_line: str):
+    """Return (depth, title) for an outline line, or None for prose"""
+    if not raw_line.strip():
+        return None
+    indent = len(raw_line) - len(raw_line.lstrip(' \t'))
+    line = raw_line.strip()
+
+    match = _HEADING.match(line)
+    if match:
+        return len(match.group(1)), _clean_title(match.group(2))
+
+    match = _BULLET.match(line)
+    if match:
+        title = _clean_title(match.group(2))
+        return (30 + indent // 2, title) if title else None
+
+    match = _NUMBERED.match(line)
+    if match:
+        title = _clean_title(match.group(2))
+        return (10 + match.group(1).count('.') + 1 + indent // 2, title) if title else None
+
+    match = _ROMAN.match(line)
+    if match:
+        title = _clean_title(match.group(2))
+        return (11 + indent // 2, title) if title else None
+
+    match = _LETTER.match(line)
+    if match and indent:
+        title = _clean_title(match.group(2))
+        return (12 + indent // 2, title) if title else None
+
+    if _CHAPTER_PREFIX.match(line.strip('*_ ')):
+        title = _clean_title(line)
+        return (11, title) if title else None
+
+    bold = _BOLD.match(line)
+    if bold and len(line) - len(bold.group(0)) <= 1:
+        title = _clean_title(line)
+        return (20 + indent // 2, title) if title else None
+    return None
+
+
+def _clean_title(title: str) -> str:
+    """Strip markdown emphasis, numbering, 'Chapter N:' prefixes and descriptions"""
+    title = title.strip()
+    bold = _BOLD.match(title)
+    if bold:
+        # "**Title**: description" keeps only the emphasised title
+        title = bold.group(1) or bold.group(2)
+    title = title.strip('*_` ').strip()
+    title = _LEADING_NUMBER.sub('', title)
+    title = _CHAPTER_PREFIX.sub('', title)
+    title = title.rstrip(':').strip()
+    if ' - ' in title and len(title) > 80:
+        title = title.split(' - ', 1)[0].strip()
+    return title
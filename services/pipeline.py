@@ -0,0 +1,137 @@
+import time
+import queue
+import threading
+import contextvars
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from config import Config
+
+
+class Node:
+    """One step of a Pipeline; func receives the results of its dependencies by name.
+
+    Nodes in after only have to be finished, whether or not they succeeded.
+    """
+    __slots__ = ('name', 'func', 'deps', 'after', 'state', 'result', 'error', 'started_at', 'finished_at')
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 after: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.after = tuple(after)
+        self.state = 'pending'  # pending, running, done, failed or skipped
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class Pipeline:
+    """Dependency-graph executor for the sections of one paper.
+
+    A node starts, on its own thread (a greenlet under gevent), as soon as
+    every dependency is done, so the wall time is the critical path rather
+    than the sum of all steps. Nodes may be added while the pipeline runs,
+    e.g. one per chapter once the outline is known. Dependents of a failed
+    node are skipped. A BaseException from a node (such as a drain
+    suspension) stops new starts and is re-raised from run() once the
+    running nodes have finished. Leaving run() early, e.g. because the
+    client went away, cancels the rest and waits for the running nodes
+    too, so none outlives the generation that started it.
+    """
+
+    def __init__(self, max_parallel: int = None):
+        self.max_parallel = max_parallel or Config.PIPELINE_MAX_PARALLEL
+        self.nodes: Dict[str, Node] = {}
+        self._finished = queue.Queue()
+        self._running = 0
+        self._cancelled = False
+        self._interrupt: Optional[BaseException] = None
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+            after: Iterable[str] = ()) -> Node:
+        node = Node(name, func, deps, after)
+        self.nodes[name] = node
+        return node
+
+    def cancel(self) -> None:
+        """Skip every node that hasn't started; running ones still finish"""
+        self._cancelled = True
+
+    def close(self) -> None:
+        """Skip every node that hasn't started and wait for the running ones to finish"""
+        self.cancel()
+        while self._running:
+            self._collect()
+        self._advance()
+
+    def run(self) -> Iterator[Node]:
+        """Drive the graph, yielding each node whenever its state changes"""
+        try:
+            while True:
+                for node in self._advance():
+                    yield node
+                if not self._running:
+                    break
+                yield self._collect()
+        finally:
+            self.close()
+        if self._interrupt is not None:
+            raise self._interrupt
+
+    def _collect(self) -> Node:
+        """Wait for the next running node to finish"""
+        node = self._finished.get()
+        self._running -= 1
+        node.state = 'failed' if node.error is not None else 'done'
+        return node
+
+    def _advance(self) -> List[Node]:
+        """Start ready nodes and skip unreachable ones, until nothing changes"""
+        changed = []
+        progress = True
+        while progress:
+            progress = False
+            for node in list(self.nodes.values()):
+                if node.state != 'pending':
+                    continue
+                dep_states = [self.nodes[dep].state if dep in self.nodes else 'pending' for dep in node.deps]
+                after_states = [self.nodes[dep].state if dep in self.nodes else 'pending' for dep in node.after]
+                if self._cancelled or self._interrupt is not None or \
+                        any(state in ('failed', 'skipped') for state in dep_states):
+                    node.state = 'skipped'
+                    changed.append(node)
+                    progress = True
+                elif all(state == 'done' for state in dep_states) and self._running < self.max_parallel and \
+                        all(state in ('done', 'failed', 'skipped') for state in after_states):
+                    self._start(node)
+                    changed.append(node)
+        return changed
+
+    def _start(self, node: Node) -> None:
+        node.state = 'running'
+        node.started_at = time.monotonic()
+        self._running += 1
+        inputs = {dep: self.nodes[dep].result for dep in node.deps}
+        # New threads start with an empty context; carry over tenant, paper and the like
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._execute, node, inputs),
+                         name=f"pipeline-{node.name}", daemon=True).start()
+
+    def _execute(self, node: Node, inputs: Dict[str, Any]) -> None:
+        try:
+            node.result = node.func(inputs)
+        except Exception as e:
+            node.error = e
+        except BaseException as e:
+            node.error = e
+            self._interrupt = e
+        finally:
+            node.finished_at = time.monotonic()
+            self._finished.put(node)
@@ -0,0 +1,175 @@
+import math
+import time
+import logging
+from typing import Callable, Dict, List
+from config import Config
+from services import metrics
+from services.usage import RoutingPolicy, UsageLedger
+from utils.tokens import WORDS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+OUTLINE_TOKENS = 400
+AUTO_CHAPTERS = (5, 4, 3, 2)  # Tried in order when the user left the chapter count on auto
+
+
+class Plan:
+    """Model, structure and concurrency chosen for one paper's time budget; adjusted while it runs"""
+    __slots__ = ('deadline_at', 'budget', 'model', 'chapters', 'words', 'parallel', 'references',
+                 'estimate', 'feasible', 'adjustments')
+
+    def __init__(self, deadline_at: float, budget: float, model: str, chapters: int, words: int,
+                 parallel: int, references: bool, estimate: float, feasible: bool):
+        self.deadline_at = deadline_at
+        self.budget = budget
+        self.model = model
+        self.chapters = chapters
+        self.words = words  # Per section
+        self.parallel = parallel
+        self.references = references
+        self.estimate = estimate
+        self.feasible = feasible
+        self.adjustments = 0
+
+    @property
+    def sections(self) -> int:
+        """Sections written by the model: introduction, chapters, conclusion and references"""
+        return self.chapters + 2 + int(self.references)
+
+    def remaining(self, now: float = None) -> float:
+        return self.deadline_at - (now or time.time())
+
+    def to_dict(self) -> Dict:
+        return {
+            'model': self.model,
+            'chapters': self.chapters,
+            'words_per_section': self.words,
+            'parallel': self.parallel,
+            'estimated_seconds': round(self.estimate, 1),
+            'remaining_seconds': round(self.remaining(), 1),
+            'feasible': self.feasible
+        }
+
+
+class DeadlinePlanner:
+    """Fits a paper into a time budget from the observed speed of each model.
+
+    A paper takes about one outline call, then its sections in rounds of
+    `parallel` calls (the introduction overlaps the outline), plus the
+    file and Word conversion. The planner keeps the requested model if it
+    can, then as many chapters and as long sections as fit, and finally the
+    least concurrency that still does, aiming for the budget divided by
+    DEADLINE_SAFETY_FACTOR. When nothing fits it takes the fastest plan and
+    marks it infeasible. While the paper runs, replan() compares the pace
+    of its finished sections with the time left and speeds up the rest.
+    """
+
+    def __init__(self, ledger: UsageLedger, routing: RoutingPolicy = None,
+                 fallback_models: Callable[[str], List[str]] = None):
+        self.ledger = ledger
+        self.routing = routing
+        self.fallback_models = fallback_models  # The models a requested one may give way to
+
+    @property
+    def max_parallel(self) -> int:
+        # The per-tenant scheduler limit caps a paper's concurrent calls whatever the pipeline allows
+        return max(1, min(Config.PIPELINE_MAX_PARALLEL, Config.SCHEDULER_TENANT_CONCURRENCY))
+
+    def call_seconds(self, model: str, tokens: float) -> float:
+        """Expected wall time of one call producing this many tokens"""
+        stats = self.ledger.model_stats(model)
+        if stats and stats.tokens_per_second:
+            return tokens / stats.tokens_per_second
+        if stats and stats.latency is not None:
+            return stats.latency
+        return Config.ROUTING_DEFAULT_LATENCY * tokens / Config.ROUTING_EXPECTED_TOKENS
+
+    def estimate(self, model: str, chapters: int, words: int, parallel: int, references: bool = False) -> float:
+        section = self.call_seconds(model, words / WORDS_PER_TOKEN)
+        outline = self.call_seconds(model, OUTLINE_TOKENS)
+        writing = chapters + 1 + int(references)  # Introduction excluded: it runs alongside the outline
+        return max(outline, section) + math.ceil(writing / parallel) * section + Config.DEADLINE_FINALIZE_SECONDS
+
+    def candidate_models(self, requested: str) -> List[str]:
+        models = [requested]
+        fallbacks = self.fallback_models(requested) if self.fallback_models is not None else []
+        for model in Config.ROUTING_FAST_MODELS + fallbacks:
+            if model not in models and (self.routing is None or self.routing.healthy(model)):
+                models.append(model)
+        return models
+
+    def plan(self, deadline_at: float, requested_model: str, chapter_count: str = 'auto',
+             word_count: str = 'auto', references: bool = False) -> Plan:
+        budget = deadline_at - time.time()
+        target = budget / Config.DEADLINE_SAFETY_FACTOR
+        if chapter_count.isdigit():
+            chapter_options = [int(chapter_count)] + [c for c in AUTO_CHAPTERS if c < int(chapter_count)]
+        else:
+            chapter_options = list(AUTO_CHAPTERS)
+        fastest = None
+        for model in self.candidate_models(requested_model):
+            for chapters in chapter_options:
+                for words in self._word_options(word_count, chapters + 2 + int(references)):
+                    for parallel in range(1, self.max_parallel + 1):
+                        estimate = self.estimate(model, chapters, words, parallel, references)
+                        if estimate <= target:
+                            return Plan(deadline_at, budget, model, chapters, words, parallel, references,
+                                        estimate, True)
+                        if fastest is None or estimate < fastest[0]:
+                            fastest = (estimate, model, chapters, words, parallel)
+        estimate, model, chapters, words, parallel = fastest
+        logger.warning("No plan fits a %.0fs budget, fastest takes ~%.0fs", budget, estimate)
+        return Plan(deadline_at, budget, model, chapters, words, parallel, references, estimate, False)
+
+    def replan(self, plan: Plan, pending: int, pace: float) -> List[str]:
+        """Speed up the pending sections if, at the observed seconds per section, they'd finish late.
+
+        Raises the concurrency first, then shortens sections, then moves to a
+        faster model; returns what was changed.
+        """
+        if not pending or pace <= 0:
+            return []
+        target = plan.remaining() - Config.DEADLINE_FINALIZE_SECONDS
+
+        def projected() -> float:
+            return math.ceil(pending / plan.parallel) * pace
+
+        changes = []
+        while projected() > target and plan.parallel < min(pending, self.max_parallel):
+            plan.parallel += 1
+            changes.append(f"parallel={plan.parallel}")
+        shorter = [w for w in Config.DEADLINE_SECTION_WORDS if w < plan.words]
+        while projected() > target and shorter:
+            words = shorter.pop(0)
+            pace *= words / plan.words
+            plan.words = words
+            changes.append(f"words={words}")
+        if projected() > target:
+            tokens = plan.words / WORDS_PER_TOKEN
+            current = self.call_seconds(plan.model, tokens)
+            faster = min(self.candidate_models(plan.model), key=lambda model: self.call_seconds(model, tokens))
+            if faster != plan.model and self.call_seconds(faster, tokens) < current:
+                plan.model = faster
+                changes.append(f"model={faster}")
+        if changes:
+            plan.adjustments += 1
+            logger.info("Replanned to finish %d sections in %.0fs: %s", pending, plan.remaining(), ', '.join(changes))
+        return changes
+
+    def record(self, plan: Plan, paper_id: str, tenant: str, budget: float, started_at: float,
+               outcome: str) -> bool:
+        """Book the deadline as met or missed; returns whether it was met"""
+        elapsed = time.time() - started_at
+        met = self.ledger.record_deadline(paper_id, tenant, plan.model, budget, elapsed, plan.feasible,
+                                          plan.adjustments, outcome)
+        metrics.DEADLINE_RESULTS.labels('met' if met else 'missed').inc()
+        metrics.DEADLINE_BUDGET_USED.observe(elapsed / budget)
+        return met
+
+    def _word_options(self, word_count: str, sections: int) -> List[int]:
+        """Words per section to try, longest first, never above what the user asked for"""
+        options = list(Config.DEADLINE_SECTION_WORDS)
+        if word_count.isdigit():
+            requested = max(50, int(word_count) // sections)
+            options = [requested] + [w for w in options if w < requested]
+        return options
@@ -0,0 +1,162 @@
+import time
+import random
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from config import Config
+from services import metrics
+from services.quality import ResponseRejected
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(Exception):
+    """No pool member freed up within POOL_ACQUIRE_TIMEOUT"""
+
+
+class PoolMember:
+    """One endpoint/key pair of a provider pool"""
+    __slots__ = ('base_url', 'api_key', 'max_concurrency', 'label', 'outstanding', 'ewma_latency',
+                 'failures', 'ejections', 'ejected_until', 'requests')
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, max_concurrency: int = 0):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key or None
+        self.max_concurrency = max_concurrency  # 0 for no cap
+        # Host plus a key fingerprint; the key itself never reaches logs or metrics
+        fingerprint = hashlib.sha1(api_key.encode('utf-8')).hexdigest()[:8] if api_key else 'nokey'
+        self.label = f"{urlparse(self.base_url).netloc or self.base_url}/{fingerprint}"
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.failures = 0  # Consecutive
+        self.ejections = 0  # Consecutive, for the backoff
+        self.ejected_until = 0.0
+        self.requests = 0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now and (not self.max_concurrency or self.outstanding < self.max_concurrency)
+
+    def export(self) -> Dict:
+        return {
+            'member': self.label,
+            'outstanding': self.outstanding,
+            'max_concurrency': self.max_concurrency,
+            'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            'requests': self.requests,
+            'ejected_for': max(0.0, round(self.ejected_until - time.monotonic(), 1))
+        }
+
+
+class EndpointPool:
+    """Balances a provider's calls over several endpoint/key pairs.
+
+    Picks the member with the fewest outstanding requests ('least_outstanding')
+    or the lowest EWMA latency weighted by its queue ('ewma'), never above a
+    member's concurrency cap; callers wait for a free member when all are at
+    their cap. POOL_EJECT_AFTER consecutive failures eject a member for
+    POOL_EJECT_SECONDS, doubling on every further ejection. When every
+    member is ejected the pool keeps using the one due back first rather
+    than failing outright.
+    """
+
+    def __init__(self, provider: str, members: List[PoolMember], strategy: str = None):
+        if not members:
+            raise ValueError(f"Provider pool for {provider} has no members")
+        self.provider = provider
+        self.members = members
+        self.strategy = strategy or Config.POOL_STRATEGY
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, provider: str, config: Dict, default_url: str, url_key: str = 'base_url') -> 'EndpointPool':
+        """Members from config['pool'], "url|key|max_concurrency,...", else the single url and key.
+
+        An empty url or key falls back to the provider's own, so "|sk-a,|sk-b"
+        spreads two keys over one endpoint.
+        """
+        url = config.get(url_key) or default_url
+        key = config.get('api_key')
+        cap = Config.POOL_MEMBER_CONCURRENCY
+        members = []
+        for item in (config.get('pool') or '').split(','):
+            if not item.strip():
+                continue
+            parts = [part.strip() for part in item.split('|')] + ['', '']
+            members.append(PoolMember(parts[0] or url, parts[1] or key, int(parts[2]) if parts[2] else cap))
+        return cls(provider, members or [PoolMember(url, key, cap)])
+
+    @property
+    def capacity(self) -> Optional[int]:
+        """Concurrent calls the pool can take, None when some member is uncapped"""
+        if any(not member.max_concurrency for member in self.members):
+            return None
+        return sum(member.max_concurrency for member in self.members)
+
+    @contextmanager
+    def acquire(self, timeout: float = None):
+        """Hold the best member for one call; failures count towards its ejection"""
+        member = self._checkout(Config.POOL_ACQUIRE_TIMEOUT if timeout is None else timeout)
+        start = time.monotonic()
+        ok = False
+        try:
+            yield member
+            ok = True
+        except ResponseRejected as e:
+            # A bad answer is the model's fault, unless the endpoint served an error page
+            ok = e.reason != 'error_page'
+            raise
+        finally:
+            self._checkin(member, ok, time.monotonic() - start)
+
+    def export(self) -> List[Dict]:
+        with self._cond:
+            return [dict(member.export(), position=position) for position, member in enumerate(self.members)]
+
+    def _checkout(self, timeout: float) -> PoolMember:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                candidates = [member for member in self.members if member.available(now)]
+                if not candidates and all(member.ejected_until > now for member in self.members):
+                    # Everything is ejected: better to try the member due back first than to fail
+                    candidates = [min(self.members, key=lambda member: member.ejected_until)]
+                if candidates:
+                    member = min(candidates, key=self._score)
+                    member.outstanding += 1
+                    member.requests += 1
+                    return member
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolExhausted(f"All {len(self.members)} {self.provider} pool members are at capacity")
+                self._cond.wait(remaining)
+
+    def _score(self, member: PoolMember):
+        # Random tie-break so idle members share the load instead of the first taking it all
+        if self.strategy == 'ewma':
+            latency = member.ewma_latency if member.ewma_latency is not None else 0.0
+            return (latency * (member.outstanding + 1), random.random())
+        return (member.outstanding, member.ewma_latency or 0.0, random.random())
+
+    def _checkin(self, member: PoolMember, ok: bool, latency: float) -> None:
+        with self._cond:
+            member.outstanding -= 1
+            if ok:
+                member.failures = 0
+                member.ejections = 0
+                member.ewma_latency = latency if member.ewma_latency is None else \
+                    0.3 * latency + 0.7 * member.ewma_latency
+            else:
+                member.failures += 1
+                if member.failures >= Config.POOL_EJECT_AFTER and len(self.members) > 1:
+                    duration = min(Config.POOL_EJECT_SECONDS * 2 ** member.ejections, 600)
+                    member.ejected_until = time.monotonic() + duration
+                    member.ejections += 1
+                    member.failures = 0
+                    # By position: keys rotate, so fingerprints would keep adding series
+                    metrics.POOL_EJECTIONS.labels(self.provider, str(self.members.index(member))).inc()
+                    logger.warning("Ejected %s pool member %s for %ss", self.provider, member.label, duration)
+            self._cond.notify()
@@ -0,0 +1,186 @@
+import gc
+import os
+import importlib
+import itertools
+import sys
+import time
+import cProfile
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+from typing import Iterator, List, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import greenlet
+except ImportError:  # Only present under the gevent workers
+    greenlet = None
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+
+def _native(module: str, name: str):
+    """The unpatched stdlib function, so a sampler keeps running while greenlets hog the CPU"""
+    if monkey is not None and monkey.is_module_patched(module):
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
+
+
+class ProfileStore:
+    """Profiler output under Config.PROFILE_FOLDER, keeping only the newest PROFILE_KEEP files"""
+
+    def __init__(self, directory: str = None, keep: int = None):
+        self.directory = directory or Config.PROFILE_FOLDER
+        self.keep = keep or Config.PROFILE_KEEP
+        self._sequence = itertools.count(1)
+
+    def path(self, kind: str, name: str, ext: str) -> str:
+        """A fresh file path; worker pid included since every worker profiles only itself"""
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence)}"
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{kind}-{stamp}-{name}.{ext}")
+
+    def write(self, kind: str, name: str, ext: str, text: str) -> str:
+        path = self.path(kind, name, ext)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self.prune()
+        return path
+
+    def list(self) -> List[dict]:
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append({'name': name, 'size': stat.st_size, 'created_at': stat.st_mtime})
+        return sorted(entries, key=lambda entry: entry['created_at'], reverse=True)
+
+    def prune(self) -> None:
+        for entry in self.list()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, entry['name']))
+            except OSError:
+                pass
+
+
+def profile_stream(events: Iterator, store: ProfileStore, name: str) -> Iterator:
+    """Run an SSE generator under cProfile and dump pstats once it finishes.
+
+    The profiler hooks the worker thread, so under gevent it also sees the
+    other greenlets (including the section pipeline) that run during the
+    generation; with real threads only the stream itself is captured.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield from events
+    finally:
+        profiler.disable()
+        path = store.path('cprofile', name, 'prof')
+        try:
+            profiler.dump_stats(path)
+            store.prune()
+            logger.info("Wrote generation profile %s", path)
+        except Exception as e:
+            logger.warning("Failed to write profile %s: %s", path, e)
+
+
+def _collapse(frame, root: str) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.append(root)
+    return ';'.join(reversed(names))
+
+
+def _suspended_greenlets() -> list:
+    if greenlet is None:
+        return []
+    return [obj for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet) and obj.gr_frame is not None]
+
+
+def sample_stacks(seconds: float, interval: float = None, include_idle: bool = True) -> Counter:
+    """Sample the stacks of every thread, and of suspended greenlets, for a while.
+
+    Returns collapsed stacks ("root;outer;inner" -> samples) as used by
+    flamegraph.pl and speedscope. The sampler runs on a native thread, so
+    it keeps sampling while a greenlet hogs the CPU; the waiting caller
+    sleeps cooperatively.
+    """
+    interval = interval or Config.PROFILE_SAMPLE_INTERVAL
+    stacks = Counter()
+    done = []  # A plain flag: a gevent Event can't be set from a native thread
+    native_sleep = _native('time', 'sleep')
+
+    def run():
+        sampler = _native('_thread', 'get_ident')()
+        names = {}
+        waiting = []
+        refreshed = 0.0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if time.monotonic() - refreshed >= 1.0:
+                # Scanning the heap for greenlets is costly, so only once a second
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                waiting = _suspended_greenlets() if include_idle else []
+                refreshed = time.monotonic()
+            for ident, frame in sys._current_frames().items():
+                if ident != sampler:
+                    stacks[_collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+            for glet in waiting:
+                if glet.gr_frame is not None:
+                    stacks[_collapse(glet.gr_frame, 'greenlet (waiting)')] += 1
+            native_sleep(interval)
+        done.append(True)
+
+    _native('_thread', 'start_new_thread')(run, ())
+    while not done:
+        time.sleep(0.1)  # Cooperative under gevent
+    return stacks
+
+
+def format_collapsed(stacks: Counter) -> str:
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def memory_diff(seconds: float, limit: int = 50, frames: int = 1) -> str:
+    """Top allocation growth over a window, from two tracemalloc snapshots"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore),
+                                                   'traceback' if frames > 1 else 'lineno')
+    lines = [f"tracemalloc diff over {seconds}s in worker {os.getpid()}, top {limit}"]
+    for stat in stats[:limit]:
+        lines.append(str(stat))
+        if frames > 1:
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+    return '\n'.join(lines) + '\n'
+
+
+def bounded_seconds(value: Optional[str], default: float = 10.0) -> float:
+    try:
+        seconds = float(value) if value else default
+    except ValueError:
+        seconds = default
+    return max(0.1, min(seconds, Config.PROFILE_MAX_SECONDS))
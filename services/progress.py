@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from config import Config
+from services import metrics
+from services.bus import EventBus
+
+logger = logging.getLogger(__name__)
+
+PENDING, IN_PROGRESS, COMPLETE, ERROR = range(4)
+STATUS_NAMES = ('pending', 'in-progress', 'complete', 'error')
+
+STEP_TEXTS = (
+    "Preparing document structure...",
+    "Generating index/table of contents...",
+    "Determining chapters...",
+    "Writing content...",
+    "Finalizing document...",
+    "Converting to Word format..."
+)
+WRITING_STEP = 3  # The step that holds one sub-step per chapter
+
+
+class Step:
+    """One progress step; timings are monotonic, the JSON fragment is cached until it changes"""
+    __slots__ = ('id', 'text', 'status', 'message', 'started', 'finished', 'children', '_json')
+
+    def __init__(self, step_id, text: str):
+        self.id = step_id
+        self.text = text
+        self.status = PENDING
+        self.message = None
+        self.started = None
+        self.finished = None
+        self.children: Optional[List['Step']] = None
+        self._json = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def set_status(self, status: int, message: str = None) -> None:
+        if status == IN_PROGRESS and self.started is None:
+            self.started = time.monotonic()
+        elif status in (COMPLETE, ERROR):
+            self.finished = time.monotonic()
+            if self.started is None:
+                self.started = self.finished  # Settled without ever running
+        self.status = status
+        if message is not None:
+            self.message = message
+        self._json = None
+
+    def to_dict(self) -> Dict:
+        data = {'id': self.id, 'text': self.text, 'status': STATUS_NAMES[self.status]}
+        if self.message:
+            data['message'] = self.message
+        if self.finished is not None:
+            data['duration'] = round(self.duration, 1)
+        if self.children is not None:
+            data['subSteps'] = [child.to_dict() for child in self.children]
+        return data
+
+    def to_json(self) -> str:
+        if self._json is None:
+            data = self.to_dict()
+            children = data.pop('subSteps', None)
+            fragment = json.dumps(data)
+            if children is not None:
+                fragment = fragment[:-1] + ', "subSteps": [' + ', '.join(c.to_json() for c in self.children) + ']}'
+            self._json = fragment
+        return self._json
+
+
+class PaperProgress:
+    """Progress of one generation, changed only through apply().
+
+    The same object feeds the SSE stream, the job status API, the shared
+    snapshot other workers read and the generation metrics.
+    """
+    __slots__ = ('task_id', 'tenant', 'paper_id', 'steps', 'progress', 'current_step', 'queue_position',
+                 'outcome', 'message', 'abort', 'created', 'finished', 'listener', 'version',
+                 '_steps_json', '_snapshot')
+
+    def __init__(self, task_id: str, tenant: str = None,
+                 listener: Callable[['PaperProgress', str, Dict], None] = None):
+        self.task_id = task_id
+        self.tenant = tenant
+        self.paper_id = None
+        self.steps = [Step(i, text) for i, text in enumerate(STEP_TEXTS)]
+        self.steps[WRITING_STEP].children = []
+        self.progress = 0.0
+        self.current_step = None
+        self.queue_position = None
+        self.outcome = None
+        self.message = None
+        self.abort = False
+        self.created = time.monotonic()
+        self.finished = None
+        self.listener = listener
+        self.version = 0
+        self._steps_json = None
+        self._snapshot = None
+
+    @property
+    def chapters(self) -> List[Step]:
+        return self.steps[WRITING_STEP].children
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.created
+
+    def apply(self, event: str, **fields) -> None:
+        """The reducer: every change to the progress goes through here"""
+        getattr(self, f"_on_{event}")(**fields)
+        self.version += 1
+        if self.listener is not None:
+            try:
+                self.listener(self, event, fields)
+            except Exception as e:
+                logger.warning("Progress listener failed for %s: %s", self.task_id, e)
+
+    def _on_queued(self, position: int) -> None:
+        self.queue_position = position
+
+    def _on_started(self, paper_id: str) -> None:
+        self.paper_id = paper_id
+        self.queue_position = None
+
+    def _on_step(self, index: int, status: int, message: str = None) -> None:
+        self.steps[index].set_status(status, message)
+        self.current_step = index
+        self._steps_json = None
+
+    def _on_chapters(self, titles: List[str]) -> None:
+        self.steps[WRITING_STEP].children = [Step(f"chapter_{i}", title) for i, title in enumerate(titles)]
+        self.steps[WRITING_STEP]._json = None
+        self._steps_json = None
+
+    def _on_chapter(self, index: int, status: int, message: str = None) -> None:
+        self.chapters[index].set_status(status, message)
+        self.steps[WRITING_STEP]._json = None
+        self.current_step = WRITING_STEP
+        self._steps_json = None
+
+    def _on_progress(self, value: float, current_step: int = None) -> None:
+        # Monotonic, so a parallel section finishing out of order never moves the bar back
+        self.progress = max(self.progress, round(value, 1))
+        if current_step is not None:
+            self.current_step = current_step
+
+    def _on_finish(self, outcome: str, message: str = None) -> None:
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        self.message = message
+        self.finished = time.monotonic()
+        if outcome in ('complete', 'partial'):
+            self.progress = 100.0
+
+    def steps_json(self) -> str:
+        if self._steps_json is None:
+            self._steps_json = '[' + ', '.join(step.to_json() for step in self.steps) + ']'
+        return self._steps_json
+
+    def chapter_progress(self, index: int) -> Dict:
+        """Payload for the chapter progress panel of the page"""
+        chapter = self.chapters[index]
+        done = sum(1 for c in self.chapters if c.status in (COMPLETE, ERROR))
+        current = done if chapter.status in (COMPLETE, ERROR) else done + 1
+        data = {
+            'current': current,
+            'total': len(self.chapters),
+            'chapter': chapter.text,
+            'percent': current / len(self.chapters) * 100
+        }
+        if chapter.finished is not None:
+            data['duration'] = round(chapter.duration, 1)
+        if chapter.status == ERROR:
+            data['error'] = chapter.message
+        return data
+
+    def event(self, with_steps: bool = True, **extra) -> str:
+        """An SSE message; the steps are spliced in from cached JSON fragments"""
+        data = {'progress': self.progress, 'current_step': self.current_step}
+        data.update(extra)
+        body = json.dumps(data)
+        if with_steps:
+            body = '{"steps": ' + self.steps_json() + ', ' + body[1:]
+        return "data: " + body + "\n\n"
+
+    def to_dict(self) -> Dict:
+        return {
+            'task_id': self.task_id,
+            'paper_id': self.paper_id,
+            'status': self.outcome or ('queued' if self.queue_position is not None else 'running'),
+            'queue_position': self.queue_position,
+            'progress': self.progress,
+            'current_step': self.current_step,
+            'message': self.message,
+            'elapsed': round(self.elapsed, 1),
+            'steps': [step.to_dict() for step in self.steps]
+        }
+
+    def snapshot_json(self) -> str:
+        """to_dict() plus the tenant as JSON, serialized once per change however many readers"""
+        if self._snapshot is None or self._snapshot[0] != self.version:
+            self._snapshot = (self.version, json.dumps(dict(self.to_dict(), tenant=self.tenant)))
+        return self._snapshot[1]
+
+
+class ProgressRegistry:
+    """Progress of this worker's generations, by task id.
+
+    Finished jobs stay queryable until PROGRESS_KEEP_FINISHED newer ones
+    have finished. Snapshots are written to PROGRESS_FOLDER, at most every
+    PROGRESS_SNAPSHOT_INTERVAL seconds per job, so the status API can
+    answer from any worker. Every change is also published on the bus,
+    with the task id as topic.
+    """
+
+    def __init__(self, directory: str = None, bus: EventBus = None):
+        self.directory = directory or Config.PROGRESS_FOLDER
+        self.bus = bus
+        self._active: Dict[str, PaperProgress] = {}
+        self._finished: 'OrderedDict[str, PaperProgress]' = OrderedDict()
+        self._written: Dict[str, float] = {}
+        self._finish_count = 0
+        self.prune()
+
+    def create(self, task_id: str, tenant: str = None) -> PaperProgress:
+        job = PaperProgress(task_id, tenant, self._changed)
+        self._active[task_id] = job
+        return job
+
+    def get(self, task_id: str) -> Optional[PaperProgress]:
+        return self._active.get(task_id) or self._finished.get(task_id)
+
+    def active(self) -> List[PaperProgress]:
+        return list(self._active.values())
+
+    def snapshot(self, task_id: str) -> Optional[Dict]:
+        """Status of a job, also when another worker runs it"""
+        job = self.get(task_id)
+        if job is not None:
+            return json.loads(job.snapshot_json())
+        return self.read_snapshot(task_id)[1]
+
+    def read_snapshot(self, task_id: str, since: float = None) -> Tuple[Optional[float], Optional[Dict]]:
+        """(mtime, snapshot) of the shared file, (mtime, None) if unchanged since 'since'"""
+        path = self._path(task_id)
+        try:
+            mtime = os.path.getmtime(path)
+            if since is not None and mtime <= since:
+                return mtime, None
+            with open(path, encoding='utf-8') as f:
+                return mtime, json.load(f)
+        except (OSError, ValueError):
+            return None, None
+
+    def _changed(self, job: PaperProgress, event: str, fields: Dict) -> None:
+        if event == 'chapter' and fields['status'] in (COMPLETE, ERROR):
+            chapter = job.chapters[fields['index']]
+            metrics.CHAPTER_DURATION.labels(STATUS_NAMES[chapter.status]).observe(chapter.duration)
+        if self.bus is not None:
+            self.bus.publish(job.task_id, job)
+        final = event == 'finish'
+        now = time.monotonic()
+        if final or now - self._written.get(job.task_id, 0) >= Config.PROGRESS_SNAPSHOT_INTERVAL:
+            self._written[job.task_id] = now
+            self._write(job)
+        if final:
+            self._retire(job)
+
+    def _retire(self, job: PaperProgress) -> None:
+        self._active.pop(job.task_id, None)
+        self._written.pop(job.task_id, None)
+        self._finished[job.task_id] = job
+        while len(self._finished) > Config.PROGRESS_KEEP_FINISHED:
+            self._finished.popitem(last=False)
+        self._finish_count += 1
+        if self._finish_count % 100 == 0:
+            self.prune()
+
+    def _path(self, task_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(task_id)}.json")
+
+    def _write(self, job: PaperProgress) -> None:
+        path = self._path(job.task_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(job.snapshot_json())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write progress snapshot for %s: %s", job.task_id, e)
+
+    def prune(self) -> None:
+        cutoff = time.time() - Config.PROGRESS_RETENTION
+        if not os.path.isdir(self.directory):
+            return  # Created by the first snapshot
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
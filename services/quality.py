@@ -0,0 +1,193 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Callable, Optional
+from config import Config
+from services import metrics
+
+# Shorter minimums for sections that are legitimately short
+SECTION_MIN_CHARS = {'index': 40}
+# Replies to arbitrary prompts, where only an empty one is surely bad: a short answer, an apology,
+# another language or an explanation of HTTP errors may be exactly what was asked for
+FREEFORM_SECTIONS = ('chat',)
+HEAD_CHARS = 300  # Error pages and refusals show up at the very start
+
+_ERROR_PAGE = re.compile(
+    r'<!doctype html|<html|<head>|<body|^\s*\{\s*"(?:error|detail)"'
+    r'|\b(?:502 bad gateway|503 service unavailable|504 gateway time-?out|too many requests|rate limit(?:ed)?'
+    r'|quota exceeded|request ended with status code|model not found|no provider found|internal server error)\b',
+    re.IGNORECASE
+)
+_REFUSAL = re.compile(
+    r"^\W*(?:i'?m sorry|i am sorry|sorry, (?:but )?i|i apologi[sz]e|i can(?:'?t|not) (?:help|assist|comply|provide|write)"
+    r"|as an ai(?: language model)?,? i|i'?m (?:unable|not able) to|i (?:will|must) decline)",
+    re.IGNORECASE
+)
+_WORD = re.compile(r'\w+')
+
+
+class ResponseRejected(Exception):
+    """Raised when a response fails the quality gate.
+
+    completion holds what was received (possibly cut off mid-stream), so the
+    tokens can still be accounted for; early is set when a streamed response
+    was abandoned before it finished.
+    """
+    def __init__(self, reason: str, completion: str = '', early: bool = False):
+        super().__init__(f"Response rejected by quality gate: {reason}")
+        self.reason = reason
+        self.completion = completion
+        self.early = early
+
+
+class StreamInterrupted(BaseException):
+    """Raised when an attempt would start over after part of a relayed answer was already passed on.
+
+    Derives from BaseException so the retries and fallbacks, which catch
+    Exception, give up instead of sending the answer twice.
+    """
+    def __init__(self, sent: int):
+        super().__init__(f"Stream interrupted after {sent} characters were sent")
+        self.sent = sent
+
+
+class StreamRelay:
+    """Passes a response on chunk by chunk as it is streamed, e.g. to a gateway client"""
+
+    def __init__(self, send: Callable[[str], None]):
+        self.send = send
+        self.sent = 0
+
+    def __call__(self, chunk: str) -> None:
+        if chunk:
+            self.send(chunk)
+            self.sent += len(chunk)
+
+
+def repetition_ratio(text: str, n: int = 6) -> float:
+    """Share of word n-grams that repeat an earlier one; loops score close to 1"""
+    words = _WORD.findall(text.lower())
+    shingles = [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+    if len(shingles) < 30:
+        return 0.0
+    return 1 - len(set(shingles)) / len(shingles)
+
+
+def dominant_script(text: str) -> Optional[str]:
+    """Most common Unicode script among the letters, e.g. LATIN, CJK or CYRILLIC"""
+    scripts = Counter(unicodedata.name(ch, 'UNKNOWN').split(' ', 1)[0] for ch in text if ch.isalpha())
+    return scripts.most_common(1)[0][0] if scripts else None
+
+
+def script_letters(text: str, script: str) -> int:
+    return sum(1 for ch in text if ch.isalpha() and unicodedata.name(ch, 'UNKNOWN').startswith(script))
+
+
+class QualityGate:
+    """Heuristic checks that catch degenerate provider responses.
+
+    Rejects empty or too short text, HTML/JSON error pages, refusal
+    boilerplate, repetition loops, answers in a script the prompt doesn't
+    use at all (some g4f providers reply in Chinese) and responses the
+    provider filtered according to finish_reason. Responses cut off at
+    max_tokens are not rejected; the provider layer continues them.
+    Freeform replies such as gateway chat completions are only rejected
+    when empty; a provider's own HTTP errors already fail the call.
+    """
+
+    def __init__(self, min_chars: int = None, max_repetition: float = None):
+        self.min_chars = min_chars or Config.QUALITY_MIN_CHARS
+        self.max_repetition = max_repetition or Config.QUALITY_MAX_REPETITION
+
+    def check(self, text: str, prompt: str = '', finish_reason: str = None, section: str = None) -> Optional[str]:
+        """The reason a complete response is unacceptable, or None"""
+        stripped = (text or '').strip()
+        if not stripped:
+            return 'empty'
+        if section in FREEFORM_SECTIONS:
+            return None
+        reason = self.check_head(stripped[:HEAD_CHARS], prompt)
+        if reason:
+            return reason
+        if len(stripped) < SECTION_MIN_CHARS.get(section, self.min_chars):
+            return 'too_short'
+        if repetition_ratio(stripped) > self.max_repetition:
+            return 'repetition'
+        if finish_reason == 'content_filter':
+            return 'content_filter'
+        return None
+
+    def check_head(self, head: str, prompt: str = '') -> Optional[str]:
+        normalized = head.replace('’', "'")
+        if _ERROR_PAGE.search(normalized):
+            return 'error_page'
+        if _REFUSAL.match(normalized):
+            return 'refusal'
+        script = dominant_script(head)
+        # Even a short subject in another script lends the prompt a few of its letters
+        if prompt and script and script_letters(prompt, script) < 3:
+            return 'language'
+        return None
+
+    def monitor(self, prompt: str = '', section: str = None, relay: StreamRelay = None) -> 'StreamMonitor':
+        return StreamMonitor(self, prompt, section, relay=relay)
+
+
+class StreamMonitor:
+    """Applies the quality gate to a response while it is being streamed.
+
+    Services feed it every chunk; once enough text has arrived it raises
+    ResponseRejected so the stream can be closed early instead of waiting
+    for the rest of a bad answer. With a relay every chunk is also passed
+    on as it arrives; once any was, a new attempt can't start over.
+    """
+
+    def __init__(self, gate: QualityGate, prompt: str, section: str = None, interval: int = 200,
+                 relay: StreamRelay = None):
+        self.gate = gate
+        self.prompt = prompt
+        self.section = section
+        self.interval = interval
+        self.relay = relay
+        self.reset()
+
+    def reset(self) -> None:
+        """Start over for a new attempt, e.g. with a fallback model"""
+        if self.relay is not None and self.relay.sent:
+            raise StreamInterrupted(self.relay.sent)
+        self.parts = []
+        self.length = 0
+        self._checked_at = 0
+        self._head_checked = False
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    def feed(self, chunk: str) -> None:
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        if self.relay is not None:
+            self.relay(chunk)
+        if self.length - self._checked_at < self.interval or self.section in FREEFORM_SECTIONS:
+            return
+        self._checked_at = self.length
+        text = self.text
+        reason = None
+        if not self._head_checked and len(text.strip()) >= 120:
+            self._head_checked = True
+            reason = self.gate.check_head(text.strip()[:HEAD_CHARS], self.prompt)
+        if not reason and self.length >= 1500:
+            # Only the recent tail, so a loop is caught soon after it starts
+            if repetition_ratio(text[-1500:]) > self.gate.max_repetition:
+                reason = 'repetition'
+        if reason:
+            metrics.QUALITY_REJECTIONS.labels(reason, 'stream').inc()
+            raise ResponseRejected(reason, text, early=True)
+
+    def check(self, text: str, finish_reason: str = None) -> None:
+        """Final check of a complete response; raises ResponseRejected"""
+        reason = self.gate.check(text, self.prompt, finish_reason, self.section)
+        if reason:
+            metrics.QUALITY_REJECTIONS.labels(reason, 'complete').inc()
+            raise ResponseRejected(reason, text)
@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# CSL-JSON, the input format of citeproc; only the fields the formatters below use
+REFERENCES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "references": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "type": {"type": "string"},
+                    "title": {"type": "string"},
+                    "author": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"family": {"type": "string"}, "given": {"type": "string"}},
+                            "required": ["family"]
+                        }
+                    },
+                    "issued": {
+                        "type": "object",
+                        "properties": {"date-parts": {"type": "array", "items": {"type": "array",
+                                                                                  "items": {"type": "integer"}}}}
+                    },
+                    "container-title": {"type": "string"},
+                    "publisher": {"type": "string"},
+                    "volume": {"type": "string"},
+                    "issue": {"type": "string"},
+                    "page": {"type": "string"},
+                    "DOI": {"type": "string"},
+                    "URL": {"type": "string"}
+                },
+                "required": ["id", "type", "title", "author", "issued"]
+            }
+        }
+    },
+    "required": ["references"]
+}
+
+_FIELDS = ('container-title', 'publisher', 'volume', 'issue', 'page', 'DOI', 'URL')
+
+
+def references_prompt(research_subject: str, chapter_titles: List[str] = None, count: int = None) -> str:
+    prompt = f"List {count or Config.REFERENCES_COUNT} real, verifiable scholarly sources for a research paper about {research_subject}"
+    if chapter_titles:
+        prompt += f" covering these chapters: {', '.join(chapter_titles)}"
+    return prompt + (
+        ". Return them as CSL-JSON: a JSON object with a 'references' array whose items have an 'id', a 'type' "
+        "(article-journal, book, chapter, paper-conference, report or webpage), the 'title', the 'author' list "
+        "of objects with 'family' and 'given' names, 'issued' as {\"date-parts\": [[year]]} and, where they apply, "
+        "'container-title', 'publisher', 'volume', 'issue', 'page', 'DOI' and 'URL'. "
+        "Do not format the references in any citation style."
+    )
+
+
+def parse_references(text: str) -> List[Dict]:
+    """CSL-JSON items from a model reply, dropping entries without a title"""
+    stripped = (text or '').strip()
+    if stripped.startswith('```'):
+        stripped = re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', stripped)
+    start = min((i for i in (stripped.find('{'), stripped.find('[')) if i >= 0), default=-1)
+    if start < 0:
+        return []
+    try:
+        data, _ = json.JSONDecoder().raw_decode(stripped[start:])
+    except ValueError:
+        return []
+    items = data.get('references', []) if isinstance(data, dict) else data
+    references = []
+    for i, item in enumerate(items if isinstance(items, list) else [], 1):
+        if not isinstance(item, dict) or not str(item.get('title') or '').strip():
+            continue
+        authors = [author for author in item.get('author') or [] if isinstance(author, dict)
+                   and (author.get('family') or author.get('literal'))]
+        reference = {'id': str(item.get('id') or f"ref{i}"), 'type': item.get('type') or 'article-journal',
+                     'title': str(item['title']).strip(), 'author': authors}
+        year = issued_year(item)
+        if year:
+            reference['issued'] = {'date-parts': [[year]]}
+        for field in _FIELDS:
+            if item.get(field) not in (None, ''):
+                reference[field] = str(item[field]).strip()
+        references.append(reference)
+    return references
+
+
+def issued_year(item: Dict) -> Optional[int]:
+    try:
+        return int(item['issued']['date-parts'][0][0])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _initials(given: str) -> str:
+    return ' '.join(f"{part[0]}." for part in re.split(r'[\s.]+', given or '') if part)
+
+
+def _name(author: Dict, inverted: bool = True, initials: bool = False) -> str:
+    if author.get('literal'):
+        return author['literal']
+    family, given = author.get('family', ''), author.get('given', '')
+    given = _initials(given) if initials else given
+    if not given:
+        return family
+    return f"{family}, {given}" if inverted else f"{given} {family}"
+
+
+def _join(names: List[str], conjunction: str = 'and', serial: bool = True) -> str:
+    if len(names) <= 1:
+        return ''.join(names)
+    if len(names) == 2:
+        # An inverted first name ("Family, Given") needs the comma even between two
+        return f"{names[0]}{',' if serial and ',' in names[0] else ''} {conjunction} {names[1]}"
+    return f"{', '.join(names[:-1])}{',' if serial else ''} {conjunction} {names[-1]}"
+
+
+def _end(text: str) -> str:
+    return text if text.endswith(('.', '?', '!')) else f"{text}."
+
+
+def _is_book(item: Dict) -> bool:
+    return item['type'] in ('book', 'report') or not item.get('container-title')
+
+
+def _pages(item: Dict) -> str:
+    return item.get('page', '').replace('-', '–')
+
+
+def _doi(item: Dict) -> str:
+    if item.get('DOI'):
+        return f"https://doi.org/{item['DOI'].split('doi.org/')[-1]}"
+    return item.get('URL', '')
+
+
+def format_apa(item: Dict, number: int) -> str:
+    names = [_name(author, initials=True) for author in item['author']]
+    authors = _join(names, '&') if len(names) <= 20 else f"{', '.join(names[:19])}, … {names[-1]}"
+    year = issued_year(item) or 'n.d.'
+    parts = [f"{_end(authors) if authors else ''} ({year}).".strip()]
+    if _is_book(item):
+        parts.append(f"*{_end(item['title'])}*")
+        if item.get('publisher'):
+            parts.append(_end(item['publisher']))
+    else:
+        parts.append(_end(item['title']))
+        source = f"*{item['container-title']}*"
+        if item.get('volume'):
+            source += f", *{item['volume']}*"
+        if item.get('issue'):
+            source += f"({item['issue']})"
+        if item.get('page'):
+            source += f", {_pages(item)}"
+        parts.append(f"{source}.")
+    if _doi(item):
+        parts.append(_doi(item))
+    return ' '.join(parts)
+
+
+def format_mla(item: Dict, number: int) -> str:
+    authors = item['author']
+    if len(authors) >= 3:
+        names = f"{_name(authors[0])}, et al."
+    elif len(authors) == 2:
+        names = f"{_name(authors[0])}, and {_name(authors[1], inverted=False)}."
+    else:
+        names = _end(_name(authors[0])) if authors else ''
+    year = issued_year(item)
+    if _is_book(item):
+        parts = [names, f"*{_end(item['title'])}*"]
+        details = [item.get('publisher'), str(year) if year else None]
+    else:
+        parts = [names, f"\"{_end(item['title'])}\""]
+        details = [f"*{item['container-title']}*",
+                   f"vol. {item['volume']}" if item.get('volume') else None,
+                   f"no. {item['issue']}" if item.get('issue') else None,
+                   str(year) if year else None,
+                   f"pp. {_pages(item)}" if item.get('page') else None]
+    details = [detail for detail in details if detail]
+    if details:
+        parts.append(f"{', '.join(details)}.")
+    if item.get('DOI'):
+        parts.append(f"https://doi.org/{item['DOI'].split('doi.org/')[-1]}.")
+    return ' '.join(part for part in parts if part)
+
+
+def format_chicago(item: Dict, number: int) -> str:
+    """Chicago author-date reference list entry"""
+    names = [_name(author, inverted=(i == 0)) for i, author in enumerate(item['author'])]
+    parts = [_end(_join(names)) if names else '', _end(str(issued_year(item) or 'n.d.'))]
+    if _is_book(item):
+        parts.append(f"*{_end(item['title'])}*")
+        if item.get('publisher'):
+            parts.append(_end(item['publisher']))
+    else:
+        source = f"\"{_end(item['title'])}\" *{item['container-title']}*"
+        if item.get('volume'):
+            source += f" {item['volume']}"
+        if item.get('issue'):
+            source += f" ({item['issue']})"
+        if item.get('page'):
+            source += f": {_pages(item)}"
+        parts.append(f"{source}.")
+    if _doi(item):
+        parts.append(f"{_doi(item)}.")
+    return ' '.join(part for part in parts if part)
+
+
+def format_harvard(item: Dict, number: int) -> str:
+    names = [_name(author, initials=True) for author in item['author']]
+    parts = [f"{_join(names, serial=False)} ({issued_year(item) or 'n.d.'})".strip()]
+    if _is_book(item):
+        parts.append(f"*{_end(item['title'])}*")
+        if item.get('publisher'):
+            parts.append(_end(item['publisher']))
+    else:
+        source = f"'{item['title']}', *{item['container-title']}*"
+        if item.get('volume'):
+            source += f", {item['volume']}"
+            if item.get('issue'):
+                source += f"({item['issue']})"
+        if item.get('page'):
+            source += f", pp. {_pages(item)}"
+        parts.append(f"{source}.")
+    if item.get('DOI'):
+        parts.append(f"doi:{item['DOI'].split('doi.org/')[-1]}.")
+    elif item.get('URL'):
+        parts.append(f"Available at: {item['URL']}.")
+    return ' '.join(parts)
+
+
+def format_ieee(item: Dict, number: int) -> str:
+    names = [_name(author, inverted=False, initials=True) for author in item['author']]
+    authors = _join(names) if len(names) <= 6 else f"{names[0]} *et al.*"
+    year = issued_year(item)
+    if _is_book(item):
+        details = [f"*{item['title']}*", item.get('publisher'), str(year) if year else None]
+        entry = f"{authors}, {', '.join(detail for detail in details if detail)}."
+    else:
+        details = [f"*{item['container-title']}*",
+                   f"vol. {item['volume']}" if item.get('volume') else None,
+                   f"no. {item['issue']}" if item.get('issue') else None,
+                   f"pp. {_pages(item)}" if item.get('page') else None,
+                   str(year) if year else None,
+                   f"doi: {item['DOI'].split('doi.org/')[-1]}" if item.get('DOI') else None]
+        entry = f"{authors}, \"{item['title']},\" {', '.join(detail for detail in details if detail)}."
+    return f"[{number}] {entry.lstrip(', ')}"
+
+
+STYLES: Dict[str, Callable[[Dict, int], str]] = {
+    'apa': format_apa,
+    'mla': format_mla,
+    'chicago': format_chicago,
+    'harvard': format_harvard,
+    'ieee': format_ieee
+}
+NUMBERED_STYLES = ('ieee',)  # Listed in citation order; the others alphabetically
+
+
+def format_references(items: List[Dict], style: str = None) -> str:
+    """The references section in a citation style; raises ValueError for an unknown style"""
+    key = (style or Config.CITATION_STYLE).strip().lower()
+    if key not in STYLES:
+        raise ValueError(f"Unknown citation style {style}, expected one of {', '.join(sorted(STYLES))}")
+    if key not in NUMBERED_STYLES:
+        items = sorted(items, key=lambda item: ((_name(item['author'][0]) if item['author'] else item['title']).lower(),
+                                                issued_year(item) or 0))
+    entries = [STYLES[key](item, number) for number, item in enumerate(items, 1)]
+    return '\n\n'.join(entries if key in NUMBERED_STYLES else [f"- {entry}" for entry in entries])
+
+
+class ReferenceStore:
+    """CSL-JSON reference data per paper, so any citation style can be rendered without the model"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or Config.REFERENCES_DIR
+
+    def _path(self, paper_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(paper_id)}.json")
+
+    def get(self, paper_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(paper_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, paper_id: str, tenant: str, subject: str, items: List[Dict]) -> None:
+        record = {'paper_id': paper_id, 'tenant': tenant, 'subject': subject, 'items': items,
+                  'created_at': time.time()}
+        path = self._path(paper_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from config import Config
+from services.model_provider import Completion
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Gate-approved completions by model and prompt, shared by all workers through SQLite.
+
+    Identical requests arriving together in one worker are coalesced into a
+    single provider call. Truncated answers are never stored.
+    """
+
+    def __init__(self, path: str = None, ttl: int = None):
+        self.path = path or Config.GATEWAY_CACHE_PATH
+        self.ttl = Config.GATEWAY_CACHE_TTL if ttl is None else ttl
+        self._conn = None  # Opened on first use, so importing the app leaves no files behind
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, List] = {}  # key -> [lock, callers holding or waiting on it]
+        self._puts = 0
+
+    def _execute(self, query: str, params=()):
+        with self._lock:
+            return self._connection().execute(query, params).fetchall()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The database connection, opened with its schema on first use; the caller holds the lock"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, model TEXT, content TEXT NOT NULL, finish_reason TEXT,
+                usage TEXT, created REAL NOT NULL)''')
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def key(model: str, prompt: str, response_format: Optional[Dict] = None, options: Optional[Dict] = None) -> str:
+        payload = json.dumps([model, prompt, response_format] + ([options] if options else []), sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Completion]:
+        if not self.ttl:
+            return None
+        rows = self._execute('SELECT model, content, finish_reason, usage FROM responses WHERE key = ? AND created > ?',
+                             (key, time.time() - self.ttl))
+        if not rows:
+            return None
+        model, content, finish_reason, usage = rows[0]
+        return Completion(content, model, finish_reason, json.loads(usage) if usage else None)
+
+    def put(self, key: str, completion: Completion) -> None:
+        if not self.ttl or getattr(completion, 'finish_reason', None) == 'length':
+            return
+        self._execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                      (key, getattr(completion, 'model', None), str(completion),
+                       getattr(completion, 'finish_reason', None),
+                       json.dumps(getattr(completion, 'usage', None) or {}), time.time()))
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self._execute('DELETE FROM responses WHERE created <= ?', (time.time() - self.ttl,))
+
+    def get_or_compute(self, key: str, compute: Callable[[], Completion]) -> (Completion, bool):
+        """(completion, cached); concurrent callers with the same key wait for the first one"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached, True
+        with self._lock:
+            flight = self._inflight.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                cached = self.get(key)
+                if cached is not None:
+                    return cached, True
+                completion = compute()
+                try:
+                    self.put(key, completion)
+                except sqlite3.Error as e:
+                    logger.warning("Failed to cache response: %s", e)
+                return completion, False
+        finally:
+            # Only the last caller drops the lock; a newcomer meanwhile must queue on the same one
+            with self._lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self._inflight[key]
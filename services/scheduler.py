@@ -0,0 +1,226 @@
+import os
+import hmac
+import time
+import sqlite3
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from config import Config
+from services import metrics
+
+# Tenant the current generation runs for; set by the route that starts it
+current_tenant: ContextVar[str] = ContextVar('current_tenant', default='anonymous')
+
+
+class QuotaExceeded(Exception):
+    """Raised when a tenant has used up its daily token quota"""
+    def __init__(self, tenant: str, retry_after: int):
+        super().__init__(f"Daily token quota exceeded for {tenant}")
+        self.tenant = tenant
+        self.retry_after = retry_after
+
+
+def bearer_token(request) -> Optional[str]:
+    """The key of an OpenAI-style 'Authorization: Bearer <key>' header"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+def tenant_from_request(request, session) -> str:
+    """Identify the caller: configured API key first, then browser session, then client IP.
+
+    Unknown keys identify nobody, and X-Forwarded-For is only believed as
+    far as TRUSTED_PROXY_COUNT proxies of our own appended to it; otherwise
+    a caller could pick a fresh tenant, quota and share, per request.
+    """
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key') or bearer_token(request)
+    if api_key and any(hmac.compare_digest(api_key.encode('utf-8'), allowed.encode('utf-8'))
+                       for allowed in Config.TENANT_API_KEYS + Config.GATEWAY_API_KEYS):
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+    if session.get('tenant'):
+        return 'session:' + session['tenant']
+    return 'ip:' + (client_ip(request) or 'unknown')
+
+
+def client_ip(request) -> Optional[str]:
+    """The address the first trusted proxy saw the request come from, else the peer's"""
+    if Config.TRUSTED_PROXY_COUNT:
+        forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(forwarded) >= Config.TRUSTED_PROXY_COUNT:
+            return forwarded[-Config.TRUSTED_PROXY_COUNT]
+    return request.remote_addr
+
+
+class _Waiter:
+    __slots__ = ('tenant', 'start_tag', 'seq', 'enqueued_at')
+
+    def __init__(self, tenant: str, start_tag: float, seq: int):
+        self.tenant = tenant
+        self.start_tag = start_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+
+class UsageStore:
+    """Daily per-tenant token and call counters shared by all workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # One connection per process, opened on first use; greenlets share it under the lock
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._connection().execute(query, params).fetchall()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The database connection, opened with its schema on first use; the caller holds the lock"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS tenant_usage (
+                    tenant TEXT NOT NULL, day TEXT NOT NULL,
+                    tokens INTEGER NOT NULL DEFAULT 0, calls INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (tenant, day))''')
+            self._conn = conn
+        return self._conn
+
+    def add(self, tenant: str, day: str, tokens: int) -> None:
+        self._execute(
+            '''INSERT INTO tenant_usage (tenant, day, tokens, calls) VALUES (?, ?, ?, 1)
+               ON CONFLICT(tenant, day) DO UPDATE SET tokens = tokens + excluded.tokens, calls = calls + 1''',
+            (tenant, day, tokens))
+
+    def tokens(self, tenant: str, day: str) -> int:
+        rows = self._execute('SELECT tokens FROM tenant_usage WHERE tenant = ? AND day = ?', (tenant, day))
+        return rows[0][0] if rows else 0
+
+    def report(self, day: str, tenant: str = None) -> List[Dict]:
+        query = 'SELECT tenant, tokens, calls FROM tenant_usage WHERE day = ?'
+        params = [day]
+        if tenant:
+            query += ' AND tenant = ?'
+            params.append(tenant)
+        rows = self._execute(query + ' ORDER BY tokens DESC', params)
+        return [{'tenant': t, 'tokens': tokens, 'calls': calls} for t, tokens, calls in rows]
+
+
+class FairScheduler:
+    """Weighted fair queuing of provider calls across tenants.
+
+    Uses start-time fair queuing: every call gets a virtual start tag of
+    max(virtual time, the tenant's previous finish tag), and its finish tag
+    adds the call's token cost divided by the tenant's weight. Free slots go
+    to the waiting call with the smallest start tag whose tenant is under its
+    concurrency cap, so a tenant submitting many calls only delays its own
+    later calls. Concurrency is per worker; token quotas are shared by all
+    workers through the usage store.
+    """
+
+    def __init__(self, max_concurrency: int = None, tenant_concurrency: int = None,
+                 daily_token_quota: int = None, weights: Dict[str, float] = None, usage_path: str = None):
+        self.max_concurrency = max_concurrency or Config.SCHEDULER_MAX_CONCURRENCY
+        self.tenant_concurrency = tenant_concurrency or Config.SCHEDULER_TENANT_CONCURRENCY
+        self.daily_token_quota = Config.SCHEDULER_DAILY_TOKEN_QUOTA if daily_token_quota is None else daily_token_quota
+        self.weights = weights if weights is not None else Config.SCHEDULER_TENANT_WEIGHTS
+        self.usage = UsageStore(usage_path or Config.USAGE_DB_PATH)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Waiter] = []
+        self._running: Dict[str, int] = {}
+        self._finish_tags: Dict[str, float] = {}
+        self._virtual_time = 0.0
+
+    @contextmanager
+    def slot(self, tenant: str, cost: int):
+        """Hold one provider-call slot for the tenant while the block runs"""
+        self._acquire(tenant, cost)
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    def check_quota(self, tenant: str) -> None:
+        if self.daily_token_quota and self.quota_remaining(tenant) <= 0:
+            raise QuotaExceeded(tenant, self._seconds_until_reset())
+
+    def quota_remaining(self, tenant: str) -> Optional[int]:
+        if not self.daily_token_quota:
+            return None
+        return self.daily_token_quota - self.usage.tokens(tenant, self._today())
+
+    def record_usage(self, tenant: str, tokens: int) -> None:
+        self.usage.add(tenant, self._today(), tokens)
+
+    def report(self, tenant: str = None) -> List[Dict]:
+        """Today's usage per tenant, with this worker's live queue state"""
+        entries = self.usage.report(self._today(), tenant)
+        with self._cond:
+            for entry in entries:
+                entry['running'] = self._running.get(entry['tenant'], 0)
+                entry['queued'] = sum(1 for w in self._waiting if w.tenant == entry['tenant'])
+                entry['weight'] = self._weight(entry['tenant'])
+                if self.daily_token_quota:
+                    entry['quota_remaining'] = max(0, self.daily_token_quota - entry['tokens'])
+        return entries
+
+    def _weight(self, tenant: str) -> float:
+        return self.weights.get(tenant, self.weights.get('default', 1.0))
+
+    def _acquire(self, tenant: str, cost: int) -> None:
+        with self._cond:
+            start_tag = max(self._virtual_time, self._finish_tags.get(tenant, 0.0))
+            self._finish_tags[tenant] = start_tag + cost / self._weight(tenant)
+            waiter = _Waiter(tenant, start_tag, next(self._seq))
+            self._waiting.append(waiter)
+            metrics.SCHEDULER_QUEUED.inc()
+            try:
+                while self._next_waiter() is not waiter:
+                    self._cond.wait(timeout=1.0)
+            except BaseException:
+                self._waiting.remove(waiter)
+                metrics.SCHEDULER_QUEUED.dec()
+                self._cond.notify_all()
+                raise
+            self._waiting.remove(waiter)
+            self._running[tenant] = self._running.get(tenant, 0) + 1
+            self._virtual_time = max(self._virtual_time, start_tag)
+        metrics.SCHEDULER_QUEUED.dec()
+        metrics.SCHEDULER_WAIT.observe(time.monotonic() - waiter.enqueued_at)
+
+    def _release(self, tenant: str) -> None:
+        with self._cond:
+            self._running[tenant] -= 1
+            if not self._running[tenant]:
+                del self._running[tenant]
+                if not any(w.tenant == tenant for w in self._waiting):
+                    # Idle tenants don't bank credit for later
+                    self._finish_tags.pop(tenant, None)
+            self._cond.notify_all()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """The waiter that should get the next free slot, if there is one"""
+        if sum(self._running.values()) >= self.max_concurrency:
+            return None
+        eligible = [w for w in self._waiting if self._running.get(w.tenant, 0) < self.tenant_concurrency]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda w: (w.start_tag, w.seq))
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def _seconds_until_reset() -> int:
+        now = datetime.now(timezone.utc)
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int((tomorrow - now).total_seconds()) + 1
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import time
+import zlib
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+from services.scheduler import current_tenant
+
+CHECKPOINT_EVERY = 1000  # New entries between signature checkpoints
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'into', 'is', 'it', 'its',
+    'of', 'on', 'or', 's', 'the', 'to', 'with', 'about', 'study', 'research', 'paper', 'role', 'effect',
+    'effects', 'analysis', 'towards', 'toward', 'via', 'using', 'between', 'within', 'upon'
+}
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Lowercased, stopword-free, lightly stemmed word tokens"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower().replace("'s", '')):
+        if token in _STOPWORDS:
+            continue
+        for suffix in ('ing', 'ies', 'es', 's'):
+            if len(token) > len(suffix) + 3 and token.endswith(suffix):
+                token = token[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+                break
+        tokens.append(token)
+    return tokens
+
+
+class MinHasher:
+    """Vectorised MinHash signatures over token sets"""
+
+    def __init__(self, num_perm: int, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm).astype(np.uint64)
+
+    def signature(self, tokens: List[str]) -> np.ndarray:
+        if not tokens:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in set(tokens)), dtype=np.uint64)
+        hashes %= _MERSENNE_PRIME
+        # (a * h + b) mod p for every permutation/token pair, then the minimum per permutation
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class SimilarityIndex:
+    """Local MinHash LSH index over archived paper subjects and sections.
+
+    Entries are appended to a shared JSONL log so every worker sees papers
+    written by the others; each worker keeps signatures in a NumPy matrix
+    and LSH band buckets in dicts, catching up on the log before lookups.
+    Paper payloads (outline and section texts) live in one JSON file per
+    paper and are only read when a match is actually reused. Every entry
+    belongs to the tenant whose paper it came from, and lookups only match
+    that tenant's entries.
+    """
+
+    def __init__(self, directory: str = None, num_perm: int = None, bands: int = None):
+        self.directory = directory or Config.SIMILARITY_DIR
+        self.num_perm = num_perm or Config.SIMILARITY_NUM_PERM
+        self.bands = bands or Config.SIMILARITY_BANDS
+        self.rows = self.num_perm // self.bands
+        self.hasher = MinHasher(self.num_perm)
+        self.log_path = os.path.join(self.directory, 'entries.jsonl')
+        self.papers_dir = os.path.join(self.directory, 'papers')  # Created with the first paper
+        # Grown by doubling so catching up never copies the whole matrix per entry
+        self._signatures = np.empty((1024, self.num_perm), dtype=np.uint32)
+        self._entries: List[Tuple[str, str, str, Optional[str]]] = []  # (kind, paper_id, key, tenant)
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._band_weights = np.random.RandomState(2).randint(1, 2 ** 31, size=self.rows).astype(np.uint64) * 2 + 1
+        self._offset = 0
+        self._checkpointed = 0
+        self._lock = threading.Lock()
+        self._load_checkpoint()
+
+    def add_paper(self, paper_id: str, subject: str, model: str, outline: Dict,
+                  sections: List[Tuple[str, str]], tenant: str = None) -> None:
+        """Archive a finished paper and index its subject and chapters, for the current tenant by default"""
+        tenant = tenant or current_tenant.get()
+        payload = {
+            'paper_id': paper_id,
+            'subject': subject,
+            'model': model,
+            'tenant': tenant,
+            'outline': outline,
+            'sections': sections,
+            'created_at': time.time()
+        }
+        tmp_path = os.path.join(self.papers_dir, f"{paper_id}.json.tmp")
+        os.makedirs(self.papers_dir, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, os.path.join(self.papers_dir, f"{paper_id}.json"))
+
+        lines = [json.dumps({'kind': 'paper', 'paper_id': paper_id, 'key': subject, 'tenant': tenant})]
+        for chapter in outline.get('chapters', []):
+            lines.append(json.dumps({'kind': 'section', 'paper_id': paper_id, 'tenant': tenant,
+                                     'key': self.section_key(subject, chapter['title'])}))
+        # A single small append is atomic enough for the other workers' readers
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def find_paper(self, subject: str, threshold: float = None, tenant: str = None) -> Optional[Tuple[Dict, float]]:
+        """Best archived paper of the tenant (the current one by default) whose subject is at least threshold-similar"""
+        match = self._best_match('paper', subject, threshold, tenant or current_tenant.get())
+        if match is None:
+            return None
+        paper_id, score = match
+        payload = self.load_paper(paper_id)
+        return (payload, score) if payload else None
+
+    def find_section(self, subject: str, chapter_title: str, threshold: float = None,
+                     tenant: str = None) -> Optional[Tuple[str, float]]:
+        """Text of the tenant's most similar archived chapter, if any"""
+        match = self._best_match('section', self.section_key(subject, chapter_title), threshold,
+                                 tenant or current_tenant.get())
+        if match is None:
+            return None
+        paper_id, score = match
+        payload = self.load_paper(paper_id)
+        if not payload:
+            return None
+        wanted = set(normalize_tokens(chapter_title))
+        for title, text in payload['sections']:
+            if title.startswith('Chapter ') and set(normalize_tokens(title.split(': ', 1)[-1])) == wanted:
+                return text, score
+        return None
+
+    def load_paper(self, paper_id: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.papers_dir, f"{paper_id}.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def section_key(subject: str, chapter_title: str) -> str:
+        # Chapter title words count twice so the chapter matters as much as the subject
+        return f"{chapter_title} {chapter_title} {subject}"
+
+    def _best_match(self, kind: str, text: str, threshold: float, tenant: str) -> Optional[Tuple[str, float]]:
+        threshold = Config.SIMILARITY_THRESHOLD if threshold is None else threshold
+        tokens = normalize_tokens(text)
+        if not tokens:
+            return None
+        self.catch_up()
+        signature = self.hasher.signature(tokens)
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature).tolist()):
+                candidates.update(self._buckets[band].get(key, ()))
+            # Entries logged before tenants were recorded belong to nobody
+            candidates = [i for i in candidates if self._entries[i][0] == kind and self._entries[i][3] == tenant]
+            if not candidates:
+                return None
+            # Estimated Jaccard similarity: share of equal MinHash values
+            scores = (self._signatures[candidates] == signature).mean(axis=1)
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            return self._entries[candidates[best]][1], float(scores[best])
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """One uint64 bucket key per band, for a single signature or a matrix of them"""
+        bands = signatures.reshape(-1, self.bands, self.rows).astype(np.uint64)
+        keys = (bands * self._band_weights).sum(axis=2)  # Wraps around mod 2**64
+        return keys[0] if signatures.ndim == 1 else keys
+
+    def catch_up(self) -> None:
+        """Index log entries appended since the last lookup, by any worker"""
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            return
+        if size == self._offset:
+            return
+        with self._lock:
+            if size == self._offset:
+                return
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read(size - self._offset)
+            # Only consume complete lines; a partial one is picked up next time
+            consumed = data.rfind(b'\n') + 1
+            for line in data[:consumed].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                signature = self.hasher.signature(normalize_tokens(entry['key']))
+                index = len(self._entries)
+                if index == len(self._signatures):
+                    self._signatures = np.resize(self._signatures, (2 * index, self.num_perm))
+                self._signatures[index] = signature
+                self._entries.append((entry['kind'], entry['paper_id'], entry['key'], entry.get('tenant')))
+                self._add_to_buckets(index, signature)
+            self._offset += consumed
+            if len(self._entries) - self._checkpointed >= CHECKPOINT_EVERY:
+                self._save_checkpoint()
+
+    def _add_to_buckets(self, index: int, signature: np.ndarray) -> None:
+        for band, key in enumerate(self._band_keys(signature).tolist()):
+            self._buckets[band].setdefault(key, []).append(index)
+
+    def _load_checkpoint(self) -> None:
+        """Start from saved signatures instead of re-hashing the whole log"""
+        try:
+            with open(os.path.join(self.directory, 'checkpoint.json'), encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            signatures = np.load(os.path.join(self.directory, 'signatures.npy'))
+        except (OSError, ValueError):
+            return
+        count = len(checkpoint['entries'])
+        if checkpoint.get('num_perm') != self.num_perm or len(signatures) < count:
+            return
+        self._signatures = np.resize(signatures[:count], (max(1024, 2 * count), self.num_perm))
+        self._entries = [tuple(entry) + (None,) * (4 - len(entry)) for entry in checkpoint['entries']]
+        keys = self._band_keys(self._signatures[:count])
+        for band in range(self.bands):
+            buckets = self._buckets[band]
+            for index, key in enumerate(keys[:, band].tolist()):
+                buckets.setdefault(key, []).append(index)
+        self._offset = checkpoint['offset']
+        self._checkpointed = count
+
+    def _save_checkpoint(self) -> None:
+        count = len(self._entries)
+        pid = os.getpid()
+        np.save(os.path.join(self.directory, f'signatures.{pid}.npy'), self._signatures[:count])
+        os.replace(os.path.join(self.directory, f'signatures.{pid}.npy'),
+                   os.path.join(self.directory, 'signatures.npy'))
+        tmp_path = os.path.join(self.directory, f'checkpoint.{pid}.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'num_perm': self.num_perm, 'offset': self._offset, 'entries': self._entries}, f)
+        os.replace(tmp_path, os.path.join(self.directory, 'checkpoint.json'))
+        self._checkpointed = count
@@ -0,0 +1,239 @@
+import os
+import time
+import sqlite3
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from config import Config
+
+# Paper the current provider calls belong to; set by the route that generates it
+current_paper: ContextVar[Optional[str]] = ContextVar('current_paper', default=None)
+
+SECTION_KINDS = ('index', 'introduction', 'chapter', 'conclusion', 'references')
+
+
+def section_kind(section_title: str) -> str:
+    """Map a section title such as 'Chapter 2: Methods' to its kind"""
+    title = section_title.lower()
+    if title.startswith('chapter '):
+        return 'chapter'
+    for kind in SECTION_KINDS:
+        if title.startswith(kind):
+            return kind
+    return 'other'
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of a call from MODEL_PRICING (per million tokens); unknown models are free"""
+    input_price, output_price = Config.MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelStats:
+    """EWMA latency and output throughput of one model"""
+    __slots__ = ('latency', 'tokens_per_second', 'calls')
+
+    def __init__(self):
+        self.latency = None
+        self.tokens_per_second = None
+        self.calls = 0
+
+    def update(self, latency: float, completion_tokens: int, alpha: float = 0.2) -> None:
+        tps = completion_tokens / latency if latency > 0 else None
+        if self.latency is None:
+            self.latency, self.tokens_per_second = latency, tps
+        else:
+            self.latency += alpha * (latency - self.latency)
+            if tps is not None:
+                self.tokens_per_second = tps if self.tokens_per_second is None else \
+                    self.tokens_per_second + alpha * (tps - self.tokens_per_second)
+        self.calls += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'tokens_per_second': round(self.tokens_per_second, 1) if self.tokens_per_second is not None else None,
+            'calls': self.calls
+        }
+
+
+class UsageLedger:
+    """Per-call token, cost and latency records, stored per paper and model.
+
+    Rows go to the shared SQLite usage database so reports cover all
+    workers; the in-memory ModelStats feed routing decisions without a
+    query per call and are seeded from recent rows at startup.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.USAGE_DB_PATH
+        self._conn = None  # Opened on first use, so importing the app leaves no files behind
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ModelStats] = {}
+
+    def _execute(self, query: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._connection().execute(query, params).fetchall()
+
+    def _connection(self) -> sqlite3.Connection:
+        """The database connection, opened with its schema and seeded stats on first use; caller holds the lock"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS token_usage (
+                ts REAL NOT NULL, paper_id TEXT, tenant TEXT, provider TEXT, model TEXT NOT NULL,
+                section TEXT, prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL,
+                estimated INTEGER NOT NULL, latency REAL NOT NULL, cost REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS token_usage_paper ON token_usage (paper_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS token_usage_model_ts ON token_usage (model, ts)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS deadlines (
+                ts REAL NOT NULL, paper_id TEXT, tenant TEXT, model TEXT, budget REAL NOT NULL, elapsed REAL NOT NULL,
+                met INTEGER NOT NULL, feasible INTEGER NOT NULL, adjustments INTEGER NOT NULL, outcome TEXT)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS deadlines_ts ON deadlines (ts)')
+            self._seed_stats(conn)
+            self._conn = conn
+        return self._conn
+
+    def record(self, model: str, provider: str, section: Optional[str], tenant: str, prompt_tokens: int,
+               completion_tokens: int, latency: float, estimated: bool) -> float:
+        """Store one call and update the model's running stats; returns its cost"""
+        cost = call_cost(model, prompt_tokens, completion_tokens)
+        self._execute(
+            'INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (time.time(), current_paper.get(), tenant, provider, model, section,
+             prompt_tokens, completion_tokens, int(estimated), latency, cost))
+        self._stats.setdefault(model, ModelStats()).update(latency, completion_tokens)
+        return cost
+
+    def model_stats(self, model: str) -> Optional[ModelStats]:
+        if self._conn is None:
+            self._execute('SELECT 1')  # The stats are seeded from the database
+        return self._stats.get(model)
+
+    def paper_report(self, paper_id: str, tenant: str = None) -> Dict:
+        """Tokens and cost of a paper; tenant limits it to calls billed to that tenant"""
+        query = '''SELECT model, section, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens),
+                          SUM(estimated), SUM(latency), SUM(cost)
+                   FROM token_usage WHERE paper_id = ?'''
+        params = (paper_id,)
+        if tenant is not None:
+            query, params = query + ' AND tenant = ?', params + (tenant,)
+        rows = self._execute(query + ' GROUP BY model, section', params)
+        breakdown = [
+            {'model': model, 'section': section, 'calls': calls, 'prompt_tokens': prompt, 'completion_tokens': completion,
+             'estimated_calls': estimated, 'latency': round(latency, 3), 'cost': round(cost, 6)}
+            for model, section, calls, prompt, completion, estimated, latency, cost in rows
+        ]
+        return {
+            'paper_id': paper_id,
+            'prompt_tokens': sum(row['prompt_tokens'] for row in breakdown),
+            'completion_tokens': sum(row['completion_tokens'] for row in breakdown),
+            'cost': round(sum(row['cost'] for row in breakdown), 6),
+            'breakdown': breakdown
+        }
+
+    def model_report(self, since: float = None) -> List[Dict]:
+        since = since if since is not None else time.time() - 86400
+        rows = self._execute(
+            '''SELECT model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency), SUM(cost)
+               FROM token_usage WHERE ts >= ? GROUP BY model ORDER BY SUM(cost) DESC''', (since,))
+        report = []
+        for model, calls, prompt, completion, latency, cost in rows:
+            stats = self._stats.get(model)
+            report.append({
+                'model': model, 'calls': calls, 'prompt_tokens': prompt, 'completion_tokens': completion,
+                'avg_latency': round(latency / calls, 3), 'cost': round(cost, 6),
+                'live': stats.to_dict() if stats else None
+            })
+        return report
+
+    def record_deadline(self, paper_id: str, tenant: str, model: str, budget: float, elapsed: float,
+                        feasible: bool, adjustments: int, outcome: str) -> bool:
+        """Store how a paper with a time budget did; returns whether the deadline was met"""
+        met = outcome in ('complete', 'partial') and elapsed <= budget
+        self._execute('INSERT INTO deadlines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (time.time(), paper_id, tenant, model, budget, elapsed, int(met), int(feasible),
+                       adjustments, outcome))
+        return met
+
+    def deadline_report(self, since: float = None) -> Dict:
+        """Share of deadlines met, and elapsed time as a share of the budget, overall and per model"""
+        since = since if since is not None else time.time() - 86400
+        rows = self._execute('SELECT model, budget, elapsed, met, feasible FROM deadlines WHERE ts >= ?', (since,))
+
+        def summarize(rows) -> Dict:
+            ratios = sorted(elapsed / budget for _, budget, elapsed, _, _ in rows)
+            return {
+                'papers': len(rows),
+                'met': sum(met for *_, met, _ in rows),
+                'met_rate': round(sum(met for *_, met, _ in rows) / len(rows), 3) if rows else None,
+                'infeasible': sum(1 for *_, feasible in rows if not feasible),
+                'budget_used_p50': round(ratios[len(ratios) // 2], 3) if ratios else None,
+                'budget_used_p95': round(ratios[min(len(ratios) - 1, int(0.95 * len(ratios)))], 3) if ratios else None
+            }
+
+        models = sorted({row[0] for row in rows})
+        return dict(summarize(rows), models={model: summarize([row for row in rows if row[0] == model])
+                                             for model in models})
+
+    def _seed_stats(self, conn: sqlite3.Connection, rows_per_model: int = 50) -> None:
+        """Warm the routing stats from the most recent calls of each model"""
+        rows = conn.execute(
+            '''SELECT model, latency, completion_tokens FROM (
+                   SELECT model, latency, completion_tokens, ts,
+                          ROW_NUMBER() OVER (PARTITION BY model ORDER BY ts DESC) AS n
+                   FROM token_usage WHERE estimated = 0 OR completion_tokens > 0)
+               WHERE n <= ? ORDER BY ts''', (rows_per_model,)).fetchall()
+        for model, latency, completion_tokens in rows:
+            self._stats.setdefault(model, ModelStats()).update(latency, completion_tokens)
+
+
+class RoutingPolicy:
+    """Sends cheap sections to faster or cheaper models.
+
+    Sections listed in ROUTING_CHEAP_SECTIONS (index, conclusion, references
+    by default) may be served by any of ROUTING_FAST_MODELS instead of the
+    requested model. Candidates are scored by their expected time for a
+    typical section, from observed tokens per second or latency, plus a
+    weighted price; everything else, chapters in particular, keeps the
+    model the user picked. With no fast models configured it is a no-op.
+    """
+
+    def __init__(self, ledger: UsageLedger, health=None):
+        self.ledger = ledger
+        self.health = health
+        self.cheap_sections = set(Config.ROUTING_CHEAP_SECTIONS)
+        self.fast_models = list(Config.ROUTING_FAST_MODELS)
+
+    def choose(self, requested_model: str, section: Optional[str]) -> str:
+        if not self.fast_models or section not in self.cheap_sections:
+            return requested_model
+        best_model, best_score = requested_model, self._score(requested_model)
+        for model in self.fast_models:
+            if model == requested_model or not self.healthy(model):
+                continue
+            score = self._score(model)
+            if score < best_score:
+                best_model, best_score = model, score
+        return best_model
+
+    def _score(self, model: str) -> float:
+        stats = self.ledger.model_stats(model)
+        expected_tokens = Config.ROUTING_EXPECTED_TOKENS
+        if stats and stats.tokens_per_second:
+            seconds = expected_tokens / stats.tokens_per_second
+        elif stats and stats.latency is not None:
+            seconds = stats.latency
+        else:
+            seconds = Config.ROUTING_DEFAULT_LATENCY
+        return seconds + Config.ROUTING_COST_WEIGHT * call_cost(model, 0, expected_tokens)
+
+    def healthy(self, model: str) -> bool:
+        if self.health is None:
+            return True
+        stats = self.health.export().get(model)
+        if not stats:
+            return True
+        total = stats['success'] + stats['failure']
+        return total < 5 or stats['failure'] / total < 0.5
@@ -0,0 +1,81 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """The warm-up phase of a worker, and with it the worker's readiness.
+
+    Steps run once, in order, on a background thread started right after
+    the worker boots. A failing step is logged and reported but doesn't
+    hold readiness back, and neither does warm-up running past
+    WARMUP_TIMEOUT. Steps added with repeat=True run again every
+    WARMUP_KEEPALIVE_INTERVAL seconds afterwards, e.g. to keep provider
+    connections from going idle.
+    """
+
+    def __init__(self, enabled: bool = None, timeout: int = None, keepalive_interval: int = None):
+        self.enabled = Config.WARMUP_ENABLED if enabled is None else enabled
+        self.timeout = timeout or Config.WARMUP_TIMEOUT
+        self.keepalive_interval = Config.WARMUP_KEEPALIVE_INTERVAL if keepalive_interval is None else keepalive_interval
+        self.steps: List[Tuple[str, Callable[[], object], bool]] = []
+        self.results: Dict[str, Dict] = {}
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func: Callable[[], object], repeat: bool = False) -> None:
+        self.steps.append((name, func, repeat))
+
+    def start(self) -> None:
+        """Start warming up, once per process"""
+        with self._lock:
+            if not self.enabled or self.started_at is not None:
+                return
+            self.started_at = time.monotonic()
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        if not self.enabled or self.finished_at is not None:
+            return True
+        return self.started_at is not None and time.monotonic() - self.started_at >= self.timeout
+
+    def status(self) -> Dict:
+        if not self.enabled:
+            state = 'disabled'
+        elif self.finished_at is not None:
+            state = 'complete'
+        elif self.started_at is None:
+            state = 'pending'
+        else:
+            state = 'timed_out' if self.ready else 'running'
+        return {'ready': self.ready, 'warmup': state, 'steps': dict(self.results)}
+
+    def _run(self) -> None:
+        for name, func, _ in self.steps:
+            self._step(name, func)
+        self.finished_at = time.monotonic()
+        logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s")
+        repeating = [(name, func) for name, func, repeat in self.steps if repeat]
+        while repeating and self.keepalive_interval:
+            time.sleep(self.keepalive_interval)
+            for name, func in repeating:
+                self._step(name, func, quiet=True)
+
+    def _step(self, name: str, func: Callable[[], object], quiet: bool = False) -> None:
+        start = time.monotonic()
+        try:
+            result = func()
+            self.results[name] = {'status': 'ok', 'duration': round(time.monotonic() - start, 3)}
+            if result is not None:
+                self.results[name]['result'] = result
+        except Exception as e:
+            self.results[name] = {'status': 'failed', 'duration': round(time.monotonic() - start, 3),
+                                  'error': str(e)}
+            if not quiet:
+                logger.warning(f"Warm-up step {name} failed: {str(e)}")
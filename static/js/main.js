@@ -142,6 +142,10 @@ function startGeneration(event) {
     const formData = new FormData(form);
     const queryParams = new URLSearchParams(formData);
 
+    openStream(queryParams);
+}
+
+function openStream(queryParams) {
     // Create SSE connection
     currentEventSource = new EventSource(`/api/stream?${queryParams.toString()}`);
     
@@ -155,6 +159,14 @@ function startGeneration(event) {
         if (data.status === 'aborted') {
             handleAbort();
         }
+
+        // The server is restarting; continue the same paper on another worker
+        if (data.status === 'suspended') {
+            currentEventSource.close();
+            document.getElementById('progressText').textContent = 'Server restarting, resuming...';
+            setTimeout(() => openStream(new URLSearchParams({resume: data.paper_id})), data.retry_after * 1000);
+            return;
+        }
         
         if (data.error) {
             handleError(data.error);
@@ -207,6 +219,11 @@ function showError(message) {
 }
 
 function updateProgress(data) {
+    // Waiting for a free generation slot
+    if (data.status === 'queued') {
+        document.getElementById('progressText').textContent = `Queued (position ${data.queue_position})`;
+    }
+
     // Update progress bar
     if (data.progress) {
         const progressBar = document.getElementById('progressBar');
@@ -362,7 +379,7 @@ function updateChapterProgress(chapterProgress) {
         chapterProgressBar.style.width = `${chapterProgress.percent}%`;
         
         if (chapterProgress.duration) {
-            chapterTime.textContent = `Time taken: ${chapterProgress.duration}`;
+            chapterTime.textContent = `Time taken: ${chapterProgress.duration.toFixed(1)}s`;
         }
         
         if (chapterProgress.error) {
@@ -0,0 +1,72 @@
+from services.archive import PaperArchive, fts_query, parse_paper
+
+PAPER = """# Research Paper: Climate change and glaciers
+
+## Index
+
+1. Introduction
+
+## Introduction
+
+Glaciers are retreating worldwide.
+
+## Chapter 1: Melting rates
+
+### Alpine glaciers
+
+Alpine glaciers lose a metre of ice a year.
+
+## Chapter 2: Sea level
+
+[Error generating this section: timeout]
+
+## Conclusion
+
+The ice will keep melting.
+"""
+
+
+def test_fts_query_quotes_every_word():
+    assert fts_query('glacier melting') == '"glacier" "melting"'
+    assert fts_query('sea-level AND "NOT"') == '"sea" "level" "AND" "NOT"'
+
+
+def test_fts_query_phrases_and_prefixes():
+    assert fts_query('"sea level" rise') == '"sea level" "rise"'
+    assert fts_query('glac* ab*') == '"glac"* "ab"'
+    assert fts_query('"" ""') == ''
+    assert fts_query(None) == ''
+    assert fts_query('"unterminated phrase') == '"unterminated" "phrase"'
+
+
+def test_parse_paper_subject_and_sections():
+    subject, sections = parse_paper(PAPER)
+    assert subject == 'Climate change and glaciers'
+    assert [title for title, _ in sections] == ['Introduction', 'Chapter 1: Melting rates', 'Conclusion']
+    assert sections[1][1] == "### Alpine glaciers\n\nAlpine glaciers lose a metre of ice a year."
+
+
+def test_parse_paper_without_headings():
+    assert parse_paper('') == (None, [])
+    assert parse_paper('# Plain title\n\nJust text.') == ('Plain title', [])
+
+
+def test_reindex_and_search(tmp_path):
+    papers = tmp_path / 'papers'
+    papers.mkdir()
+    (papers / 'research_paper_1.md').write_text(PAPER, encoding='utf-8')
+    (papers / 'notes.md').write_text(PAPER, encoding='utf-8')
+    archive = PaperArchive(str(tmp_path / 'archive.db'))
+    assert archive.reindex(str(papers)) == {'indexed': 1, 'unchanged': 0, 'removed': 0, 'failed': 0}
+    assert archive.reindex(str(papers))['unchanged'] == 1
+
+    found = archive.search('alpine metre')
+    assert [(r['paper_id'], r['title'], r['kind']) for r in found['results']] == \
+        [('research_paper_1', 'Chapter 1: Melting rates', 'chapter')]
+    assert '<mark>' in found['results'][0]['snippet']
+    assert archive.search('timeout')['results'] == []
+    assert archive.search('melt*')['results']
+
+    (papers / 'research_paper_1.md').unlink()
+    assert archive.reindex(str(papers))['removed'] == 1
+    assert archive.paper('research_paper_1') is None
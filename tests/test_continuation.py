@@ -0,0 +1,34 @@
+from config import Config
+from services.model_provider import WORDS_PER_TOKEN, join_continuation, token_limit
+
+TEXT = "Glaciers flow downhill under their own weight, carving valleys as they"
+
+
+def test_joins_mid_word_cut_with_a_space():
+    assert join_continuation(TEXT, "move.") == TEXT + " move."
+
+
+def test_keeps_existing_whitespace_and_punctuation():
+    assert join_continuation(TEXT + " ", "move.") == TEXT + " move."
+    assert join_continuation(TEXT, "\n\nNext paragraph.") == TEXT + "\n\nNext paragraph."
+    assert join_continuation(TEXT, ", slowly.") == TEXT + ", slowly."
+    assert join_continuation("", "Start.") == "Start."
+    assert join_continuation(TEXT, "") == TEXT
+
+
+def test_drops_repeated_overlap():
+    repeated = "under their own weight, carving valleys as they move through the mountains."
+    assert join_continuation(TEXT, repeated) == TEXT + " move through the mountains."
+    assert join_continuation(TEXT, "  " + repeated) == TEXT + " move through the mountains."
+
+
+def test_short_coincidental_overlap_is_kept():
+    assert join_continuation("The ice is thick", "thick layers of snow.") == "The ice is thick thick layers of snow."
+
+
+def test_token_limit_scales_with_words_within_bounds():
+    assert token_limit(words=900) == int(900 / WORDS_PER_TOKEN * Config.TOKEN_LIMIT_MARGIN)
+    assert token_limit('chapter') == token_limit(words=Config.SECTION_WORDS['chapter'])
+    assert token_limit(words=10) == Config.TOKEN_LIMIT_MIN
+    assert token_limit(words=100000) == Config.TOKEN_LIMIT_MAX
+    assert token_limit('index') is None
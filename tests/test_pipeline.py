@@ -0,0 +1,91 @@
+import threading
+import pytest
+from services.pipeline import Pipeline
+
+
+def run(pipeline):
+    """(name, state) of every change run() yields, in order"""
+    return [(node.name, node.state) for node in pipeline.run()]
+
+
+def test_dependencies_run_first_and_receive_results():
+    pipeline = Pipeline(max_parallel=4)
+    pipeline.add('outline', lambda inputs: ['a', 'b'])
+    pipeline.add('intro', lambda inputs: f"intro of {len(inputs['outline'])}", deps=['outline'])
+    pipeline.add('end', lambda inputs: inputs['intro'].upper(), deps=['intro'])
+    events = run(pipeline)
+    assert [name for name, state in events if state == 'done'] == ['outline', 'intro', 'end']
+    assert pipeline.nodes['end'].result == 'INTRO OF 2'
+    assert all(node.duration is not None for node in pipeline.nodes.values())
+
+
+def test_independent_nodes_run_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+    pipeline = Pipeline(max_parallel=2)
+    pipeline.add('a', lambda inputs: barrier.wait())
+    pipeline.add('b', lambda inputs: barrier.wait())
+    run(pipeline)
+    assert {node.state for node in pipeline.nodes.values()} == {'done'}
+
+
+def test_failure_skips_dependents_but_not_after():
+    def fail(inputs):
+        raise ValueError('no outline')
+
+    pipeline = Pipeline()
+    pipeline.add('outline', fail)
+    pipeline.add('chapter', lambda inputs: 'text', deps=['outline'])
+    pipeline.add('summary', lambda inputs: 'done anyway', after=['outline'])
+    events = run(pipeline)
+    assert ('outline', 'failed') in events
+    assert pipeline.nodes['chapter'].state == 'skipped'
+    assert pipeline.nodes['summary'].state == 'done'
+    assert isinstance(pipeline.nodes['outline'].error, ValueError)
+
+
+def test_nodes_added_while_running():
+    pipeline = Pipeline()
+
+    def outline(inputs):
+        for i in range(3):
+            pipeline.add(f"chapter {i}", lambda inputs, i=i: i, deps=['outline'])
+        return 'outline'
+
+    pipeline.add('outline', outline)
+    run(pipeline)
+    assert [pipeline.nodes[f"chapter {i}"].result for i in range(3)] == [0, 1, 2]
+
+
+def test_interrupt_is_reraised_after_running_nodes_finish():
+    class Suspended(BaseException):
+        pass
+
+    release = threading.Event()
+
+    def slow(inputs):
+        release.wait(5)
+        return 'finished'
+
+    def suspend(inputs):
+        release.set()
+        raise Suspended()
+
+    pipeline = Pipeline(max_parallel=2)
+    pipeline.add('slow', slow)
+    pipeline.add('suspend', suspend)
+    pipeline.add('later', lambda inputs: 'never', deps=['slow'])
+    with pytest.raises(Suspended):
+        run(pipeline)
+    assert pipeline.nodes['slow'].state == 'done'
+    assert pipeline.nodes['later'].state == 'skipped'
+
+
+def test_closing_early_cancels_pending_nodes():
+    pipeline = Pipeline(max_parallel=1)
+    pipeline.add('first', lambda inputs: 1)
+    pipeline.add('second', lambda inputs: 2, deps=['first'])
+    events = pipeline.run()
+    next(events)  # 'first' started
+    events.close()
+    assert pipeline.nodes['first'].state == 'done'
+    assert pipeline.nodes['second'].state == 'skipped'
@@ -0,0 +1,67 @@
+from services.quality import QualityGate, StreamInterrupted, StreamRelay
+
+PROMPT = "Write the introduction of a research paper about glaciers"
+GOOD = ("Glaciers are slow rivers of ice that form where more snow falls each winter than melts in summer. "
+        "Over centuries the snow compacts into dense ice, which flows downhill under its own weight and "
+        "carves valleys, moves rock and stores a large share of the fresh water on Earth. Their retreat "
+        "over the last century is one of the clearest signals of a warming climate.")
+
+gate = QualityGate(min_chars=200, max_repetition=0.5)
+
+
+def test_accepts_good_text():
+    assert gate.check(GOOD, PROMPT) is None
+
+
+def test_rejects_empty_and_short():
+    assert gate.check('', PROMPT) == 'empty'
+    assert gate.check('   \n', PROMPT) == 'empty'
+    assert gate.check("Glaciers are made of ice.", PROMPT) == 'too_short'
+    assert gate.check("1. Introduction\n2. Glaciers\n3. Conclusion", PROMPT, section='index') is None
+
+
+def test_rejects_error_pages():
+    assert gate.check("<!DOCTYPE html><html><body>Bad gateway</body></html>" + GOOD, PROMPT) == 'error_page'
+    assert gate.check('{"error": "model not found"}', PROMPT) == 'error_page'
+    assert gate.check("Rate limited, please try again later. " + GOOD, PROMPT) == 'error_page'
+
+
+def test_rejects_refusals():
+    assert gate.check("I'm sorry, but I can't help with that. " + GOOD, PROMPT) == 'refusal'
+    assert gate.check("I’m unable to write this paper. " + GOOD, PROMPT) == 'refusal'
+
+
+def test_rejects_other_script_unless_prompt_uses_it():
+    chinese = "冰川是由积雪经过长期压实而形成的巨大冰体，它们在重力作用下缓慢流动。" * 10
+    assert gate.check(chinese, PROMPT) == 'language'
+    assert gate.check(chinese, PROMPT + " (冰川研究)") is None
+
+
+def test_rejects_repetition_loops():
+    assert gate.check("The glacier moves slowly down the valley. " * 40, PROMPT) == 'repetition'
+
+
+def test_rejects_filtered_but_not_truncated():
+    assert gate.check(GOOD, PROMPT, finish_reason='content_filter') == 'content_filter'
+    assert gate.check(GOOD, PROMPT, finish_reason='length') is None
+
+
+def test_chat_replies_are_only_rejected_when_empty():
+    assert gate.check('', PROMPT, section='chat') == 'empty'
+    assert gate.check("Sorry, I don't know.", PROMPT, section='chat') is None
+    assert gate.check("<html>502 Bad Gateway</html>", PROMPT, section='chat') is None
+
+
+def test_monitor_refuses_to_restart_after_relaying():
+    sent = []
+    monitor = gate.monitor(PROMPT, section='chat', relay=StreamRelay(sent.append))
+    monitor.reset()
+    monitor.feed("Glaciers ")
+    monitor.feed("")
+    assert sent == ["Glaciers "]
+    try:
+        monitor.reset()
+    except StreamInterrupted as e:
+        assert e.sent == len("Glaciers ")
+    else:
+        raise AssertionError("reset() after relaying must raise StreamInterrupted")
@@ -0,0 +1,68 @@
+import pytest
+from services.references import format_references, parse_references, STYLES
+
+ARTICLE = {'id': 'smith2020', 'type': 'article-journal', 'title': 'Glacier retreat in the Alps',
+           'author': [{'family': 'Smith', 'given': 'Jane Ann'}, {'family': 'Doe', 'given': 'John'}],
+           'issued': {'date-parts': [[2020]]}, 'container-title': 'Journal of Glaciology',
+           'volume': '66', 'issue': '3', 'page': '100-120', 'DOI': '10.1017/jog.2020.1'}
+BOOK = {'id': 'brown2015', 'type': 'book', 'title': 'Ice and climate', 'author': [{'family': 'Brown', 'given': 'Amy'}],
+        'issued': {'date-parts': [[2015]]}, 'publisher': 'Oxford University Press'}
+
+
+def test_parse_references_from_fenced_json():
+    reply = '''Here you go:
+```json
+{"references": [
+  {"id": "a", "type": "book", "title": " Ice ", "author": [{"family": "Brown"}, {"given": "Nobody"}],
+   "issued": {"date-parts": [["2015"]]}, "publisher": "OUP", "volume": ""},
+  {"id": "b", "type": "book", "title": "", "author": []},
+  "not an object"
+]}
+```'''
+    assert parse_references(reply) == [{'id': 'a', 'type': 'book', 'title': 'Ice', 'author': [{'family': 'Brown'}],
+                                        'issued': {'date-parts': [[2015]]}, 'publisher': 'OUP'}]
+
+
+def test_parse_references_bare_list_and_defaults():
+    items = parse_references('[{"title": "Untitled work", "issued": {"date-parts": [["n.d."]]}}]')
+    assert items == [{'id': 'ref1', 'type': 'article-journal', 'title': 'Untitled work', 'author': []}]
+
+
+def test_parse_references_rejects_garbage():
+    assert parse_references('') == []
+    assert parse_references(None) == []
+    assert parse_references('No JSON here') == []
+    assert parse_references('{"references": [') == []
+    assert parse_references('{"references": "none"}') == []
+
+
+def test_format_apa():
+    assert format_references([ARTICLE], 'APA') == (
+        '- Smith, J. A., & Doe, J. (2020). Glacier retreat in the Alps. *Journal of Glaciology*, *66*(3), '
+        '100–120. https://doi.org/10.1017/jog.2020.1')
+
+
+def test_format_ieee_is_numbered_in_citation_order():
+    assert format_references([BOOK, ARTICLE], 'ieee') == (
+        '[1] A. Brown, *Ice and climate*, Oxford University Press, 2015.\n\n'
+        '[2] J. A. Smith and J. Doe, "Glacier retreat in the Alps," *Journal of Glaciology*, vol. 66, no. 3, '
+        'pp. 100–120, 2020, doi: 10.1017/jog.2020.1.')
+
+
+def test_author_date_styles_sort_alphabetically():
+    for style in STYLES:
+        if style != 'ieee':
+            entries = format_references([ARTICLE, BOOK], style).split('\n\n')
+            assert entries[0].startswith('- Brown'), style
+            assert entries[1].startswith('- Smith'), style
+
+
+def test_every_style_handles_missing_fields():
+    bare = {'id': 'x', 'type': 'webpage', 'title': 'Glacier monitoring', 'author': []}
+    for style in STYLES:
+        assert 'Glacier monitoring' in format_references([bare], style), style
+
+
+def test_unknown_style():
+    with pytest.raises(ValueError):
+        format_references([ARTICLE], 'vancouver')
@@ -0,0 +1,46 @@
+import pytest
+from services.similarity import SimilarityIndex, normalize_tokens
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SimilarityIndex(directory=str(tmp_path))
+
+
+def test_normalize_tokens_drops_stopwords_and_stems():
+    assert normalize_tokens("The Effects of Climate Change on Glaciers") == ['climate', 'change', 'glacier']
+    assert normalize_tokens("Studies of the world's economies") == ['study', 'world', 'economy']
+
+
+def test_normalize_tokens_keeps_short_words_unstemmed():
+    assert normalize_tokens("gas bus using AI") == ['gas', 'bus', 'ai']
+
+
+def test_best_match_finds_near_duplicate_subject(index):
+    index.add_paper('p1', "Climate change and glaciers", 'model', {'chapters': []}, [], tenant='t1')
+    paper_id, score = index._best_match('paper', "The effects of climate change on glaciers", 0.8, 't1')
+    assert paper_id == 'p1'
+    assert score == 1.0
+
+
+def test_best_match_ignores_other_tenants_and_kinds(index):
+    outline = {'chapters': [{'title': 'Melting rates'}]}
+    index.add_paper('p1', "Climate change and glaciers", 'model', outline, [], tenant='t1')
+    assert index._best_match('paper', "Climate change and glaciers", 0.8, 't2') is None
+    assert index._best_match('section', "Climate change and glaciers", 0.8, 't1') is None
+    key = SimilarityIndex.section_key("Climate change and glaciers", 'Melting rates')
+    assert index._best_match('section', key, 0.8, 't1') == ('p1', 1.0)
+
+
+def test_best_match_below_threshold(index):
+    index.add_paper('p1', "Climate change and glaciers", 'model', {'chapters': []}, [], tenant='t1')
+    assert index._best_match('paper', "Medieval trade routes in Europe", 0.5, 't1') is None
+    assert index._best_match('paper', "", 0.5, 't1') is None
+
+
+def test_find_paper_loads_payload(index):
+    index.add_paper('p1', "Climate change and glaciers", 'model', {'chapters': []},
+                    [['Introduction', 'Text']], tenant='t1')
+    payload, score = index.find_paper("climate change glaciers", tenant='t1')
+    assert payload['paper_id'] == 'p1'
+    assert payload['sections'] == [['Introduction', 'Text']]
@@ -0,0 +1,111 @@
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import mimetypes
+import logging
+from typing import Dict
+from flask import Response, request, send_file, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # Optional; assets are then only precompressed with gzip
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+DIST_FOLDER = os.path.join(STATIC_FOLDER, 'dist')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def compress(data: bytes) -> Dict[str, bytes]:
+    """Precompressed variants of data, keyed by content coding"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+def preferred_encoding(available) -> str:
+    """Best content coding the client accepts among the available ones, '' for identity"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings.quality(encoding) > 0:
+            return encoding
+    return ''
+
+
+def build(static_folder: str = STATIC_FOLDER, dist_folder: str = DIST_FOLDER) -> Dict[str, str]:
+    """Fingerprint every static file into dist_folder, with .gz/.br variants and a manifest"""
+    shutil.rmtree(dist_folder, ignore_errors=True)  # Drop builds of older versions
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root).startswith(os.path.abspath(dist_folder)):
+            continue
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(dist_folder, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            for encoding, compressed in compress(data).items():
+                # Not worth a variant when compression doesn't pay off
+                if len(compressed) < len(data):
+                    with open(f"{target}.{'gz' if encoding == 'gzip' else 'br'}", 'wb') as f:
+                        f.write(compressed)
+            manifest[logical] = fingerprinted
+    with open(os.path.join(dist_folder, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    """Maps static files to their fingerprinted, precompressed builds.
+
+    Without a build (e.g. in development) assets fall back to Flask's
+    plain static route.
+    """
+
+    def __init__(self, dist_folder: str = DIST_FOLDER):
+        self.dist_folder = dist_folder
+        try:
+            with open(os.path.join(dist_folder, 'manifest.json'), encoding='utf-8') as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            logger.info("No asset build found, serving static files unfingerprinted")
+            self.files = {}
+        self.version = hashlib.sha1(json.dumps(self.files, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def url(self, filename: str) -> str:
+        if filename in self.files:
+            return url_for('views.asset', filename=self.files[filename])
+        return url_for('static', filename=filename)
+
+    def send(self, filename: str) -> Response:
+        """Serve a fingerprinted file, precompressed when the client accepts it"""
+        path = safe_join(self.dist_folder, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        suffixes = {'br': '.br', 'gzip': '.gz'}
+        encoding = preferred_encoding([e for e, suffix in suffixes.items() if os.path.isfile(path + suffix)])
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(path + suffixes[encoding] if encoding else path, mimetype=mimetype, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    for logical, fingerprinted in build().items():
+        logger.info(f"{logical} -> {fingerprinted}")
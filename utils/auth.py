@@ -0,0 +1,23 @@
+import hmac
+from functools import wraps
+from flask import abort, request
+from config import Config
+
+
+def is_admin() -> bool:
+    """True when the request carries the configured admin token.
+
+    Only as a header: query strings end up in access logs and Referer headers.
+    """
+    token = request.headers.get('X-Admin-Token') or ''
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), Config.ADMIN_TOKEN.encode('utf-8'))
+
+
+def admin_required(f):
+    """Restrict a view to callers presenting ADMIN_TOKEN"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not is_admin():
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated
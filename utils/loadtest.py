@@ -0,0 +1,95 @@
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import requests
+
+SUBJECTS = ('coral reef bleaching', 'graph neural networks', 'urban heat islands', 'protein folding',
+            'monetary policy', 'battery recycling', 'soil microbiomes', 'quantum error correction')
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+
+def run_one(session: requests.Session, args, index: int) -> Dict:
+    subject = SUBJECTS[index % len(SUBJECTS)] if args.repeat else f"{random.choice(SUBJECTS)} #{index}"
+    body = {'model': args.model, 'stream': args.stream,
+            'messages': [{'role': 'user', 'content': f"Write two paragraphs about {subject}."}]}
+    headers = {'Authorization': f"Bearer {args.key}"} if args.key else {}
+    if not args.cache:
+        headers['Cache-Control'] = 'no-cache'
+    start = time.monotonic()
+    first = None
+    try:
+        response = session.post(f"{args.url.rstrip('/')}/v1/chat/completions", json=body, headers=headers,
+                                stream=args.stream, timeout=args.timeout)
+        if args.stream:
+            for line in response.iter_lines():
+                if line.startswith(b'data: ') and b'"content": "' in line and first is None \
+                        and b'"content": ""' not in line:
+                    first = time.monotonic() - start
+        else:
+            response.content
+        return {'status': response.status_code, 'latency': time.monotonic() - start, 'first': first,
+                'cache': response.headers.get('X-Cache')}
+    except requests.RequestException as e:
+        return {'status': type(e).__name__, 'latency': time.monotonic() - start, 'first': None, 'cache': None}
+
+
+def main(argv: List[str] = None) -> None:
+    """python -m utils.loadtest: drive /v1/chat/completions of a local server and report latencies.
+
+    Runs cheaply against AI_PROVIDER=replay with REPLAY_SPEED=0, or for
+    real against the built-in g4f providers.
+    """
+    parser = argparse.ArgumentParser(prog='python -m utils.loadtest', description=main.__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--key', help='Gateway API key, one of GATEWAY_API_KEYS')
+    parser.add_argument('-n', '--requests', type=int, default=100)
+    parser.add_argument('-c', '--concurrency', type=int, default=10)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--cache', action='store_true', help='Allow cached answers (sent with no-cache otherwise)')
+    parser.add_argument('--repeat', action='store_true', help='Cycle through a few prompts instead of unique ones')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args(argv)
+
+    local = threading.local()
+
+    def task(index: int) -> Dict:
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return run_one(local.session, args, index)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(task, range(args.requests)))
+    elapsed = time.monotonic() - start
+
+    ok = [r for r in results if r['status'] == 200]
+    latencies = [r['latency'] for r in ok]
+    print(f"requests      {len(results)} in {elapsed:.1f}s, {len(results) / elapsed:.1f}/s")
+    statuses = {}
+    for r in results:
+        statuses[r['status']] = statuses.get(r['status'], 0) + 1
+    print(f"status        {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str))}")
+    if latencies:
+        print(f"latency       p50 {percentile(latencies, 0.5):.3f}s  p95 {percentile(latencies, 0.95):.3f}s"
+              f"  max {max(latencies):.3f}s")
+    firsts = [r['first'] for r in ok if r['first'] is not None]
+    if firsts:
+        print(f"first token   p50 {percentile(firsts, 0.5):.3f}s  p95 {percentile(firsts, 0.95):.3f}s")
+    hits = sum(1 for r in ok if r['cache'] == 'HIT')
+    if not args.stream:
+        print(f"cache hits    {hits}/{len(ok)}")
+    if len(ok) < len(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterator, Optional
+from config import Config
+
+# The paper generation or HTTP request a record belongs to, and the provider call within it
+current_task = contextvars.ContextVar('current_task', default=None)
+current_span = contextvars.ContextVar('current_span', default=None)
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(task_id)s %(span_id)s] %(message)s'
+_listener: Optional[QueueListener] = None
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def span() -> Iterator[str]:
+    """Tag the records logged inside with a span id of their own"""
+    token = current_span.set(new_id())
+    try:
+        yield current_span.get()
+    finally:
+        current_span.reset(token)
+
+
+def in_span(func):
+    """Run each call of func in a span of its own"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with span():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of each logger's records below WARNING, as set in LOG_SAMPLE_RATES.
+
+    Rates apply to a logger and its children, the most specific name
+    winning; warnings and errors are never sampled away.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._resolved.get(record.name)
+        if rate is None:
+            matches = [name for name in self.rates if record.name == name or record.name.startswith(f"{name}.")]
+            rate = self.rates[max(matches, key=len)] if matches else 1.0
+            self._resolved[record.name] = rate
+        return rate >= 1.0 or random.random() < rate
+
+
+class DuplicateFilter(logging.Filter):
+    """Lets an identical record from the same line through once per window.
+
+    The next one after the window carries how many were suppressed in
+    'repeated'. Runs on the listener thread only, so it needs no lock.
+    """
+
+    def __init__(self, window: float):
+        super().__init__()
+        self.window = window
+        self._seen: Dict[tuple, list] = {}  # key -> [first seen, suppressed since]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.lineno, record.getMessage())
+        entry = self._seen.get(key)
+        if entry is not None and record.created - entry[0] < self.window:
+            entry[1] += 1
+            return False
+        if entry is not None and entry[1]:
+            record.repeated = entry[1]
+        self._seen[key] = [record.created, 0]
+        if len(self._seen) > 10000:
+            cutoff = record.created - self.window
+            self._seen = {k: v for k, v in self._seen.items() if v[0] >= cutoff}
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    """Hands records to the listener thread without blocking the caller.
+
+    Only the ids the caller's context holds are captured here; the
+    message, including any lazy %-style arguments, is formatted and
+    written on the listener. Those arguments must therefore not change
+    once logged. Records that don't fit in the queue are dropped and
+    counted on the next one that does.
+    """
+
+    def __init__(self, log_queue: queue.Queue, context: Dict[str, contextvars.ContextVar] = None):
+        super().__init__(log_queue)
+        self.context = context or {}
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.task_id = current_task.get()
+        record.span_id = current_span.get()
+        for name, var in self.context.items():
+            setattr(record, name, var.get())
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 + getattr(record, 'dropped', 0)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the context ids where set"""
+    FIELDS = ('task_id', 'span_id', 'tenant', 'paper_id', 'repeated', 'dropped')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(context: Dict[str, contextvars.ContextVar] = None) -> None:
+    """Send every record through a queue to a writer thread; only the first call has an effect.
+
+    context names further context variables to record, e.g. the tenant.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if Config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    output.addFilter(DuplicateFilter(Config.LOG_DEDUP_WINDOW))
+    handler = ContextQueueHandler(queue.Queue(Config.LOG_QUEUE_SIZE), context)
+    handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_RATES))
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(Config.LOG_LEVEL)
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flushes what is still queued
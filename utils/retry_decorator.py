@@ -2,7 +2,7 @@ import time
 import random
 from functools import wraps
 
-def retry(max_retries=3, initial_delay=1, backoff_factor=2):
+def retry(max_retries=3, initial_delay=1, backoff_factor=2, on_retry=None, giveup_on=()):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -14,10 +14,14 @@ def retry(max_retries=3, initial_delay=1, backoff_factor=2):
                     return func(*args, **kwargs)
                 except (SystemExit, KeyboardInterrupt):
                     raise
+                except giveup_on:
+                    raise  # Retrying the same call would not help
                 except Exception as e:
                     retries += 1
                     if retries >= max_retries:
                         raise  # Re-raise the last exception if max retries reached
+                    if on_retry:
+                        on_retry(e, retries)
                     
                     # Exponential backoff with some randomness
                     time.sleep(delay + random.uniform(0, 0.5))
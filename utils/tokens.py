@@ -0,0 +1,49 @@
+import re
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to the regex approximation
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and single punctuation marks: close to BPE counts for English prose
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+WORDS_PER_TOKEN = 0.75  # English prose
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # The encoding file may not be cached locally and there may be no network
+            logger.warning(f"tiktoken unavailable, approximating token counts: {str(e)}")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally, with tiktoken when available"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_APPROX_TOKEN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ''
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    matches = list(_APPROX_TOKEN.finditer(text))
+    return text if len(matches) <= max_tokens else text[:matches[max_tokens - 1].end()]